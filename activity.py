@@ -0,0 +1,163 @@
+# activity.py - 用户活动日志：进程内缓冲，后台线程批量写入
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from flask import request, has_request_context
+from sqlalchemy import insert
+
+from exts import db
+from model import UserActivity
+
+logger = logging.getLogger(__name__)
+
+# 保护 fork 后的重新初始化：新 worker 里并发的请求线程只能有一个去重建缓冲区和后台线程
+_start_lock = threading.Lock()
+
+
+class ActivityLogger:
+    """请求线程只把事件追加到有界缓冲区（不碰数据库），
+    后台线程每隔 N 毫秒或攒够 M 条时一次多行INSERT写入。
+    缓冲区满时丢弃新事件并计数，绝不阻塞请求"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = False
+        self._pid = None
+        self._thread = None
+        self._stopping = False
+        self._reset()
+        if app is not None:
+            self.init_app(app)
+
+    def _reset(self):
+        self._buffer = deque()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._flush_lock = threading.Lock()
+        self.logged = 0
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+        self.flushes = 0
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get('ACTIVITY_LOG_ENABLED', True)
+        self.capacity = app.config.get('ACTIVITY_BUFFER_SIZE', 10000)
+        self.flush_interval = app.config.get('ACTIVITY_FLUSH_INTERVAL_MS', 500) / 1000
+        self.flush_batch = app.config.get('ACTIVITY_FLUSH_BATCH', 200)
+        app.extensions['activity_logger'] = self
+        atexit.register(self.shutdown)
+
+    def _ensure_thread(self):
+        # fork 之后线程和锁不会被继承，在新进程里重新初始化（双重检查，只初始化一次）
+        if self._pid == os.getpid():
+            return
+        with _start_lock:
+            if self._pid == os.getpid():
+                return
+            self._reset()
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name='activity-flusher', daemon=True)
+            self._thread.start()
+            # 最后才设置：其他线程看到本进程的pid时缓冲区和线程都已就绪
+            self._pid = os.getpid()
+
+    def log(self, activity_type, user_id, target_type=None, target_id=None,
+            ip_address=None, user_agent=None):
+        """记录一条活动，返回是否进入缓冲区"""
+        if not self.enabled or not user_id:
+            return False
+        self._ensure_thread()
+
+        row = {
+            'user_id': user_id,
+            'activity_type': activity_type,
+            'target_type': target_type,
+            'target_id': target_id,
+            'ip_address': ip_address,
+            'user_agent': user_agent,
+            'created_at': datetime.utcnow(),
+        }
+        with self._lock:
+            if len(self._buffer) >= self.capacity:
+                self.dropped += 1
+                return False
+            self._buffer.append(row)
+            self.logged += 1
+            pending = len(self._buffer)
+        if pending >= self.flush_batch:
+            self._wakeup.set()
+        return True
+
+    def _run(self):
+        while not self._stopping:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """把缓冲区中的事件全部写入数据库，返回写入条数"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._buffer:
+                    return 0
+                rows = list(self._buffer)
+                self._buffer.clear()
+
+            written = 0
+            try:
+                with self.app.app_context():
+                    with db.engine.begin() as conn:
+                        for start in range(0, len(rows), self.flush_batch):
+                            conn.execute(insert(UserActivity.__table__),
+                                         rows[start:start + self.flush_batch])
+                            written += min(self.flush_batch, len(rows) - start)
+                self.written += written
+                self.flushes += 1
+            except Exception:
+                # 写入失败的事件直接丢弃，避免缓冲区无限重试膨胀
+                self.failed += len(rows)
+                logger.exception('写入用户活动日志失败，丢弃 %d 条', len(rows))
+            return written
+
+    def shutdown(self, timeout=5.0):
+        """停止后台线程并写完剩余事件（worker退出时调用）"""
+        if self._pid != os.getpid():
+            return
+        self._stopping = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        deadline = time.monotonic() + timeout
+        while self._buffer and time.monotonic() < deadline:
+            if not self.flush():
+                break
+
+    def stats(self):
+        return {
+            'pending': len(self._buffer),
+            'logged': self.logged,
+            'written': self.written,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'flushes': self.flushes,
+        }
+
+
+activity_logger = ActivityLogger()
+
+
+def log_activity(activity_type, user_id, target_type=None, target_id=None):
+    """在请求中记录活动，自动带上IP和User-Agent"""
+    ip_address = user_agent = None
+    if has_request_context():
+        # 可信代理的 X-Forwarded-For 已由 ProxyFix 换到 remote_addr
+        ip_address = (request.remote_addr or '')[:45] or None
+        user_agent = request.headers.get('User-Agent')
+    return activity_logger.log(activity_type, user_id, target_type, target_id, ip_address, user_agent)
@@ -1,17 +1,38 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory, session
+from flask import Flask, Blueprint, current_app, request, jsonify, send_from_directory, session, Response, stream_with_context
 import config
 from exts import db, migrate
-from model import User, CampusMemory, Diary, MemoryComment, MemoryLike, Notification
+from model import User, CampusMemory, Diary, DiaryRevision, MemoryComment, MemoryLike, Notification
+from revisions import DeltaError, apply_delta, record_revision, content_at
+from moderation import moderator, record_flag
+from availability import FIELDS as AVAILABILITY_FIELDS, availability_index
+from storage import save_upload
+from fileserve import serve_upload
+from cache import TTLCache
+from activity import activity_logger, log_activity
+from ratelimit import rate_limit
+from trending import bump, score_at
+from jobs import enqueue
+from changelog import init_changelog, log_change, changes_since, settled_token, token_expired, latest_change
+from sqlalchemy.orm import joinedload
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy.exc import IntegrityError
+from timeline import fetch_timeline
+from building_summary import catalog, memory_added, memory_removed, memory_changed, preview_payload
+from geo import nearest_buildings
+from campus import init_campus, current_campus
+from compression import init_compression
+from conditional import conditional, building_feed_fingerprint, comments_fingerprint, notifications_fingerprint, \
+    profiles_changed
+from pages import page_cache, static_max_age
+from commands import LazyCommandGroup
+from werkzeug.middleware.proxy_fix import ProxyFix
 import base64
+import hmac
 import os
 import json
 from datetime import datetime
-from werkzeug.utils import secure_filename
 
 
-app = Flask(__name__)
-app.config.from_object(config)
-
 # === Railway 环境检测 ===
 IS_RAILWAY = 'RAILWAY_ENVIRONMENT' in os.environ
 IS_PRODUCTION = os.environ.get('ENVIRONMENT') == 'production'
@@ -19,24 +40,28 @@ IS_PRODUCTION = os.environ.get('ENVIRONMENT') == 'production'
 # 设置基本路径
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
-# === 配置上传目录 ===
-UPLOAD_FOLDER = os.path.join(BASE_DIR, 'uploads')
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
-
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# 所有页面和接口都注册在这个蓝图上，由 create_app() 挂到应用
+bp = Blueprint('main', __name__)
 
 # === 静态文件和上传文件路由 ===
-@app.route('/static/<path:filename>')
+@bp.route('/static/<path:filename>')
 def serve_static(filename):
-    return send_from_directory(os.path.join(BASE_DIR, 'static'), filename)
-
-@app.route('/uploads/<filename>')
+    max_age = static_max_age(filename)
+    response = send_from_directory(os.path.join(BASE_DIR, 'static'), filename, max_age=max_age)
+    if max_age:
+        response.headers['Cache-Control'] += ', immutable'
+    return response
+
+# 上传文件：支持Range、条件GET，可交给前置代理发送
+# （上传目录由存储后端在第一次写入时创建）
+@bp.route('/uploads/<path:filename>')
 def uploaded_file(filename):
-    return send_from_directory(UPLOAD_FOLDER, filename)
+    return serve_upload(filename)
+
 
-db.init_app(app)
-migrate.init_app(app, db)
+def diary_overview_cache():
+    """日记概览缓存（按用户），带着生成时该用户日记的最新变更id，有新的变更即失效"""
+    return current_app.extensions['diary_overview_cache']
 
 # 允许的头像扩展名
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
@@ -45,24 +70,32 @@ def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+def admin_authorized():
+    """运维接口：请求头 X-Admin-Token 与配置的 ADMIN_TOKEN 一致（未配置时一律拒绝）"""
+    token = current_app.config.get('ADMIN_TOKEN')
+    provided = request.headers.get('X-Admin-Token', '')
+    return bool(token) and hmac.compare_digest(provided.encode(), token.encode())
+
+
 # ========== 页面路由 ==========
-@app.route('/')
+# 页面在启动时预渲染（见 pages.py），请求时直接返回内存中的结果
+@bp.route('/')
 def index():
-    return render_template('index.html')
+    return page_cache.serve('index')
 
-@app.route('/campus')
+@bp.route('/campus')
 def campus():
-    return render_template('校园记忆.html')
+    return page_cache.serve('campus')
 
-@app.route('/my-bupt')
+@bp.route('/my-bupt')
 def my_bupt():
-    return render_template('my-bupt.html')
+    return page_cache.serve('my_bupt')
 
 
 
 # ========== API路由 ==========
 # API: 检查登录状态
-@app.route('/api/check-login', methods=['GET'])
+@bp.route('/api/check-login', methods=['GET'])
 def check_login():
     user_id = session.get('user_id')
     if user_id:
@@ -77,7 +110,8 @@ def check_login():
 
 
 # API: 用户注册
-@app.route('/api/register', methods=['POST'])
+@bp.route('/api/register', methods=['POST'])
+@rate_limit('register')
 def register():
     try:
         data = request.json
@@ -96,12 +130,11 @@ def register():
         if len(data['password']) < 6:
             return jsonify({'success': False, 'message': '密码至少6个字符'})
 
-        # 检查用户名是否已存在
-        if User.query.filter_by(username=data['username']).first():
+        # 检查用户名、学号是否已存在（内存索引确定没被占用的不查数据库）
+        if availability_index.is_taken('username', data['username']):
             return jsonify({'success': False, 'message': '用户名已存在'})
 
-        # 检查学号是否已存在
-        if User.query.filter_by(student_id=data['student_id']).first():
+        if availability_index.is_taken('student_id', data['student_id']):
             return jsonify({'success': False, 'message': '该学号已注册'})
 
         # 创建新用户
@@ -113,10 +146,19 @@ def register():
         new_user.set_password(data['password'])
 
         db.session.add(new_user)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # 索引还没同步到的注册（其他worker刚注册、并发注册），由唯一约束拦下
+            db.session.rollback()
+            if User.query.filter_by(username=data['username']).first():
+                return jsonify({'success': False, 'message': '用户名已存在'})
+            return jsonify({'success': False, 'message': '该学号已注册'})
+        availability_index.add(new_user)
 
         # 注册后自动登录
         session['user_id'] = new_user.id
+        log_activity('register', new_user.id, 'user', new_user.id)
 
         return jsonify({
             'success': True,
@@ -128,8 +170,27 @@ def register():
         return jsonify({'success': False, 'message': f'注册失败：{str(e)}'})
 
 
+# API: 注册表单实时检查用户名/学号是否可用
+@bp.route('/api/check-availability')
+@rate_limit('availability')
+def check_availability():
+    try:
+        available = {}
+        for field in AVAILABILITY_FIELDS:
+            value = request.args.get(field, '').strip()
+            if value:
+                available[field] = not availability_index.is_taken(field, value)
+        if not available:
+            return jsonify({'success': False, 'message': '请提供用户名或学号'})
+        # 只是提示：提交注册时仍以数据库的唯一约束为准
+        return jsonify({'success': True, 'available': available})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'检查失败：{str(e)}'})
+
+
 # API: 用户登录
-@app.route('/api/login', methods=['POST'])
+@bp.route('/api/login', methods=['POST'])
+@rate_limit('login')
 def login():
     try:
         data = request.json
@@ -144,10 +205,7 @@ def login():
             return jsonify({'success': False, 'message': '请输入用户名和密码'})
 
         # 查找用户（支持用户名或学号登录）
-        user = User.query.filter(
-            (User.username == username) |
-            (User.student_id == username)
-        ).first()
+        user = availability_index.find_user(username)
 
         if not user:
             return jsonify({'success': False, 'message': '用户不存在'})
@@ -161,6 +219,7 @@ def login():
         # 更新最后登录时间
         user.last_login = datetime.utcnow()
         db.session.commit()
+        log_activity('login', user.id, 'user', user.id)
 
         return jsonify({
             'success': True,
@@ -172,7 +231,7 @@ def login():
 
 
 # API: 更新个人资料
-@app.route('/api/update-profile', methods=['POST'])
+@bp.route('/api/update-profile', methods=['POST'])
 def update_profile():
     try:
         user_id = session.get('user_id')
@@ -206,6 +265,10 @@ def update_profile():
                 user.gender = data.get('gender', user.gender)
                 user.college = data.get('college', user.college)
 
+        # 记忆流、评论里内嵌了昵称和头像，修改后它们的ETag要失效
+        state = db.inspect(user).attrs
+        if state.nickname.history.has_changes() or state.avatar.history.has_changes():
+            profiles_changed()
         db.session.commit()
         return jsonify({
             'success': True,
@@ -218,23 +281,25 @@ def update_profile():
 
 
 # API: 用户登出
-@app.route('/api/logout', methods=['POST'])
+@bp.route('/api/logout', methods=['POST'])
 def logout():
-    session.pop('user_id', None)
+    user_id = session.pop('user_id', None)
+    log_activity('logout', user_id, 'user', user_id)
     return jsonify({'success': True, 'message': '已退出登录'})
 
 
 # ========== 校园记忆API路由 ==========
 
 # API: 获取某个建筑的记忆列表
-@app.route('/api/campus/memories/<building>', methods=['GET'])
+@bp.route('/api/campus/memories/<building>', methods=['GET'])
+@conditional(building_feed_fingerprint)
 def get_building_memories(building):
     try:
         # 分页支持
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 20, type=int)
 
-        memories = CampusMemory.query.filter_by(building=building) \
+        memories = CampusMemory.in_campus(current_campus()).filter_by(building=building) \
             .order_by(CampusMemory.created_at.desc()) \
             .paginate(page=page, per_page=per_page, error_out=False)
 
@@ -271,7 +336,7 @@ def get_building_memories(building):
 
 
 # API: 提交新记忆（支持图片上传）
-@app.route('/api/campus/memories', methods=['POST'])
+@bp.route('/api/campus/memories', methods=['POST'])
 def submit_memory():
     try:
         user_id = session.get('user_id')
@@ -292,30 +357,39 @@ def submit_memory():
         if not content and 'images' not in request.files:
             return jsonify({'success': False, 'message': '请输入回忆内容或添加图片'})
 
+        # 敏感词过滤：block 直接拒绝（在保存图片之前），mask 替换后保存，flag 保存并记录待审核
+        moderation = moderator.check(content)
+        if moderation.blocked:
+            return jsonify({'success': False, 'message': '内容包含不当词语，请修改后再提交'})
+        content = moderation.text
+
         # 处理图片上传
         image_files = request.files.getlist('images')
         image_data_list = []
 
         for image_file in image_files[:3]:  # 最多3张图片
             if image_file and image_file.filename and allowed_file(image_file.filename):
-                # 保存图片到uploads目录
-                filename = secure_filename(f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{user_id}_{image_file.filename}")
-                filepath = os.path.join('uploads', filename)
-                image_file.save(filepath)
-
-                # 存储相对路径
-                image_data_list.append(f"/uploads/{filename}")
+                # 边写盘边计算哈希，按内容去重存储
+                image_data_list.append(save_upload(image_file))
 
         # 创建新记忆
+        campus = current_campus()
         new_memory = CampusMemory(
+            campus=campus,
             building=building,
             content=content,
             user_id=user_id,
-            images=json.dumps(image_data_list) if image_data_list else '[]'
+            images=json.dumps(image_data_list) if image_data_list else '[]',
+            hot_score=score_at('post')
         )
 
         db.session.add(new_memory)
+        memory_added(new_memory)
+        if moderation.flagged:
+            db.session.flush()
+            record_flag(moderation, 'memory', new_memory.id, user_id)
         db.session.commit()
+        log_activity('add_memory', user_id, 'memory', new_memory.id)
 
         return jsonify({
             'success': True,
@@ -328,14 +402,14 @@ def submit_memory():
 
 
 # API: 删除记忆（只能删除自己的）
-@app.route('/api/campus/memories/<int:memory_id>', methods=['DELETE'])
+@bp.route('/api/campus/memories/<int:memory_id>', methods=['DELETE'])
 def delete_memory(memory_id):
     try:
         user_id = session.get('user_id')
         if not user_id:
             return jsonify({'success': False, 'message': '请先登录'})
 
-        memory = CampusMemory.query.get(memory_id)
+        memory = CampusMemory.in_campus(current_campus()).filter_by(id=memory_id).first()
         if not memory:
             return jsonify({'success': False, 'message': '记忆不存在'})
 
@@ -343,7 +417,12 @@ def delete_memory(memory_id):
         if memory.user_id != user_id:
             return jsonify({'success': False, 'message': '只能删除自己的记忆'})
 
-        db.session.delete(memory)
+        # 软删除：立即从所有列表中隐藏。点赞、评论、通知和图片引用
+        # 由后台任务在宽限期后分批删除，请求不受关联数据量影响
+        memory.deleted_at = datetime.utcnow()
+        memory_removed(memory)
+        enqueue('purge.memory', {'memory_id': memory.id}, key=f'purge.memory:{memory.id}',
+                priority=-10, delay=current_app.config.get('PURGE_GRACE_SECONDS', 300))
         db.session.commit()
 
         return jsonify({'success': True, 'message': '删除成功'})
@@ -353,14 +432,15 @@ def delete_memory(memory_id):
 
 
 # API: 点赞记忆
-@app.route('/api/campus/memories/<int:memory_id>/like', methods=['POST'])
+@bp.route('/api/campus/memories/<int:memory_id>/like', methods=['POST'])
+@rate_limit('like')
 def like_memory(memory_id):
     try:
         user_id = session.get('user_id')
         if not user_id:
             return jsonify({'success': False, 'message': '请先登录'})
 
-        memory = CampusMemory.query.get(memory_id)
+        memory = CampusMemory.in_campus(current_campus()).filter_by(id=memory_id).first()
         if not memory:
             return jsonify({'success': False, 'message': '记忆不存在'})
 
@@ -373,12 +453,15 @@ def like_memory(memory_id):
             # 取消点赞
             db.session.delete(existing_like)
             memory.likes_count = max(0, memory.likes_count - 1)
+            # 按点赞当时的贡献值扣回
+            bump(memory_id, 'like', when=existing_like.created_at, sign=-1)
             message = '取消点赞成功'
         else:
             # 添加点赞
             new_like = MemoryLike(memory_id=memory_id, user_id=user_id)
             db.session.add(new_like)
             memory.likes_count += 1
+            bump(memory_id, 'like')
             message = '点赞成功'
 
             # 创建通知（如果不是给自己的记忆点赞）
@@ -392,7 +475,10 @@ def like_memory(memory_id):
                 )
                 db.session.add(notification)
 
+        memory_changed(memory)
         db.session.commit()
+        if not existing_like:
+            log_activity('like', user_id, 'memory', memory_id)
 
         return jsonify({
             'success': True,
@@ -405,7 +491,8 @@ def like_memory(memory_id):
 
 
 # API: 添加评论
-@app.route('/api/campus/memories/<int:memory_id>/comments', methods=['POST'])
+@bp.route('/api/campus/memories/<int:memory_id>/comments', methods=['POST'])
+@rate_limit('comment')
 def add_comment(memory_id):
     try:
         user_id = session.get('user_id')
@@ -416,7 +503,7 @@ def add_comment(memory_id):
         if not data or 'content' not in data:
             return jsonify({'success': False, 'message': '评论内容不能为空'})
 
-        memory = CampusMemory.query.get(memory_id)
+        memory = CampusMemory.in_campus(current_campus()).filter_by(id=memory_id).first()
         if not memory:
             return jsonify({'success': False, 'message': '记忆不存在'})
 
@@ -424,6 +511,11 @@ def add_comment(memory_id):
         if not content:
             return jsonify({'success': False, 'message': '评论内容不能为空'})
 
+        moderation = moderator.check(content)
+        if moderation.blocked:
+            return jsonify({'success': False, 'message': '内容包含不当词语，请修改后再提交'})
+        content = moderation.text
+
         # 添加评论
         new_comment = MemoryComment(
             memory_id=memory_id,
@@ -433,7 +525,11 @@ def add_comment(memory_id):
         )
 
         db.session.add(new_comment)
+        if moderation.flagged:
+            db.session.flush()
+            record_flag(moderation, 'comment', new_comment.id, user_id)
         memory.comments_count += 1
+        bump(memory_id, 'comment')
 
         # 创建通知（如果不是给自己的记忆评论）
         if memory.user_id != user_id:
@@ -448,7 +544,9 @@ def add_comment(memory_id):
             )
             db.session.add(notification)
 
+        memory_changed(memory)
         db.session.commit()
+        log_activity('comment', user_id, 'comment', new_comment.id)
 
         return jsonify({
             'success': True,
@@ -462,12 +560,16 @@ def add_comment(memory_id):
 
 
 # API: 获取记忆的评论
-@app.route('/api/campus/memories/<int:memory_id>/comments', methods=['GET'])
+@bp.route('/api/campus/memories/<int:memory_id>/comments', methods=['GET'])
+@conditional(comments_fingerprint)
 def get_memory_comments(memory_id):
     try:
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 20, type=int)
 
+        if not CampusMemory.in_campus(current_campus()).filter_by(id=memory_id).count():
+            return jsonify({'success': False, 'message': '记忆不存在'})
+
         comments = MemoryComment.query.filter_by(memory_id=memory_id) \
             .order_by(MemoryComment.created_at.asc()) \
             .paginate(page=page, per_page=per_page, error_out=False)
@@ -483,47 +585,137 @@ def get_memory_comments(memory_id):
         return jsonify({'success': False, 'message': f'获取评论失败：{str(e)}'})
 
 
-# API: 获取所有建筑列表（用于统计）
-@app.route('/api/campus/buildings', methods=['GET'])
+# API: 热门记忆（全校或某个建筑），按热度索引倒序扫描
+@bp.route('/api/campus/trending', methods=['GET'])
+def get_trending_memories():
+    try:
+        building = request.args.get('building', '').strip()
+        limit = max(1, min(request.args.get('limit', 20, type=int), 50))
+        cursor = request.args.get('cursor', '')
+
+        query = CampusMemory.in_campus(current_campus()).options(joinedload(CampusMemory.user))
+        if building:
+            query = query.filter(CampusMemory.building == building)
+
+        # 游标分页：上一页最后一条的 (热度, id)
+        if cursor:
+            score, _, last_id = cursor.partition(':')
+            score, last_id = float(score), int(last_id)
+            query = query.filter(db.or_(
+                CampusMemory.hot_score < score,
+                db.and_(CampusMemory.hot_score == score, CampusMemory.id < last_id)
+            ))
+
+        memories = query.order_by(CampusMemory.hot_score.desc(), CampusMemory.id.desc()) \
+            .limit(limit + 1).all()
+        has_more = len(memories) > limit
+        memories = memories[:limit]
+
+        next_cursor = None
+        if has_more:
+            last = memories[-1]
+            next_cursor = f'{last.hot_score!r}:{last.id}'
+
+        return jsonify({
+            'success': True,
+            'memories': [memory.to_frontend_dict() for memory in memories],
+            'next_cursor': next_cursor
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'获取热门记忆失败：{str(e)}'})
+
+
+# API: 全校时间线（可按建筑、学院筛选），游标分页
+@bp.route('/api/campus/timeline', methods=['GET'])
+def get_campus_timeline():
+    try:
+        # 去重（保持顺序）并限制个数：每个建筑是 UNION ALL 里的一个子查询
+        buildings = list(dict.fromkeys(b.strip() for b in request.args.get('buildings', '').split(',') if b.strip()))
+        if len(buildings) > current_app.config['TIMELINE_MAX_BUILDINGS']:
+            return jsonify({'success': False,
+                            'message': f'最多同时筛选{current_app.config["TIMELINE_MAX_BUILDINGS"]}个建筑'})
+        colleges = [c for c in request.args.get('colleges', '').split(',') if c.strip()]
+        limit = max(1, min(request.args.get('limit', 20, type=int), 50))
+        cursor = request.args.get('cursor') or None
+
+        memories, next_cursor = fetch_timeline(current_campus(), buildings, colleges, cursor, limit)
+        return jsonify({
+            'success': True,
+            'memories': memories,
+            'next_cursor': next_cursor
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'获取时间线失败：{str(e)}'})
+
+
+# API: 获取当前校区的建筑列表（用于统计）
+@bp.route('/api/campus/buildings', methods=['GET'])
 def get_buildings():
     try:
-        # 获取有记忆的建筑
-        buildings = db.session.query(
-            CampusMemory.building,
-            db.func.count(CampusMemory.id).label('memory_count')
-        ).group_by(CampusMemory.building).all()
-
-        building_list = [{'name': b[0], 'count': b[1]} for b in buildings]
-
-        # 默认建筑列表（即使没有记忆也显示）
-        default_buildings = [
-            '体育场', '教学实验综合楼', '图书馆', '宿舍楼', '礼堂',
-            '学生餐厅', '校园湖', '马克思主义学院', '工程实验楼',
-            '理学院', '智能工程与自动化学院', '数字媒体与艺术设计学院',
-            '网络空间安全学院', '学生活动中心', '教职工食堂', '天猫超市'
-        ]
-
-        # 合并数据
-        building_data = []
-        for building in default_buildings:
-            count = next((b['count'] for b in building_list if b['name'] == building), 0)
-            building_data.append({
-                'name': building,
-                'count': count,
-                'has_memories': count > 0
-            })
+        # 建筑目录和记忆数都在建筑表里（提交、删除记忆时增量维护）
+        building_data = [{
+            'name': b.name,
+            'count': b.memories_count or 0,
+            'has_memories': bool(b.memories_count)
+        } for b in catalog(current_campus())]
 
         return jsonify({
             'success': True,
             'buildings': building_data,
-            'total_memories': sum(b['count'] for b in building_list)
+            'total_memories': sum(b['count'] for b in building_data)
         })
     except Exception as e:
         return jsonify({'success': False, 'message': f'获取建筑列表失败：{str(e)}'})
 
 
+# API: 地图页的全部建筑预览（预先生成，带ETag）
+@bp.route('/api/campus/buildings/preview', methods=['GET'])
+def get_buildings_preview():
+    try:
+        etag, body = preview_payload(current_campus())
+        if request.if_none_match.contains(etag):
+            response = current_app.response_class(status=304)
+        else:
+            response = current_app.response_class(body, mimetype='application/json')
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'获取建筑预览失败：{str(e)}'})
+
+
+# API: 附近的建筑和它们的最新记忆（空间索引找最近的建筑，时间线一次取回记忆）
+@bp.route('/api/campus/nearby', methods=['GET'])
+def get_nearby():
+    try:
+        lat = request.args.get('lat', type=float)
+        lon = request.args.get('lon', type=float)
+        if lat is None or lon is None or not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            return jsonify({'success': False, 'message': '请提供有效的经纬度'})
+        k = max(1, min(request.args.get('k', current_app.config['NEARBY_BUILDINGS'], type=int), 10))
+        radius = request.args.get('radius', current_app.config['NEARBY_RADIUS_METERS'], type=float)
+        limit = max(1, min(request.args.get('limit', 20, type=int), 50))
+        cursor = request.args.get('cursor') or None
+
+        campus = current_campus()
+        nearby = nearest_buildings(campus, lat, lon, k, radius)
+        buildings = [dict(building, distance=round(distance)) for distance, building in nearby]
+        memories, next_cursor = [], None
+        if buildings:
+            memories, next_cursor = fetch_timeline(
+                campus, [b['name'] for b in buildings], None, cursor, limit)
+        return jsonify({
+            'success': True,
+            'buildings': buildings,
+            'memories': memories,
+            'next_cursor': next_cursor
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'获取附近的记忆失败：{str(e)}'})
+
+
 # API: 获取用户的所有记忆
-@app.route('/api/campus/user-memories', methods=['GET'])
+@bp.route('/api/campus/user-memories', methods=['GET'])
 def get_user_memories():
     try:
         user_id = session.get('user_id')
@@ -533,7 +725,7 @@ def get_user_memories():
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 10, type=int)
 
-        memories = CampusMemory.query.filter_by(user_id=user_id) \
+        memories = CampusMemory.in_campus(current_campus()).filter_by(user_id=user_id) \
             .order_by(CampusMemory.created_at.desc()) \
             .paginate(page=page, per_page=per_page, error_out=False)
 
@@ -548,10 +740,90 @@ def get_user_memories():
         return jsonify({'success': False, 'message': f'获取用户记忆失败：{str(e)}'})
 
 
+# API: 导出个人数据（流式输出，ndjson 或 zip）
+@bp.route('/api/export', methods=['GET'])
+def export_data():
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({'success': False, 'message': '请先登录'})
+
+    fmt = request.args.get('format', 'zip')
+    if fmt not in ('ndjson', 'zip'):
+        return jsonify({'success': False, 'message': '不支持的导出格式'})
+
+    stamp = datetime.utcnow().strftime('%Y%m%d%H%M%S')
+    if fmt == 'zip':
+        from export import iter_zip
+        body, mimetype = iter_zip(user_id), 'application/zip'
+    else:
+        from export import iter_ndjson
+        body, mimetype = iter_ndjson(user_id), 'application/x-ndjson'
+
+    # 生成器在请求上下文内执行，数据库会话在整个传输过程中保持可用
+    return Response(stream_with_context(body), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename="export_{user_id}_{stamp}.{fmt}"',
+        'Cache-Control': 'no-store'
+    })
+
+
 # ========== 日记功能API路由 ==========
 
+# API: 日记概览（每个地点的日记数和最新一篇预览，一次查询）
+@bp.route('/api/bupt/diaries/overview', methods=['GET'])
+def get_diary_overview():
+    try:
+        user_id = session.get('user_id')
+        if not user_id:
+            return jsonify({'success': False, 'message': '请先登录'})
+
+        campus = current_campus()
+        # 缓存在各worker内存里，写操作可能发生在其他worker：每次用该用户日记的最新变更id
+        # （新建、修改、删除都会记一条，id不复用）确认缓存仍然有效，保证能读到自己刚写的内容
+        fingerprint = latest_change('diary', user_id, campus)
+        cached = diary_overview_cache().get((campus, user_id))
+        if cached is not None and cached[0] == fingerprint:
+            return jsonify(cached[1])
+
+        # 窗口函数：同一地点内按时间倒序编号并计数，只取每个地点的第一行
+        ranked = db.session.query(
+            Diary.id,
+            Diary.location,
+            db.func.substr(Diary.content, 1, 101).label('preview'),
+            Diary.created_at,
+            db.func.count(Diary.id).over(partition_by=Diary.location).label('diary_count'),
+            db.func.row_number().over(
+                partition_by=Diary.location,
+                order_by=(Diary.created_at.desc(), Diary.id.desc())
+            ).label('rn')
+        ).filter(Diary.campus == campus, Diary.user_id == user_id).subquery()
+
+        rows = db.session.query(ranked).filter(ranked.c.rn == 1).all()
+
+        locations = {}
+        for row in rows:
+            locations[row.location] = {
+                'count': row.diary_count,
+                'latest': {
+                    'id': row.id,
+                    'preview': row.preview[:100],
+                    'has_more': len(row.preview) > 100,
+                    'created_at': row.created_at.strftime('%Y-%m-%d %H:%M:%S') if row.created_at else None
+                }
+            }
+
+        result = {
+            'success': True,
+            'locations': locations,
+            'total': sum(item['count'] for item in locations.values())
+        }
+        diary_overview_cache().set((campus, user_id), (fingerprint, result))
+        return jsonify(result)
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'获取日记概览失败：{str(e)}'})
+
+
 # API: 获取某个地点的日记列表
-@app.route('/api/bupt/diaries/<location>', methods=['GET'])
+@bp.route('/api/bupt/diaries/<location>', methods=['GET'])
 def get_location_diaries(location):
     try:
         user_id = session.get('user_id')
@@ -561,7 +833,7 @@ def get_location_diaries(location):
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 20, type=int)
 
-        diaries = Diary.query.filter_by(location=location, user_id=user_id) \
+        diaries = Diary.query.filter_by(campus=current_campus(), user_id=user_id, location=location) \
             .order_by(Diary.created_at.desc()) \
             .paginate(page=page, per_page=per_page, error_out=False)
 
@@ -577,7 +849,7 @@ def get_location_diaries(location):
 
 
 # API: 创建新日记
-@app.route('/api/bupt/diaries', methods=['POST'])
+@bp.route('/api/bupt/diaries', methods=['POST'])
 def create_diary():
     try:
         user_id = session.get('user_id')
@@ -599,6 +871,7 @@ def create_diary():
 
         # 创建新日记
         new_diary = Diary(
+            campus=current_campus(),
             location=location,
             content=content,
             user_id=user_id
@@ -606,6 +879,7 @@ def create_diary():
 
         db.session.add(new_diary)
         db.session.commit()
+        log_activity('add_diary', user_id, 'diary', new_diary.id)
 
         return jsonify({
             'success': True,
@@ -618,14 +892,14 @@ def create_diary():
 
 
 # API: 获取日记详情
-@app.route('/api/bupt/diaries/detail/<int:diary_id>', methods=['GET'])
+@bp.route('/api/bupt/diaries/detail/<int:diary_id>', methods=['GET'])
 def get_diary_detail(diary_id):
     try:
         user_id = session.get('user_id')
         if not user_id:
             return jsonify({'success': False, 'message': '请先登录'})
 
-        diary = Diary.query.get(diary_id)
+        diary = Diary.query.filter_by(id=diary_id, campus=current_campus()).first()
         if not diary:
             return jsonify({'success': False, 'message': '日记不存在'})
 
@@ -641,15 +915,110 @@ def get_diary_detail(diary_id):
         return jsonify({'success': False, 'message': f'获取日记详情失败：{str(e)}'})
 
 
+# API: 修改日记。请求体带 base_version（客户端所基于的版本）和 content（全文）
+# 或 delta（相对 base_version 的补丁，格式见 revisions.py）；版本不一致时返回409和最新内容
+@bp.route('/api/bupt/diaries/<int:diary_id>', methods=['PATCH'])
+def update_diary(diary_id):
+    try:
+        user_id = session.get('user_id')
+        if not user_id:
+            return jsonify({'success': False, 'message': '请先登录'})
+
+        data = request.json
+        if not data or not isinstance(data.get('base_version'), int):
+            return jsonify({'success': False, 'message': '缺少基础版本号'})
+        if ('content' in data) == ('delta' in data):
+            return jsonify({'success': False, 'message': '请提供 content 或 delta 之一'})
+
+        diary = Diary.query.filter_by(id=diary_id, campus=current_campus()).first()
+        if not diary:
+            return jsonify({'success': False, 'message': '日记不存在'})
+
+        # 检查权限：只能修改自己的日记
+        if diary.user_id != user_id:
+            return jsonify({'success': False, 'message': '只能修改自己的日记'})
+
+        if data['base_version'] != diary.version:
+            return jsonify({
+                'success': False,
+                'conflict': True,
+                'message': '日记已在其他地方被修改',
+                'diary': diary.to_dict()
+            }), 409
+
+        delta = data.get('delta')
+        try:
+            content = apply_delta(diary.content, delta) if delta is not None else str(data['content'])
+        except DeltaError as e:
+            return jsonify({'success': False, 'message': f'补丁与基础版本不匹配：{str(e)}'}), 400
+        if not content.strip():
+            return jsonify({'success': False, 'message': '日记内容不能为空'})
+        location = (data.get('location') or diary.location).strip()
+
+        if content == diary.content and location == diary.location:
+            return jsonify({'success': True, 'message': '没有修改', 'version': diary.version})
+
+        if content != diary.content:
+            record_revision(diary, diary.content, content, delta)
+        diary.content = content
+        diary.location = location
+        # version 由ORM加一，UPDATE 带上旧版本号作为条件
+        db.session.commit()
+
+        return jsonify({
+            'success': True,
+            'message': '日记已保存',
+            'version': diary.version,
+            'updated_at': diary.updated_at.strftime('%Y-%m-%d %H:%M:%S')
+        })
+    except StaleDataError:
+        # 读取之后、提交之前被另一个请求改过
+        db.session.rollback()
+        return jsonify({'success': False, 'conflict': True, 'message': '日记已在其他地方被修改'}), 409
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': f'保存日记失败：{str(e)}'})
+
+
+# API: 日记的修订历史；带 version 参数时返回该版本的内容
+@bp.route('/api/bupt/diaries/<int:diary_id>/revisions', methods=['GET'])
+def get_diary_revisions(diary_id):
+    try:
+        user_id = session.get('user_id')
+        if not user_id:
+            return jsonify({'success': False, 'message': '请先登录'})
+
+        diary = Diary.query.filter_by(id=diary_id, campus=current_campus()).first()
+        if not diary or diary.user_id != user_id:
+            return jsonify({'success': False, 'message': '日记不存在'})
+
+        version = request.args.get('version', type=int)
+        if version is not None:
+            content = content_at(diary, version)
+            if content is None:
+                return jsonify({'success': False, 'message': '该版本不存在或已合并'})
+            return jsonify({'success': True, 'version': version, 'content': content})
+
+        revisions = DiaryRevision.query.filter_by(diary_id=diary.id) \
+            .order_by(DiaryRevision.version.desc()).all()
+        return jsonify({
+            'success': True,
+            'current_version': diary.version,
+            'revisions': [revision.to_dict() for revision in revisions]
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'获取修订历史失败：{str(e)}'})
+
+
 # API: 删除日记
-@app.route('/api/bupt/diaries/<int:diary_id>', methods=['DELETE'])
+@bp.route('/api/bupt/diaries/<int:diary_id>', methods=['DELETE'])
 def delete_diary(diary_id):
     try:
         user_id = session.get('user_id')
         if not user_id:
             return jsonify({'success': False, 'message': '请先登录'})
 
-        diary = Diary.query.get(diary_id)
+        diary = Diary.query.filter_by(id=diary_id, campus=current_campus()).first()
         if not diary:
             return jsonify({'success': False, 'message': '日记不存在'})
 
@@ -657,6 +1026,7 @@ def delete_diary(diary_id):
         if diary.user_id != user_id:
             return jsonify({'success': False, 'message': '只能删除自己的日记'})
 
+        DiaryRevision.query.filter_by(diary_id=diary.id).delete()
         db.session.delete(diary)
         db.session.commit()
 
@@ -669,7 +1039,8 @@ def delete_diary(diary_id):
 # ========== 通知功能API路由 ==========
 
 # API: 获取用户的通知
-@app.route('/api/notifications', methods=['GET'])
+@bp.route('/api/notifications', methods=['GET'])
+@conditional(notifications_fingerprint)
 def get_notifications():
     try:
         user_id = session.get('user_id')
@@ -680,6 +1051,7 @@ def get_notifications():
         per_page = request.args.get('per_page', 20, type=int)
 
         notifications = Notification.query.filter_by(user_id=user_id) \
+            .filter(Notification.not_hidden()) \
             .order_by(Notification.created_at.desc()) \
             .paginate(page=page, per_page=per_page, error_out=False)
 
@@ -689,14 +1061,15 @@ def get_notifications():
             'total': notifications.total,
             'page': notifications.page,
             'pages': notifications.pages,
-            'unread_count': Notification.query.filter_by(user_id=user_id, is_read=False).count()
+            'unread_count': Notification.query.filter_by(user_id=user_id, is_read=False)
+                .filter(Notification.not_hidden()).count()
         })
     except Exception as e:
         return jsonify({'success': False, 'message': f'获取通知失败：{str(e)}'})
 
 
 # API: 标记通知为已读
-@app.route('/api/notifications/<int:notification_id>/read', methods=['POST'])
+@bp.route('/api/notifications/<int:notification_id>/read', methods=['POST'])
 def mark_notification_read(notification_id):
     try:
         user_id = session.get('user_id')
@@ -721,15 +1094,16 @@ def mark_notification_read(notification_id):
 
 
 # API: 清空所有通知
-@app.route('/api/notifications/clear', methods=['POST'])
+@bp.route('/api/notifications/clear', methods=['POST'])
 def clear_notifications():
     try:
         user_id = session.get('user_id')
         if not user_id:
             return jsonify({'success': False, 'message': '请先登录'})
 
-        # 删除该用户的所有通知
+        # 删除该用户的所有通知（批量删除不经过flush，单独记一条变更）
         Notification.query.filter_by(user_id=user_id).delete()
+        log_change('notification', 'clear', user_id=user_id)
         db.session.commit()
 
         return jsonify({'success': True, 'message': '已清空所有通知'})
@@ -738,49 +1112,131 @@ def clear_notifications():
         return jsonify({'success': False, 'message': f'清空失败：{str(e)}'})
 
 
-# ========== 文件服务 ==========
+# ========== 增量同步API路由 ==========
+
+SYNC_ENTITIES = ('memory', 'diary', 'notification')
+
+
+# API: 增量同步。不带 since 时只返回当前令牌（客户端先全量加载）；
+# 带 since 时返回之后新增、修改、删除的记忆（当前校区）、日记和通知（当前用户）。
+# 记忆被删除时，引用它的通知客户端也应一并隐藏（与通知列表一致）
+@bp.route('/api/sync', methods=['GET'])
+def sync_changes():
+    try:
+        user_id = session.get('user_id')
+        entities = [e for e in request.args.get('types', ','.join(SYNC_ENTITIES)).split(',')
+                    if e in SYNC_ENTITIES]
+        if not user_id:
+            entities = [e for e in entities if e == 'memory']
+        if not entities:
+            return jsonify({'success': False, 'message': '请先登录'})
 
-# 提供上传的文件访问
-@app.route('/uploads/<filename>')
-def serve_uploaded_file(filename):
-    return send_from_directory('uploads', filename)
+        since = request.args.get('since', '')
+        if not since:
+            response = jsonify({'success': True, 'token': str(settled_token())})
+        elif not since.isdigit() or token_expired(int(since)):
+            # 令牌无效或对应的变更已被清理，客户端需要全量刷新
+            response = jsonify({'success': True, 'reset': True, 'token': str(settled_token())})
+        else:
+            token, has_more, changes = changes_since(int(since), current_campus(), user_id, entities)
+            response = jsonify({
+                'success': True,
+                'reset': False,
+                'token': str(token),
+                'has_more': has_more,
+                'changes': changes
+            })
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'同步失败：{str(e)}'})
+
+
+# API: 汇总最近的性能剖析结果（最热的函数），需要管理员令牌
+@bp.route('/api/admin/profiles', methods=['GET'])
+def get_profiles():
+    try:
+        if not admin_authorized():
+            return jsonify({'success': False, 'message': '权限不足'}), 403
+        directory = current_app.config.get('PROFILE_DIR')
+        if not directory:
+            return jsonify({'success': False, 'message': '未启用性能剖析（PROFILE_DIR）'})
+
+        from profiling import list_profiles, aggregate
+        endpoint = request.args.get('endpoint') or None
+        limit = max(1, min(request.args.get('limit', 200, type=int), 2000))
+        top = max(1, min(request.args.get('top', 20, type=int), 100))
+        return jsonify({'success': True, **aggregate(list_profiles(directory, endpoint, limit), top)})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'汇总剖析结果失败：{str(e)}'})
 
 
 # 健康检查
-@app.route('/health')
+@bp.route('/health')
 def health_check():
-    return jsonify({'status': 'healthy', 'timestamp': datetime.utcnow().isoformat()})
+    return jsonify({
+        'status': 'healthy',
+        'timestamp': datetime.utcnow().isoformat(),
+        'activity_log': activity_logger.stats()
+    })
 
 
 # 错误处理
-@app.errorhandler(404)
+@bp.app_errorhandler(404)
 def not_found(error):
     return jsonify({'success': False, 'message': '请求的资源不存在'}), 404
 
 
-@app.errorhandler(500)
+@bp.app_errorhandler(500)
 def internal_error(error):
     db.session.rollback()
     return jsonify({'success': False, 'message': '服务器内部错误'}), 500
 
 
-if __name__ == '__main__':
-    with app.app_context():
-        # 创建数据库表（如果不存在）
-        db.create_all()
-    app.run(host='0.0.0.0', port=8080, debug=True)
 
-# 在文件末尾修改
-if __name__ == '__main__':
-    # 创建必要目录
-    if not os.path.exists('uploads'):
-        os.makedirs('uploads')
+# ========== 应用工厂 ==========
+def create_app(config_object=config):
+    """创建应用。导入和初始化都不连接数据库、不写文件，
+    可以在 gunicorn --preload 的主进程里执行，worker 之后 fork 出来共享内存"""
+    app = Flask(__name__, static_folder=None)  # 静态文件由 serve_static 提供
+    app.config.from_object(config_object)
+    # 运维命令在被调用时才导入对应模块
+    app.cli = LazyCommandGroup()
+
+    db.init_app(app)
+    migrate.init_app(app, db)
+    activity_logger.init_app(app)
+    init_compression(app)
+    init_changelog(app)
+    moderator.init_app(app)
+    if app.config.get('TRAFFIC_RECORD_DIR'):
+        from traffic import traffic_recorder
+        traffic_recorder.init_app(app)
+    if app.config.get('PROFILE_DIR'):
+        from profiling import request_profiler
+        request_profiler.init_app(app)
+    app.extensions['diary_overview_cache'] = TTLCache(
+        maxsize=2048, ttl=app.config['DIARY_OVERVIEW_CACHE_TTL'])
+
+    app.register_blueprint(bp)
+    if app.config.get('TRUSTED_PROXY_COUNT'):
+        # 只取可信代理追加的 X-Forwarded-For 作为 remote_addr，客户端伪造的部分被忽略
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXY_COUNT'])
+    # 最外层：先按子域名或 /c/<校区> 前缀确定校区，再交给其余中间件和路由
+    init_campus(app)
+
+    # 路由注册完之后再预渲染页面（模板里的 url_for 需要完整的路由表）
+    if app.config['PAGES_PRERENDER']:
+        page_cache.build(app)
+    return app
+
+
+# gunicorn app:app
+app = create_app()
 
-    # 初始化数据库
-    with app.app_context():
-        db.create_all()
 
-    # 使用Railway提供的端口
+if __name__ == '__main__':
+    # 表结构由 flask db upgrade 管理，这里只负责启动开发服务器
     port = int(os.environ.get("PORT", 8080))
     debug = not IS_PRODUCTION  # 生产环境关闭debug
-    app.run(host='0.0.0.0', port=port, debug=debug)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=port, debug=debug)
@@ -0,0 +1,130 @@
+# availability.py - 用户名/学号占用索引：注册表单实时检查、注册预检、登录查找
+#
+# 每个worker在内存里维护一个布隆过滤器，装着所有已注册的用户名和学号：
+#   过滤器说"没有"  （几乎）没被占用，不查数据库；
+#   过滤器说"可能有" 再按对应列的唯一索引精确查一次（误判率 AVAILABILITY_FP_RATE）。
+# worker 启动时（gunicorn post_fork）或第一次使用时从 users 表全量构建；本worker注册的用户立即加入，
+# 其他worker注册的每隔 AVAILABILITY_REFRESH_SECONDS 秒增量补进来。
+# 自增id的分配顺序和提交顺序可能不同（并发注册、flask import users 分批提交），
+# 所以增量不是只看 id > 水位，而是从 AVAILABILITY_SETTLE_SECONDS 之前的水位开始重扫（同 changelog 的令牌）。
+# 过滤器仍可能落后，所以"可用"只是提示：注册以 users 表的唯一约束为准，登录总是查数据库。
+# 用户名和学号都不能修改、用户也不会被删除，过滤器只增不减。
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import select, func
+
+from bloom import BloomFilter
+from exts import db
+from model import User
+
+FIELDS = ('username', 'student_id')
+
+
+def _key(field, value):
+    return f'{field}:{value}'
+
+
+class AvailabilityIndex:
+    def __init__(self):
+        self.bloom = None
+        self.high_water = 0  # 已装入过滤器的最大用户id
+        self._marks = deque()  # (时间, 当时的水位)，只保留重扫窗口需要的
+        self._refreshed_at = 0.0
+        self._lock = threading.Lock()
+
+    def _add(self, bloom, username, student_id):
+        # 重扫会再次遇到已装入的用户：已经在过滤器里的键不再计数，容量按实际用户数消耗
+        for key in (_key('username', username), _key('student_id', student_id)):
+            if key not in bloom:
+                bloom.add(key)
+
+    def _build(self):
+        config = current_app.config
+        count = db.session.execute(select(func.count(User.id))).scalar()
+        # 每个用户两个键，预留余量；装满后下次刷新时按新的用户数重建
+        bloom = BloomFilter(2 * (count + config.get('AVAILABILITY_HEADROOM', 10000)),
+                            config.get('AVAILABILITY_FP_RATE', 0.001))
+        recent = datetime.utcnow() - timedelta(seconds=config.get('AVAILABILITY_SETTLE_SECONDS', 10))
+        high_water = 0
+        floor = None
+        rows = db.session.execute(
+            select(User.id, User.username, User.student_id, User.created_at)
+            .execution_options(yield_per=5000))
+        for user_id, username, student_id, created_at in rows:
+            self._add(bloom, username, student_id)
+            high_water = max(high_water, user_id)
+            if created_at is not None and created_at >= recent:
+                floor = user_id - 1 if floor is None else min(floor, user_id - 1)
+        self.bloom, self.high_water = bloom, high_water
+        # 最近注册的用户前面可能还有没提交的事务，第一次重扫从它们开始
+        self._marks = deque([(time.monotonic(), high_water if floor is None else floor)])
+
+    def _catch_up(self):
+        """从 SETTLE 秒前的水位开始重扫（主键范围扫描，通常只有最近注册的几行）"""
+        settle = current_app.config.get('AVAILABILITY_SETTLE_SECONDS', 10)
+        now = time.monotonic()
+        while len(self._marks) > 1 and self._marks[1][0] <= now - settle:
+            self._marks.popleft()
+        floor = self._marks[0][1]
+        rows = db.session.execute(
+            select(User.id, User.username, User.student_id).where(User.id > floor)
+        ).all()
+        for user_id, username, student_id in rows:
+            self._add(self.bloom, username, student_id)
+            self.high_water = max(self.high_water, user_id)
+        if self.high_water != self._marks[-1][1]:
+            self._marks.append((now, self.high_water))
+
+    def refresh(self):
+        """到了刷新间隔时构建/增量更新，返回当前的过滤器；
+        另一个线程正在刷新时直接返回旧的，还没构建好时返回 None（调用方查数据库）"""
+        interval = current_app.config.get('AVAILABILITY_REFRESH_SECONDS', 2)
+        now = time.monotonic()
+        if self.bloom is not None and now - self._refreshed_at < interval:
+            return self.bloom
+        if self._lock.acquire(blocking=False):
+            try:
+                if self.bloom is None or self.bloom.count > self.bloom.capacity:
+                    self._build()
+                else:
+                    self._catch_up()
+            except Exception:
+                current_app.logger.exception('刷新用户名索引失败')
+            finally:
+                self._refreshed_at = now
+                self._lock.release()
+        return self.bloom
+
+    def might_exist(self, field, value):
+        """False 表示（在过滤器的时效内）没被占用"""
+        bloom = self.refresh()
+        return bloom is None or _key(field, value) in bloom
+
+    def is_taken(self, field, value):
+        if not self.might_exist(field, value):
+            return False
+        column = getattr(User, field)
+        return db.session.execute(select(User.id).where(column == value).limit(1)).first() is not None
+
+    def add(self, user):
+        """本worker注册成功后调用。不推进水位：比它小的id可能是其他worker刚注册的"""
+        bloom = self.bloom
+        if bloom is not None:
+            self._add(bloom, user.username, user.student_id)
+
+    def find_user(self, identifier):
+        """按用户名或学号找用户，每次只走一个唯一索引，代替 username = ? OR student_id = ?。
+        过滤器只决定先查哪一列（通常一次命中）；它可能落后，另一列照样要查"""
+        fields = sorted(FIELDS, key=lambda field: not self.might_exist(field, identifier))
+        for field in fields:
+            user = User.query.filter(getattr(User, field) == identifier).first()
+            if user is not None:
+                return user
+        return None
+
+
+availability_index = AvailabilityIndex()
@@ -0,0 +1,54 @@
+# bloom.py - 布隆过滤器：判断"一定不在集合里"，内存占用与集合大小线性、与元素长度无关
+import hashlib
+import math
+
+
+class BloomFilter:
+    """k 个哈希位由一次 blake2b 的两个 64 位值按双重哈希生成。
+    might_contain 返回 False 时元素一定没加入过；返回 True 时有 fp_rate 的概率误判"""
+
+    def __init__(self, capacity, fp_rate=0.001):
+        capacity = max(1, int(capacity))
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self.num_bits = max(8, int(-capacity * math.log(fp_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        if isinstance(item, str):
+            item = item.encode('utf-8')
+        digest = hashlib.blake2b(item, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, item):
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def update(self, items):
+        for item in items:
+            self.add(item)
+
+    def might_contain(self, item):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+    __contains__ = might_contain
+
+    @property
+    def size_bytes(self):
+        return len(self.bits)
+
+    def to_bytes(self):
+        return bytes(self.bits)
+
+    @classmethod
+    def from_bytes(cls, data, capacity, fp_rate=0.001):
+        bloom = cls(capacity, fp_rate)
+        if len(data) != len(bloom.bits):
+            raise ValueError('位数组长度与容量、误判率不匹配')
+        bloom.bits = bytearray(data)
+        return bloom
@@ -0,0 +1,196 @@
+# building_summary.py - 预先生成的建筑预览（地图页一次取回全部建筑）
+#
+# 记忆数在提交/删除记忆时原子加减；预览只在新记忆进入（或被删的记忆在）最新几条时重新生成。
+# 点赞、评论只在这条记忆正显示在预览里时重新生成预览（预览里有它的点赞/评论数），否则不碰建筑行。
+# flask buildings sync 全量重算，用于校正和导入数据之后。
+import hashlib
+import json
+import threading
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy.exc import IntegrityError
+
+from campus import campus_config
+from exts import db
+from model import Building, CampusMemory, User
+
+# 每个建筑预览里的最新记忆条数
+PREVIEW_SIZE = 3
+
+# 校区 -> {'fingerprint', 'etag', 'body'}
+_payload_cache = {}
+_payload_lock = threading.Lock()
+
+
+def _image_url(campus, name):
+    prefix = campus_config(campus).get('image_prefix', f'/static/campuses/{campus}/')
+    return f'{prefix}{name}.jpg'
+
+
+def _get_or_create(campus, name):
+    building = Building.query.filter_by(campus=campus, name=name).first()
+    if building is not None:
+        return building
+    try:
+        with db.session.begin_nested():
+            building = Building(campus=campus, name=name, image_url=_image_url(campus, name),
+                                memories_count=0, diaries_count=0, preview='{}')
+            db.session.add(building)
+    except IntegrityError:
+        building = Building.query.filter_by(campus=campus, name=name).first()
+    return building
+
+
+def _preview(campus, name):
+    """最新 PREVIEW_SIZE 条记忆和封面图（沿 campus, building, created_at 索引取前几行）"""
+    rows = db.session.query(
+        CampusMemory.id, CampusMemory.content, CampusMemory.images,
+        CampusMemory.likes_count, CampusMemory.comments_count, CampusMemory.created_at,
+        User.nickname, User.username
+    ).join(User, User.id == CampusMemory.user_id) \
+        .filter(CampusMemory.campus == campus, CampusMemory.building == name,
+                CampusMemory.deleted_at.is_(None)) \
+        .order_by(CampusMemory.created_at.desc(), CampusMemory.id.desc()) \
+        .limit(PREVIEW_SIZE).all()
+
+    latest = []
+    cover = None
+    for row in rows:
+        images = json.loads(row.images) if row.images else []
+        if cover is None and images:
+            cover = images[0]
+        latest.append({
+            'id': row.id,
+            'content': row.content[:60],
+            'image': images[0] if images else None,
+            'name': row.nickname or row.username,
+            'likes_count': row.likes_count,
+            'comments_count': row.comments_count,
+            'time': row.created_at.strftime('%m-%d %H:%M') if row.created_at else ''
+        })
+    return json.dumps({'cover': cover, 'latest': latest}, ensure_ascii=False)
+
+
+def _adjust_count(campus, name, delta):
+    # 在数据库里原子加减，不读出再写回
+    Building.query.filter_by(campus=campus, name=name).update(
+        {Building.memories_count: Building.memories_count + delta}, synchronize_session=False)
+
+
+def memory_added(memory):
+    """新记忆提交时调用（调用方事务内）：计数加一；新记忆一定是最新的一条，重新生成预览"""
+    building = _get_or_create(memory.campus, memory.building)
+    _adjust_count(memory.campus, memory.building, 1)
+    db.session.flush()  # 预览查询要看到这条新记忆
+    building.preview = _preview(memory.campus, memory.building)
+    return building
+
+
+def _refresh_if_previewed(memory):
+    """这条记忆正显示在建筑预览里时重新生成预览"""
+    building = Building.query.filter_by(campus=memory.campus, name=memory.building).first()
+    if building is None:
+        return None
+    preview = json.loads(building.preview) if building.preview else {}
+    if any(item.get('id') == memory.id for item in preview.get('latest', [])):
+        db.session.flush()
+        building.preview = _preview(memory.campus, memory.building)
+    return building
+
+
+def memory_removed(memory):
+    """记忆删除时调用（调用方事务内）：计数减一；只有它在预览里时才重新生成预览"""
+    _adjust_count(memory.campus, memory.building, -1)
+    return _refresh_if_previewed(memory)
+
+
+def memory_changed(memory):
+    """点赞、取消点赞、评论后调用（调用方事务内）：只有它在预览里时才重新生成预览"""
+    return _refresh_if_previewed(memory)
+
+
+def refresh_building(campus, name):
+    """全量重算一个建筑的计数和预览（COUNT 随建筑的记忆数线性增长，只用于 flask buildings sync）"""
+    building = _get_or_create(campus, name)
+    building.memories_count = db.session.query(db.func.count(CampusMemory.id)) \
+        .filter(CampusMemory.campus == campus, CampusMemory.building == name,
+                CampusMemory.deleted_at.is_(None)).scalar()
+    building.preview = _preview(campus, name)
+    return building
+
+
+def sync_buildings(campus):
+    """按配置补齐校区的建筑目录（顺序以配置为准），并重算全部预览"""
+    catalog = campus_config(campus).get('buildings', [])
+    names = set(catalog)
+    names.update(name for (name,) in db.session.query(CampusMemory.building)
+                 .filter(CampusMemory.campus == campus).distinct())
+    for name in sorted(names):
+        refresh_building(campus, name)
+    order = {name: i for i, name in enumerate(catalog)}
+    coordinates = campus_config(campus).get('coordinates', {})
+    for building in Building.query.filter_by(campus=campus):
+        if building.name in order:
+            building.position = order[building.name]
+        if building.name in coordinates:
+            building.latitude, building.longitude = coordinates[building.name]
+    db.session.commit()
+    return len(names)
+
+
+def catalog(campus):
+    """校区的建筑目录（按 position、名称排序）。
+    还没有同步过目录（没有一个建筑有顺序）时按配置初始化一次"""
+    buildings = Building.query.filter_by(campus=campus) \
+        .order_by(Building.position.is_(None), Building.position, Building.name).all()
+    if all(b.position is None for b in buildings) and campus_config(campus).get('buildings'):
+        sync_buildings(campus)
+        return catalog(campus)
+    return buildings
+
+
+def buildings_fingerprint(campus):
+    """本校区建筑表的指纹：max(updated_at) 和行数，任何建筑变化都会改变它"""
+    latest, count = db.session.query(
+        db.func.max(Building.updated_at), db.func.count(Building.id)
+    ).filter(Building.campus == campus).one()
+    return f'{campus}|{latest}|{count}'
+
+
+def preview_payload(campus):
+    """返回 (ETag, JSON字节)。指纹没变化时直接用缓存"""
+    fingerprint = buildings_fingerprint(campus)
+
+    with _payload_lock:
+        cached = _payload_cache.get(campus)
+        if cached and cached['fingerprint'] == fingerprint:
+            return cached['etag'], cached['body']
+
+    buildings = catalog(campus)
+    body = json.dumps({
+        'success': True,
+        'buildings': [b.to_preview_dict() for b in buildings],
+        'total_memories': sum(b.memories_count or 0 for b in buildings)
+    }, ensure_ascii=False).encode('utf-8')
+    etag = hashlib.sha1(fingerprint.encode()).hexdigest()[:16]
+
+    with _payload_lock:
+        _payload_cache[campus] = {'fingerprint': fingerprint, 'etag': etag, 'body': body}
+    return etag, body
+
+
+@click.group('buildings')
+def buildings_cli():
+    """建筑目录与预览"""
+
+
+@buildings_cli.command('sync')
+@click.option('--campus', 'campuses', multiple=True, help='只处理这些校区（默认全部已配置的校区）')
+@with_appcontext
+def sync_command(campuses):
+    """按配置补齐各校区的建筑目录并重算所有建筑预览"""
+    for campus in campuses or current_app.config['CAMPUSES']:
+        total = sync_buildings(campus)
+        click.echo(f'{campus}: 已刷新 {total} 个建筑的预览')
@@ -0,0 +1,359 @@
+# bulk_import.py - 批量导入（CSV / NDJSON），集合式插入，计数最后统一校正
+#
+# 集合式插入绕过了 ORM 的 flush（memory_added、bump、变更日志都不会触发），
+# 所以导入结束后统一校正一次：点赞/评论数、受影响记忆的热度、所在校区的建筑计数与预览，
+# 并给受影响的记忆补记变更日志，让增量同步的客户端取到它们。
+import csv
+import io
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import insert, select, func, literal, null
+
+from building_summary import sync_buildings
+from counters import reconcile_counters
+from exts import db
+from model import User, CampusMemory, MemoryComment, MemoryLike, ChangeLog, hash_password
+from trending import rebuild
+
+DEFAULT_BATCH_SIZE = 5000
+
+
+def read_rows(path):
+    """按扩展名读取 CSV 或 NDJSON，逐行产出字典"""
+    if path.endswith('.csv'):
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            yield from csv.DictReader(f)
+    else:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+
+def batched(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def parse_time(value):
+    if not value:
+        return datetime.utcnow()
+    if isinstance(value, datetime):
+        return value
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(value[:19], fmt)
+        except ValueError:
+            continue
+    raise ValueError(f'无法解析时间：{value}')
+
+
+def _dialect():
+    return db.engine.dialect.name
+
+
+def insert_ignore(table):
+    """忽略唯一约束冲突的INSERT（重复导入同一文件不会报错）"""
+    dialect = _dialect()
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as pg_insert
+        return pg_insert(table).on_conflict_do_nothing()
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+        return sqlite_insert(table).on_conflict_do_nothing()
+    if dialect == 'mysql':
+        return insert(table).prefix_with('IGNORE')
+    return insert(table)
+
+
+def copy_rows(table, columns, rows):
+    """PostgreSQL下用COPY FROM STDIN装载一批行"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(['\\N' if row[c] is None else row[c] for c in columns])
+    buffer.seek(0)
+
+    raw = db.session.connection().connection.dbapi_connection
+    with raw.cursor() as cursor:
+        cursor.copy_expert(
+            f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+            buffer
+        )
+
+
+def load_batch(table, rows, ignore_conflicts=False):
+    """插入一批行：PostgreSQL 走 COPY，其他数据库走 executemany。
+    返回实际插入的行数（忽略冲突时不含被跳过的行）"""
+    if not rows:
+        return 0
+    if _dialect() == 'postgresql' and not ignore_conflicts:
+        # COPY 要么全部装载、要么整体失败
+        copy_rows(table, list(rows[0].keys()), rows)
+        return len(rows)
+    stmt = insert_ignore(table) if ignore_conflicts else insert(table)
+    rowcount = db.session.execute(stmt, rows).rowcount
+    # 个别驱动的 executemany 不报告行数（-1），只能按提交的行数计
+    return rowcount if rowcount is not None and rowcount >= 0 else len(rows)
+
+
+class UserResolver:
+    """用户名 -> 用户ID，按批一次IN查询，结果缓存"""
+
+    def __init__(self):
+        self._ids = {}
+
+    def resolve(self, rows):
+        missing = {r['username'] for r in rows
+                   if not r.get('user_id') and r.get('username') and r['username'] not in self._ids}
+        if missing:
+            result = db.session.execute(
+                select(User.id, User.username).where(User.username.in_(missing))
+            )
+            self._ids.update({username: user_id for user_id, username in result})
+
+    def user_id(self, row):
+        if row.get('user_id'):
+            return int(row['user_id'])
+        return self._ids.get(row.get('username'))
+
+
+class ImportStats:
+    def __init__(self, name):
+        self.name = name
+        self.loaded = 0
+        self.skipped = 0
+        self.started = time.perf_counter()
+
+    def report(self, final=False):
+        elapsed = time.perf_counter() - self.started
+        rate = self.loaded / elapsed * 60 if elapsed else 0
+        prefix = '完成' if final else '进度'
+        click.echo(f'[{self.name}] {prefix}：导入 {self.loaded} 行，跳过 {self.skipped} 行，'
+                   f'用时 {elapsed:.1f}s，约 {rate:,.0f} 行/分钟')
+
+
+def log_imported(memory_ids):
+    """给受影响的记忆补记变更日志（集合式插入、计数校正都不经过 flush，同 changelog.log_change），
+    返回它们所在的校区"""
+    campuses = set()
+    now = datetime.utcnow()
+    for chunk in batched(sorted(memory_ids), DEFAULT_BATCH_SIZE):
+        campuses.update(campus for (campus,) in db.session.execute(
+            select(CampusMemory.campus).where(CampusMemory.id.in_(chunk)).distinct()))
+        db.session.execute(insert(ChangeLog.__table__).from_select(
+            ['entity', 'entity_id', 'op', 'campus', 'user_id', 'created_at'],
+            select(literal('memory'), CampusMemory.id, literal('upsert'), CampusMemory.campus,
+                   null(), literal(now)).where(CampusMemory.id.in_(chunk))))
+    db.session.commit()
+    return campuses
+
+
+def reconcile_import(memory_ids, campuses):
+    """导入结束后的统一校正：全部点赞/评论数，受影响记忆的热度，所在校区的建筑计数与预览"""
+    reconcile_counters()
+    rebuild(memory_ids=memory_ids)
+    for campus in sorted(campuses):
+        sync_buildings(campus)
+
+
+def _finish(stats, reconcile, memory_ids=()):
+    """memory_ids：新导入的记忆，或导入的评论/点赞指向的记忆"""
+    db.session.commit()
+    stats.report(final=True)
+    if not memory_ids:
+        return
+    campuses = log_imported(memory_ids)
+    if not reconcile:
+        click.echo('未校正：全部导入完成后执行 flask reconcile-counters、flask trending rebuild、flask buildings sync')
+        return
+    started = time.perf_counter()
+    reconcile_import(memory_ids, campuses)
+    click.echo(f'校正完成：{len(memory_ids)} 条记忆的计数与热度、{len(campuses)} 个校区的建筑预览，'
+               f'用时 {time.perf_counter() - started:.1f}s')
+
+
+# ===== 命令行 =====
+
+@click.group('import')
+def import_cli():
+    """批量导入用户、记忆、评论、点赞"""
+
+
+batch_option = click.option('--batch-size', default=DEFAULT_BATCH_SIZE, show_default=True,
+                            help='每批插入的行数')
+reconcile_option = click.option('--reconcile/--no-reconcile', default=True,
+                                help='导入结束后统一校正计数、热度和建筑预览（连续导入多个文件时可先关闭，'
+                                     '最后执行 flask reconcile-counters、flask trending rebuild、flask buildings sync）')
+
+
+@import_cli.command('users')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@batch_option
+@click.option('--workers', default=os.cpu_count() or 1, show_default=True, help='计算密码哈希的进程数')
+@with_appcontext
+def import_users(path, batch_size, workers):
+    """导入用户：username, student_id, password（或password_hash）, nickname, gender, college, email"""
+    stats = ImportStats('users')
+    table = User.__table__
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for batch in batched(read_rows(path), batch_size):
+            valid = [r for r in batch if r.get('username') and r.get('student_id')
+                     and (r.get('password') or r.get('password_hash'))]
+            stats.skipped += len(batch) - len(valid)
+
+            plain = [r['password'] for r in valid if not r.get('password_hash')]
+            hashes = iter(pool.map(hash_password, plain, chunksize=max(1, len(plain) // (workers * 4))))
+
+            rows = []
+            for r in valid:
+                rows.append({
+                    'username': r['username'],
+                    'student_id': r['student_id'],
+                    'password_hash': r.get('password_hash') or next(hashes),
+                    'nickname': r.get('nickname') or r['username'],
+                    'gender': r.get('gender') or '未设置',
+                    'college': r.get('college') or '未设置',
+                    'email': r.get('email') or None,
+                    'created_at': parse_time(r.get('created_at')),
+                })
+
+            # 用户名/学号可能已存在，忽略冲突
+            inserted = load_batch(table, rows, ignore_conflicts=True)
+            db.session.commit()
+            stats.loaded += inserted
+            stats.skipped += len(rows) - inserted
+            stats.report()
+
+    _finish(stats, reconcile=False)
+
+
+@import_cli.command('memories')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@batch_option
+@reconcile_option
+@with_appcontext
+def import_memories(path, batch_size, reconcile):
+    """导入记忆：building, content, user_id 或 username, images（JSON数组或|分隔）, created_at, campus（可选）"""
+    stats = ImportStats('memories')
+    resolver = UserResolver()
+    table = CampusMemory.__table__
+    # COPY / executemany 不返回新行的id，按导入前的最大id找出新插入的记忆
+    floor = db.session.execute(select(func.max(CampusMemory.id))).scalar() or 0
+
+    for batch in batched(read_rows(path), batch_size):
+        resolver.resolve(batch)
+        rows = []
+        for r in batch:
+            user_id = resolver.user_id(r)
+            if not user_id or not r.get('building'):
+                stats.skipped += 1
+                continue
+            images = r.get('images') or []
+            if isinstance(images, str):
+                images = json.loads(images) if images.startswith('[') else [i for i in images.split('|') if i]
+            created_at = parse_time(r.get('created_at'))
+            rows.append({
+                'campus': r.get('campus') or current_app.config['DEFAULT_CAMPUS'],
+                'building': r['building'],
+                'content': r.get('content') or '',
+                'user_id': user_id,
+                'images': json.dumps(images),
+                'likes_count': 0,
+                'comments_count': 0,
+                'created_at': created_at,
+                'updated_at': created_at,
+            })
+        stats.loaded += load_batch(table, rows)
+        db.session.commit()
+        stats.report()
+
+    memory_ids = db.session.execute(select(CampusMemory.id).where(CampusMemory.id > floor)).scalars().all()
+    _finish(stats, reconcile, memory_ids)
+
+
+@import_cli.command('comments')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@batch_option
+@reconcile_option
+@with_appcontext
+def import_comments(path, batch_size, reconcile):
+    """导入评论：memory_id, user_id 或 username, content, parent_id, created_at"""
+    stats = ImportStats('comments')
+    resolver = UserResolver()
+    table = MemoryComment.__table__
+    memory_ids = set()
+
+    for batch in batched(read_rows(path), batch_size):
+        resolver.resolve(batch)
+        rows = []
+        for r in batch:
+            user_id = resolver.user_id(r)
+            if not user_id or not r.get('memory_id') or not r.get('content'):
+                stats.skipped += 1
+                continue
+            rows.append({
+                'memory_id': int(r['memory_id']),
+                'user_id': user_id,
+                'parent_id': int(r['parent_id']) if r.get('parent_id') else None,
+                'content': r['content'],
+                'likes_count': 0,
+                'created_at': parse_time(r.get('created_at')),
+            })
+        stats.loaded += load_batch(table, rows)
+        db.session.commit()
+        memory_ids.update(r['memory_id'] for r in rows)
+        stats.report()
+
+    _finish(stats, reconcile, memory_ids)
+
+
+@import_cli.command('likes')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@batch_option
+@reconcile_option
+@with_appcontext
+def import_likes(path, batch_size, reconcile):
+    """导入点赞：memory_id, user_id 或 username, created_at"""
+    stats = ImportStats('likes')
+    resolver = UserResolver()
+    table = MemoryLike.__table__
+    memory_ids = set()
+
+    for batch in batched(read_rows(path), batch_size):
+        resolver.resolve(batch)
+        rows = []
+        for r in batch:
+            user_id = resolver.user_id(r)
+            if not user_id or not r.get('memory_id'):
+                stats.skipped += 1
+                continue
+            rows.append({
+                'memory_id': int(r['memory_id']),
+                'user_id': user_id,
+                'created_at': parse_time(r.get('created_at')),
+            })
+        # 同一用户对同一记忆只能点赞一次，重复的忽略
+        inserted = load_batch(table, rows, ignore_conflicts=True)
+        db.session.commit()
+        stats.loaded += inserted
+        stats.skipped += len(rows) - inserted
+        memory_ids.update(r['memory_id'] for r in rows)
+        stats.report()
+
+    _finish(stats, reconcile, memory_ids)
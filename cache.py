@@ -0,0 +1,42 @@
+# cache.py - 进程内的小型TTL缓存
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """线程安全的LRU + TTL缓存。每个gunicorn worker各有一份、互不同步，
+    需要跨worker一致的调用方自己校验（如随值存一份数据库指纹），TTL只限制内存占用"""
+
+    def __init__(self, maxsize=1024, ttl=30):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
@@ -0,0 +1,61 @@
+# campus.py - 多校区路由：在WSGI层确定请求所属的校区
+#
+# 两种方式：
+#   子域名   xitucheng.capsule.example.com/api/...  （配置 CAMPUS_ROOT_DOMAIN）
+#   路径前缀 capsule.example.com/c/xitucheng/api/...
+# 路径前缀被移到 SCRIPT_NAME，路由表不需要改动，url_for 生成的地址自动带上前缀。
+# 所有按校区分区的查询都从 current_campus() 取分区键。
+from flask import current_app, has_request_context, request
+
+ENVIRON_KEY = 'bupt.campus'
+PATH_PREFIX = '/c/'
+
+
+class CampusMiddleware:
+    def __init__(self, wsgi_app, config):
+        self.wsgi_app = wsgi_app
+        self.campuses = set(config['CAMPUSES'])
+        self.default = config['DEFAULT_CAMPUS']
+        root = config.get('CAMPUS_ROOT_DOMAIN')
+        self.host_suffix = '.' + root.lower() if root else None
+
+    def _from_host(self, environ):
+        if not self.host_suffix:
+            return None
+        host = environ.get('HTTP_HOST', '').split(':', 1)[0].lower()
+        if host.endswith(self.host_suffix):
+            slug = host[:-len(self.host_suffix)]
+            if slug in self.campuses:
+                return slug
+        return None
+
+    def __call__(self, environ, start_response):
+        campus = self._from_host(environ)
+        path = environ.get('PATH_INFO', '')
+        if path.startswith(PATH_PREFIX):
+            slug, _, rest = path[len(PATH_PREFIX):].partition('/')
+            # 未知的前缀原样交给路由，得到404
+            if slug in self.campuses:
+                campus = slug
+                prefix = PATH_PREFIX + slug
+                environ['SCRIPT_NAME'] = environ.get('SCRIPT_NAME', '') + prefix
+                environ['PATH_INFO'] = '/' + rest
+        environ[ENVIRON_KEY] = campus or self.default
+        return self.wsgi_app(environ, start_response)
+
+
+def init_campus(app):
+    app.wsgi_app = CampusMiddleware(app.wsgi_app, app.config)
+
+
+def current_campus():
+    """当前请求的校区；命令行等没有请求的场景使用默认校区"""
+    if has_request_context():
+        campus = request.environ.get(ENVIRON_KEY)
+        if campus:
+            return campus
+    return current_app.config['DEFAULT_CAMPUS']
+
+
+def campus_config(campus):
+    return current_app.config['CAMPUSES'].get(campus, {})
@@ -0,0 +1,173 @@
+# changelog.py - 变更日志与增量同步
+#
+# 每次 flush 时把记忆、日记、通知的新增/修改/删除记一行到 change_log（与业务数据同一事务）。
+# 客户端先全量加载并保存 /api/sync 返回的令牌，之后带令牌轮询，只取回令牌之后的变化。
+# 令牌是变更日志的自增id：并发事务的id分配顺序和提交顺序可能不同，
+# 所以令牌只推进到 SYNC_SETTLE_SECONDS 之前的变更（假定事务都能在这段时间内提交）。
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import event, insert, select, delete, func, or_, and_
+from sqlalchemy.orm import Session
+
+from exts import db
+from jobs import task
+from model import CampusMemory, Diary, Notification, ChangeLog, AppState
+from timeline import hydrate
+
+# 令牌早于这个值的变更已被清理，客户端需要全量刷新
+PRUNED_KEY = 'change_log_pruned_through'
+
+TRACKED = {CampusMemory: 'memory', Diary: 'diary', Notification: 'notification'}
+
+
+# ===== 记录 =====
+
+def _entry(obj, op, now):
+    entity = TRACKED[type(obj)]
+    if entity == 'memory':
+        if obj.deleted_at is not None:
+            op = 'delete'  # 软删除对客户端来说就是删除
+        campus, user_id = obj.campus, None
+    elif entity == 'diary':
+        campus, user_id = obj.campus, obj.user_id
+    else:
+        campus, user_id = None, obj.user_id
+    return {'entity': entity, 'entity_id': obj.id, 'op': op,
+            'campus': campus, 'user_id': user_id, 'created_at': now}
+
+
+def _after_flush(session, flush_context):
+    now = datetime.utcnow()
+    rows = [_entry(obj, 'upsert', now) for obj in session.new if type(obj) in TRACKED]
+    rows += [_entry(obj, 'upsert', now) for obj in session.dirty
+             if type(obj) in TRACKED and session.is_modified(obj, include_collections=False)]
+    rows += [_entry(obj, 'delete', now) for obj in session.deleted if type(obj) in TRACKED]
+    if rows:
+        session.connection().execute(insert(ChangeLog.__table__), rows)
+
+
+def init_changelog(app):
+    # 监听所有会话；批量 UPDATE/DELETE 不经过 flush，需要的地方调用 log_change
+    if not event.contains(Session, 'after_flush', _after_flush):
+        event.listen(Session, 'after_flush', _after_flush)
+
+
+def log_change(entity, op, entity_id=None, campus=None, user_id=None):
+    """手动记一条变更（用于绕过ORM的批量操作），随调用方事务提交"""
+    db.session.execute(insert(ChangeLog.__table__).values(
+        entity=entity, entity_id=entity_id, op=op, campus=campus, user_id=user_id,
+        created_at=datetime.utcnow()))
+
+
+# ===== 增量查询 =====
+
+def settled_token():
+    """稳定的令牌：SYNC_SETTLE_SECONDS 之前的最大变更id（走 created_at 索引）"""
+    cutoff = datetime.utcnow() - timedelta(seconds=current_app.config.get('SYNC_SETTLE_SECONDS', 10))
+    token = db.session.execute(
+        select(func.max(ChangeLog.id)).where(ChangeLog.created_at <= cutoff)
+    ).scalar() or 0
+    # 日志被清空后令牌也不能倒退
+    return max(token, int(AppState.get_value(PRUNED_KEY) or 0))
+
+
+def latest_change(entity, user_id, campus):
+    """该用户在本校区某类数据的最新变更id（沿 user_id, id 索引倒序取第一条），没有时为 None。
+    与业务数据同一事务写入、自增id不复用，可用作"该用户的数据有没有变"的标记"""
+    return db.session.execute(
+        select(ChangeLog.id).where(ChangeLog.user_id == user_id, ChangeLog.entity == entity,
+                                   ChangeLog.campus == campus)
+        .order_by(ChangeLog.id.desc()).limit(1)
+    ).scalar()
+
+
+def token_expired(since):
+    return since < int(AppState.get_value(PRUNED_KEY) or 0)
+
+
+def _scope(campus, user_id, entities):
+    clauses = []
+    if 'memory' in entities:
+        clauses.append(and_(ChangeLog.entity == 'memory', ChangeLog.campus == campus))
+    if user_id and 'diary' in entities:
+        clauses.append(and_(ChangeLog.entity == 'diary', ChangeLog.user_id == user_id,
+                            ChangeLog.campus == campus))
+    if user_id and 'notification' in entities:
+        clauses.append(and_(ChangeLog.entity == 'notification', ChangeLog.user_id == user_id))
+    return or_(*clauses)
+
+
+def _hydrate(entity, ids, campus, user_id):
+    """取变更行当前的内容；已不存在（或已不可见）的按删除处理"""
+    if not ids:
+        return {}
+    if entity == 'memory':
+        return {item['id']: item for item in hydrate(ids)}
+    if entity == 'diary':
+        rows = Diary.query.filter(Diary.id.in_(ids), Diary.user_id == user_id, Diary.campus == campus)
+    else:
+        rows = Notification.query.filter(Notification.id.in_(ids), Notification.user_id == user_id) \
+            .filter(Notification.not_hidden())
+    return {row.id: row.to_dict() for row in rows}
+
+
+def changes_since(since, campus, user_id, entities):
+    """返回 (新令牌, 是否还有更多, {实体: {'upserted', 'deleted', 'cleared'}})"""
+    limit = current_app.config.get('SYNC_MAX_CHANGES', 500)
+    horizon = settled_token()
+    rows = db.session.execute(
+        select(ChangeLog.id, ChangeLog.entity, ChangeLog.entity_id, ChangeLog.op)
+        .where(ChangeLog.id > since, _scope(campus, user_id, entities))
+        .order_by(ChangeLog.id).limit(limit + 1)
+    ).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    # 同一对象多次变更只保留最后一次；clear 之前的通知变更都作废
+    latest = {entity: {} for entity in entities}
+    cleared = set()
+    for row in rows:
+        if row.op == 'clear':
+            latest[row.entity].clear()
+            cleared.add(row.entity)
+        else:
+            latest[row.entity][row.entity_id] = row.op
+
+    result = {}
+    for entity, ops in latest.items():
+        upsert_ids = [entity_id for entity_id, op in ops.items() if op == 'upsert']
+        current = _hydrate(entity, upsert_ids, campus, user_id)
+        result[entity] = {
+            'upserted': [current[i] for i in upsert_ids if i in current],
+            'deleted': [i for i, op in ops.items() if op == 'delete' or i not in current],
+            'cleared': entity in cleared,
+        }
+
+    # 分页时令牌不能越过本页最后一条；令牌没能前进时不让客户端立即再取
+    token = min(rows[-1].id, horizon) if has_more else horizon
+    token = max(token, since)
+    return token, has_more and token > since, result
+
+
+# ===== 清理 =====
+
+@task('changelog.prune', concurrency=1)
+def prune_task(batch_size=5000):
+    """删除超过保留天数的变更日志（flask jobs enqueue changelog.prune，建议每天一次）"""
+    days = current_app.config.get('SYNC_LOG_KEEP_DAYS', 7)
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    through = db.session.execute(
+        select(func.max(ChangeLog.id)).where(ChangeLog.created_at < cutoff)).scalar()
+    if not through:
+        return
+    # 先记下边界，早于它的令牌从此要求全量刷新
+    AppState.set_value(PRUNED_KEY, str(through))
+    db.session.commit()
+    while True:
+        ids = db.session.execute(select(ChangeLog.id).where(ChangeLog.id <= through)
+                                 .order_by(ChangeLog.id).limit(batch_size)).scalars().all()
+        if not ids:
+            break
+        db.session.execute(delete(ChangeLog).where(ChangeLog.id.in_(ids)))
+        db.session.commit()
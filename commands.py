@@ -0,0 +1,89 @@
+# commands.py - flask 命令按需导入 + 启动耗时检查
+# web worker 启动时不加载只在运维时用到的模块（导入、导出、清理等）
+import importlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+import click
+from flask.cli import AppGroup
+
+# 命令名 -> (模块, 命令对象)
+LAZY_COMMANDS = {
+    'export-user': ('export', 'export_user_command'),
+    'import': ('bulk_import', 'import_cli'),
+    'reconcile-counters': ('counters', 'reconcile_counters_command'),
+    'retention': ('retention', 'retention_cli'),
+    'purge': ('purge', 'purge_cli'),
+    'worker': ('jobs', 'worker_command'),
+    'jobs': ('jobs', 'jobs_cli'),
+    'uploads': ('upload_gc', 'uploads_cli'),
+    'traffic': ('traffic', 'traffic_cli'),
+    'profile': ('profiling', 'profile_cli'),
+    'trending': ('trending', 'trending_cli'),
+    'moderation': ('moderation', 'moderation_cli'),
+    'buildings': ('building_summary', 'buildings_cli'),
+    'build-pages': ('pages', 'build_pages_command'),
+    'startup-check': ('commands', 'startup_check_command'),
+}
+
+
+class LazyCommandGroup(AppGroup):
+    """第一次查找命令时才导入所在模块"""
+
+    def list_commands(self, ctx):
+        return sorted(set(super().list_commands(ctx)) | set(LAZY_COMMANDS))
+
+    def get_command(self, ctx, name):
+        if name not in self.commands and name in LAZY_COMMANDS:
+            module, attr = LAZY_COMMANDS[name]
+            self.add_command(getattr(importlib.import_module(module), attr), name)
+        return super().get_command(ctx, name)
+
+
+# ===== 启动检查 =====
+
+# 在全新的解释器里导入应用：记录耗时，并确认导入过程没有连接数据库、没有启动线程。
+# 这两点保证 gunicorn --preload 时 fork 出来的 worker 不会共享连接或丢失线程
+_PROBE = '''
+import json, threading, time
+start = time.perf_counter()
+import app as module
+elapsed = (time.perf_counter() - start) * 1000
+with module.app.app_context():
+    pool = module.db.engine.pool
+    connections = getattr(pool, 'checkedin', lambda: 0)() + getattr(pool, 'checkedout', lambda: 0)()
+print(json.dumps({'ms': elapsed, 'threads': threading.active_count(), 'connections': connections}))
+'''
+
+
+def probe_startup():
+    root = os.path.dirname(os.path.abspath(__file__))
+    output = subprocess.run([sys.executable, '-c', _PROBE], cwd=root, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+@click.command('startup-check')
+@click.option('--budget-ms', default=1500, show_default=True, help='冷启动耗时上限（中位数）')
+@click.option('--runs', default=3, show_default=True)
+def startup_check_command(budget_ms, runs):
+    """测量冷启动耗时并检查是否可以安全地 preload，超出预算时返回非0"""
+    results = [probe_startup() for _ in range(runs)]
+    median = statistics.median(r['ms'] for r in results)
+    click.echo(f'冷启动耗时（中位数）：{median:.0f}ms，预算 {budget_ms}ms')
+
+    problems = []
+    if median > budget_ms:
+        problems.append('超出启动耗时预算')
+    if any(r['connections'] for r in results):
+        problems.append('导入时建立了数据库连接')
+    if any(r['threads'] > 1 for r in results):
+        problems.append('导入时启动了后台线程')
+    for problem in problems:
+        click.echo(problem, err=True)
+    if problems:
+        sys.exit(1)
+    click.echo('检查通过')
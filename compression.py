@@ -0,0 +1,61 @@
+# compression.py - JSON响应压缩（gzip / brotli），超过阈值才压缩
+import gzip
+
+try:
+    import brotli  # 可选依赖，未安装时只用gzip
+except ImportError:
+    brotli = None
+
+from flask import request
+
+COMPRESSIBLE_TYPES = {'application/json', 'text/html', 'text/plain', 'application/x-ndjson'}
+
+
+def choose_encoding(accept_encoding):
+    """按 Accept-Encoding 选择编码：优先 br，其次 gzip"""
+    if brotli is not None and accept_encoding['br']:
+        return 'br'
+    if accept_encoding['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress_response(response, min_size, gzip_level=6, brotli_quality=4):
+    if (response.status_code != 200
+            or response.direct_passthrough
+            or response.is_streamed
+            or response.mimetype not in COMPRESSIBLE_TYPES
+            or 'Content-Encoding' in response.headers):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    if len(data) < min_size:
+        return response
+
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+
+    if encoding == 'br':
+        compressed = brotli.compress(data, quality=brotli_quality)
+    else:
+        compressed = gzip.compress(data, compresslevel=gzip_level)
+
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    # 压缩后字节变了，强ETag降为弱ETag
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_compression(app):
+    min_size = app.config.get('COMPRESS_MIN_SIZE', 1024)
+    gzip_level = app.config.get('COMPRESS_GZIP_LEVEL', 6)
+    brotli_quality = app.config.get('COMPRESS_BROTLI_QUALITY', 4)
+
+    @app.after_request
+    def _compress(response):
+        return compress_response(response, min_size, gzip_level, brotli_quality)
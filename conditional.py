@@ -0,0 +1,93 @@
+# conditional.py - 基于廉价指纹的条件GET：命中时在查询数据、序列化之前就返回304
+import hashlib
+from datetime import datetime
+from functools import wraps
+
+from flask import request, session, make_response, current_app
+from sqlalchemy.exc import IntegrityError
+
+from campus import current_campus
+from exts import db
+from model import CampusMemory, MemoryComment, Notification, AppState
+
+# 任何用户的昵称或头像最后一次修改的时间。记忆流、评论里内嵌了作者信息，
+# 逐个作者比对代价太高，资料修改又很少见，所以用一个全局值让这些接口的ETag一起失效
+PROFILES_KEY = 'profiles_changed_at'
+
+
+def conditional(fingerprint):
+    """fingerprint(*args, **kwargs) 返回能代表结果的小元组（如行数 + 最新时间），
+    与请求路径、查询参数、校区、登录用户一起生成弱ETag"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                fp = fingerprint(*args, **kwargs)
+            except Exception:
+                current_app.logger.exception('计算ETag指纹失败')
+                fp = None
+            if fp is None:
+                return view(*args, **kwargs)
+
+            # 子域名区分的校区路径相同，校区要单独计入
+            raw = repr((request.full_path, current_campus(), session.get('user_id'), fp))
+            etag = hashlib.sha1(raw.encode()).hexdigest()[:20]
+            if request.if_none_match.contains_weak(etag):
+                response = current_app.response_class(status=304)
+                response.set_etag(etag, weak=True)
+                return response
+
+            response = make_response(view(*args, **kwargs))
+            payload = response.get_json(silent=True) if response.status_code == 200 else None
+            # 只给成功的结果打ETag，出错的响应不应被缓存
+            if payload and payload.get('success'):
+                response.set_etag(etag, weak=True)
+                response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
+
+
+def profiles_changed():
+    """昵称或头像修改时调用（随调用方事务提交）"""
+    value = datetime.utcnow().isoformat()
+    try:
+        with db.session.begin_nested():
+            AppState.set_value(PROFILES_KEY, value)
+    except IntegrityError:
+        # 第一次写入时其他请求同时插入了这一行
+        AppState.set_value(PROFILES_KEY, value)
+
+
+def _profiles_version():
+    return db.select(AppState.value).where(AppState.key == PROFILES_KEY).scalar_subquery()
+
+
+# ===== 各接口的指纹 =====
+
+def building_feed_fingerprint(building):
+    """建筑记忆流：行数 + 最后更新时间（点赞、评论都会刷新 updated_at）+ 作者资料版本"""
+    return db.session.query(
+        db.func.count(CampusMemory.id), db.func.max(CampusMemory.updated_at), _profiles_version()
+    ).filter(CampusMemory.campus == current_campus(), CampusMemory.building == building,
+             CampusMemory.deleted_at.is_(None)).one()
+
+
+def comments_fingerprint(memory_id):
+    # 记忆被删除后指纹也要变，旧的缓存不能再得到304；评论里有评论者的昵称和头像
+    deleted_at = db.select(CampusMemory.deleted_at).where(CampusMemory.id == memory_id).scalar_subquery()
+    return db.session.query(
+        db.func.count(MemoryComment.id), db.func.max(MemoryComment.id),
+        db.func.max(MemoryComment.created_at), deleted_at, _profiles_version()
+    ).filter(MemoryComment.memory_id == memory_id).one()
+
+
+def notifications_fingerprint():
+    # 通知里内嵌了发送者的昵称和头像
+    user_id = session.get('user_id')
+    if not user_id:
+        return None
+    return db.session.query(
+        db.func.count(Notification.id), db.func.max(Notification.id),
+        db.func.sum(db.case((Notification.is_read.is_(True), 1), else_=0)), _profiles_version()
+    ).filter(Notification.user_id == user_id, Notification.not_hidden()).one()
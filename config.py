@@ -1,5 +1,6 @@
 # config.py - Railway专用版本
 import os
+import tempfile
 from urllib.parse import urlparse
 
 # ===== 环境检测 =====
@@ -35,6 +36,169 @@ SECRET_KEY = os.environ.get('SECRET_KEY', 'dev-secret-key-change-this-in-product
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 UPLOAD_FOLDER = os.path.join(BASE_DIR, 'uploads')
 MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 最大上传16MB
+UPLOAD_CHUNK_SIZE = 64 * 1024  # 流式写盘的分块大小
+
+# 存储后端：'local' 本地分片目录；'s3' S3兼容对象存储
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'local')
+S3_BUCKET = os.environ.get('S3_BUCKET', 'uploads')
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL')  # 为空时使用本地替身
+S3_LOCAL_ROOT = os.environ.get('S3_LOCAL_ROOT', os.path.join(BASE_DIR, 's3-local'))
+
+# 上传文件发送方式：为空时由应用发送（sendfile零拷贝）；
+# 'nginx' 返回 X-Accel-Redirect，'sendfile' 返回 X-Sendfile，由前置代理发送文件内容
+UPLOAD_ACCEL_MODE = os.environ.get('UPLOAD_ACCEL_MODE') or None
+UPLOAD_ACCEL_PREFIX = os.environ.get('UPLOAD_ACCEL_PREFIX', '/_uploads/')  # nginx internal location
+UPLOAD_LEGACY_MAX_AGE = 86400  # 旧版平铺文件的缓存时间
+# 没有被引用的上传文件超过该秒数才会被 flask uploads gc 删除（留给进行中的上传事务）
+UPLOAD_GC_GRACE_SECONDS = 86400
+
+# ===== 用户名/学号占用索引 =====
+# 每个worker内存里的布隆过滤器（见 availability.py），其他worker的新注册按这个间隔补进来
+AVAILABILITY_REFRESH_SECONDS = 2
+# 增量从这么多秒之前的水位开始重扫：id 较小、提交较晚的注册（并发注册、分批导入）也能补进来
+AVAILABILITY_SETTLE_SECONDS = 10
+AVAILABILITY_FP_RATE = 0.001
+AVAILABILITY_HEADROOM = 10000  # 构建时在现有用户数之外预留的容量
+
+# ===== 敏感词过滤 =====
+# 词表文件每行一个词，可在制表符后写 block / mask / flag（见 moderation.py）；未设置时不过滤
+MODERATION_WORDS_FILE = os.environ.get('MODERATION_WORDS_FILE') or None
+MODERATION_DEFAULT_ACTION = os.environ.get('MODERATION_DEFAULT_ACTION', 'mask')
+MODERATION_RELOAD_INTERVAL = 5  # 检查词表文件是否修改的间隔（秒）
+
+# ===== 缓存 =====
+DIARY_OVERVIEW_CACHE_TTL = 300  # 日记概览缓存秒数（各worker独立，每次按该用户日记的最新变更id校验，TTL只限制内存占用）
+
+# ===== 日记修订 =====
+DIARY_REVISION_COALESCE_SECONDS = 60  # 这段时间内的连续保存合并为一条修订
+DIARY_MAX_REVISIONS = 100  # 每篇日记最多保留的修订数
+
+# ===== 数据保留 =====
+# 超过天数的行由 flask retention run 搬到归档表
+RETENTION_DAYS = {
+    'read_notifications': 90,
+    'unread_notifications': 365,
+    'user_activities': 180,
+}
+
+# ===== 删除清理 =====
+# 删除记忆是软删除，关联数据由后台任务（flask worker）分批清理，flask purge run 补漏
+PURGE_BATCH_SIZE = 1000
+PURGE_GRACE_SECONDS = 300  # 删除后等待进行中的请求结束再清理
+
+# ===== 增量同步 =====
+# /api/sync 按变更日志返回增量。令牌只推进到 SYNC_SETTLE_SECONDS 之前的变更，
+# 更新的变更也会返回但下次还会再给一次，保证并发事务晚提交的变更不会被跳过
+SYNC_SETTLE_SECONDS = 10
+SYNC_MAX_CHANGES = 500  # 每次最多返回的变更条数
+SYNC_LOG_KEEP_DAYS = 7  # 变更日志保留天数，更早的令牌需要全量刷新
+
+# ===== 后台任务 =====
+# 任务存放在应用数据库的 jobs 表里，由 flask worker 进程执行（不需要额外的消息队列）
+JOB_MAX_ATTEMPTS = 5  # 默认最多执行次数（含第一次）
+JOB_RETRY_BASE_SECONDS = 10  # 失败重试退避：base × 2^(次数-1)，带随机抖动
+JOB_RETRY_MAX_SECONDS = 3600
+JOB_LEASE_SECONDS = 900  # 执行超过该秒数仍未结束视为worker已退出，任务重新入队
+JOB_POLL_INTERVAL = 1.0  # 队列为空时的轮询间隔（秒）
+JOB_KEEP_FINISHED_DAYS = 7  # 已完成/失败的任务保留天数，期间相同幂等键不会重复入队
+
+# ===== 用户活动日志 =====
+ACTIVITY_LOG_ENABLED = os.environ.get('ACTIVITY_LOG_ENABLED', '1') == '1'
+ACTIVITY_BUFFER_SIZE = 10000  # 缓冲区上限，满了丢弃新事件
+ACTIVITY_FLUSH_INTERVAL_MS = 500  # 最长多久写一次
+ACTIVITY_FLUSH_BATCH = 200  # 攒够多少条立即写
+
+# ===== 客户端IP =====
+# 应用前面可信代理的层数（Railway 的边缘代理算一层）。只信任这些代理追加的 X-Forwarded-For，
+# 客户端自己带的部分不可信；直接对外服务时设为 0，使用连接的对端地址
+TRUSTED_PROXY_COUNT = int(os.environ.get('TRUSTED_PROXY_COUNT', '1' if IS_RAILWAY else '0'))
+
+# ===== 限流 =====
+# 状态存放在本机SQLite文件中，同一台机器上的所有gunicorn worker共享。
+# 每个请求按IP限流，已登录的同时按用户限流，任何一个超限都拒绝
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', '1') == '1'
+RATE_LIMIT_DB = os.environ.get('RATE_LIMIT_DB', os.path.join(tempfile.gettempdir(), 'bupt-ratelimit.sqlite3'))
+RATE_LIMITS = {
+    'login': '10/minute',
+    'register': '5/hour',
+    'availability': '60/minute',  # 注册表单边输入边检查
+    'like': '60/minute',
+    'comment': '20/minute',
+}
+
+# ===== 热门排序 =====
+TRENDING_HALF_LIFE_HOURS = 24  # 热度半衰期
+TRENDING_WEIGHTS = {'post': 1.0, 'like': 1.0, 'comment': 2.0}
+
+# ===== 响应压缩 =====
+COMPRESS_MIN_SIZE = 1024  # 小于该字节数的响应不压缩
+COMPRESS_GZIP_LEVEL = 6
+COMPRESS_BROTLI_QUALITY = 4  # 安装了 brotli 时优先使用
+
+# ===== 流量录制 =====
+# 设置目录后记录脱敏的请求轨迹（每个进程一个NDJSON文件），用 flask traffic replay 回放压测
+TRAFFIC_RECORD_DIR = os.environ.get('TRAFFIC_RECORD_DIR') or None
+TRAFFIC_RECORD_SAMPLE = float(os.environ.get('TRAFFIC_RECORD_SAMPLE', '1'))  # 录制比例
+
+# ===== 性能剖析 =====
+# 设置目录后启用：带签名头 X-Profile 的请求（flask profile token 生成）或按比例抽样的请求会被剖析
+PROFILE_DIR = os.environ.get('PROFILE_DIR') or None
+PROFILE_MODE = os.environ.get('PROFILE_MODE', 'sample')  # sample（采样，输出折叠栈）或 cprofile
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_INTERVAL_MS = 5  # 采样间隔
+
+# 运维接口（如 /api/admin/profiles）的令牌，请求头 X-Admin-Token；未设置时运维接口不可用
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN') or None
+
+# ===== 页面预渲染 =====
+# 关闭后每次请求重新渲染模板，便于开发时修改页面
+PAGES_PRERENDER = os.environ.get('PAGES_PRERENDER', '1') == '1'
+
+# ===== 多校区 =====
+# 记忆、日记、建筑目录按校区分区。请求的校区由子域名（<校区>.CAMPUS_ROOT_DOMAIN）
+# 或路径前缀（/c/<校区>/...）决定，都没有时使用默认校区
+DEFAULT_CAMPUS = os.environ.get('DEFAULT_CAMPUS', 'bupt')
+CAMPUS_ROOT_DOMAIN = os.environ.get('CAMPUS_ROOT_DOMAIN') or None  # 如 capsule.example.com
+# 校区 -> 名称、建筑目录（地图上的顺序）、建筑图片目录、建筑坐标。
+# 目录和坐标由 flask buildings sync --campus 写入数据库，之后以数据库为准
+CAMPUSES = {
+    'bupt': {
+        'name': '北京邮电大学',
+        'image_prefix': '/static/',
+        'buildings': [
+            '体育场', '教学实验综合楼', '图书馆', '宿舍楼', '礼堂',
+            '学生餐厅', '校园湖', '马克思主义学院', '工程实验楼',
+            '理学院', '智能工程与自动化学院', '数字媒体与艺术设计学院',
+            '网络空间安全学院', '学生活动中心', '教职工食堂', '天猫超市'
+        ],
+        # 建筑 -> (纬度, 经度)，WGS84。海淀校区的示意位置，上线前按实测坐标修正
+        'coordinates': {
+            '体育场': (39.9630, 116.3540),
+            '教学实验综合楼': (39.9605, 116.3567),
+            '图书馆': (39.9612, 116.3575),
+            '宿舍楼': (39.9640, 116.3570),
+            '礼堂': (39.9600, 116.3550),
+            '学生餐厅': (39.9635, 116.3560),
+            '校园湖': (39.9618, 116.3555),
+            '马克思主义学院': (39.9592, 116.3580),
+            '工程实验楼': (39.9598, 116.3595),
+            '理学院': (39.9622, 116.3590),
+            '智能工程与自动化学院': (39.9628, 116.3600),
+            '数字媒体与艺术设计学院': (39.9585, 116.3560),
+            '网络空间安全学院': (39.9608, 116.3605),
+            '学生活动中心': (39.9645, 116.3550),
+            '教职工食堂': (39.9590, 116.3545),
+            '天猫超市': (39.9650, 116.3580),
+        },
+    },
+}
+
+# /api/campus/timeline 一次最多筛选的建筑数（每个建筑是一个子查询），不少于目录里的建筑数
+TIMELINE_MAX_BUILDINGS = 20
+
+# /api/campus/nearby：默认返回的建筑数、搜索半径（米）
+NEARBY_BUILDINGS = 3
+NEARBY_RADIUS_METERS = 500
 
 # ===== 会话配置 =====
 SESSION_COOKIE_HTTPONLY = True
@@ -0,0 +1,48 @@
+# counters.py - 冗余计数字段的整体校正
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import select, update, func
+
+from exts import db
+from jobs import task
+from model import CampusMemory, MemoryComment, MemoryLike, CommentLike
+
+
+def reconcile_counters():
+    """用集合式UPDATE按真实数据重算点赞数/评论数，返回受影响的行数"""
+    memories = CampusMemory.__table__
+    comments = MemoryComment.__table__
+    memory_likes = MemoryLike.__table__
+    comment_likes = CommentLike.__table__
+
+    likes_subq = select(func.count()).select_from(memory_likes) \
+        .where(memory_likes.c.memory_id == memories.c.id).scalar_subquery()
+    comments_subq = select(func.count()).select_from(comments) \
+        .where(comments.c.memory_id == memories.c.id).scalar_subquery()
+    comment_likes_subq = select(func.count()).select_from(comment_likes) \
+        .where(comment_likes.c.comment_id == comments.c.id).scalar_subquery()
+
+    # 不带updated_at，校正计数不算内容更新
+    result = db.session.execute(
+        update(memories).values(likes_count=likes_subq, comments_count=comments_subq,
+                                updated_at=memories.c.updated_at)
+    )
+    changed = result.rowcount
+    result = db.session.execute(update(comments).values(likes_count=comment_likes_subq))
+    changed += result.rowcount
+    db.session.commit()
+    return changed
+
+
+@task('counters.reconcile', concurrency=1)
+def reconcile_counters_task():
+    """全表重算，同一时间只允许一个在执行"""
+    reconcile_counters()
+
+
+@click.command('reconcile-counters')
+@with_appcontext
+def reconcile_counters_command():
+    """重算所有记忆和评论的点赞数、评论数"""
+    changed = reconcile_counters()
+    click.echo(f'计数校正完成，扫描 {changed} 行')
@@ -0,0 +1,185 @@
+# export.py - 个人数据导出（NDJSON / ZIP 流式生成，内存占用恒定）
+import json
+import zipfile
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from werkzeug.security import safe_join
+
+from exts import db
+from model import User, CampusMemory, Diary, MemoryComment
+from storage import get_storage, key_from_url
+
+# 服务端游标每批取回的行数
+EXPORT_BATCH_SIZE = 500
+CHUNK_SIZE = 64 * 1024
+
+
+def _fmt(dt):
+    return dt.strftime('%Y-%m-%d %H:%M:%S') if dt else None
+
+
+def _image_name(memory_id, index, url):
+    extension = url.rsplit('.', 1)[-1] if '.' in url else 'bin'
+    return f'images/{memory_id}_{index}.{extension}'
+
+
+def iter_user_records(user_id, with_image_files=False):
+    """逐行产出用户数据。只查询需要的列并用yield_per走服务端游标，不在内存中攒结果"""
+    user = User.query.get(user_id)
+    if not user:
+        return
+    profile = user.to_dict()
+    profile['last_login'] = _fmt(user.last_login)
+    yield {'type': 'user', **profile}
+
+    memories = db.session.query(
+        CampusMemory.id, CampusMemory.building, CampusMemory.content, CampusMemory.images,
+        CampusMemory.likes_count, CampusMemory.comments_count,
+        CampusMemory.created_at, CampusMemory.updated_at
+    ).filter(CampusMemory.user_id == user_id, CampusMemory.deleted_at.is_(None)) \
+        .order_by(CampusMemory.id).yield_per(EXPORT_BATCH_SIZE)
+    for row in memories:
+        images = json.loads(row.images) if row.images else []
+        record = {
+            'type': 'memory',
+            'id': row.id,
+            'building': row.building,
+            'content': row.content,
+            'images': images,
+            'likes_count': row.likes_count,
+            'comments_count': row.comments_count,
+            'created_at': _fmt(row.created_at),
+            'updated_at': _fmt(row.updated_at)
+        }
+        if with_image_files:
+            record['image_files'] = [_image_name(row.id, i, url) for i, url in enumerate(images)]
+        yield record
+
+    diaries = db.session.query(
+        Diary.id, Diary.location, Diary.content, Diary.created_at, Diary.updated_at
+    ).filter(Diary.user_id == user_id) \
+        .order_by(Diary.id).yield_per(EXPORT_BATCH_SIZE)
+    for row in diaries:
+        yield {
+            'type': 'diary',
+            'id': row.id,
+            'location': row.location,
+            'content': row.content,
+            'created_at': _fmt(row.created_at),
+            'updated_at': _fmt(row.updated_at)
+        }
+
+    comments = db.session.query(
+        MemoryComment.id, MemoryComment.memory_id, MemoryComment.parent_id,
+        MemoryComment.content, MemoryComment.likes_count, MemoryComment.created_at
+    ).filter(MemoryComment.user_id == user_id) \
+        .order_by(MemoryComment.id).yield_per(EXPORT_BATCH_SIZE)
+    for row in comments:
+        yield {
+            'type': 'comment',
+            'id': row.id,
+            'memory_id': row.memory_id,
+            'parent_id': row.parent_id,
+            'content': row.content,
+            'likes_count': row.likes_count,
+            'created_at': _fmt(row.created_at)
+        }
+
+
+def iter_ndjson(user_id, with_image_files=False):
+    """每条记录一行JSON"""
+    for record in iter_user_records(user_id, with_image_files):
+        yield (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+
+
+def _open_image(url):
+    """打开一张上传图片，找不到时返回None"""
+    storage = get_storage()
+    key = key_from_url(url)
+    try:
+        if key:
+            return storage.open(key)
+        if url.startswith('/uploads/'):
+            # 旧版平铺文件
+            path = safe_join(current_app.config['UPLOAD_FOLDER'], url[len('/uploads/'):])
+            return open(path, 'rb') if path else None
+    except (FileNotFoundError, IsADirectoryError):
+        return None
+    return None
+
+
+class _ZipSink:
+    """不可seek的写入端：zipfile写进来的字节暂存在这里，由生成器及时取走"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def iter_zip(user_id):
+    """边生成边输出ZIP：data.ndjson + 引用到的图片"""
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, 'w') as archive:
+        info = zipfile.ZipInfo('data.ndjson')
+        info.compress_type = zipfile.ZIP_DEFLATED
+        with archive.open(info, 'w', force_zip64=True) as entry:
+            for line in iter_ndjson(user_id, with_image_files=True):
+                entry.write(line)
+                data = sink.drain()
+                if data:
+                    yield data
+
+        # 第二遍只取图片列，逐张写入，图片本身已压缩，直接存储
+        rows = db.session.query(CampusMemory.id, CampusMemory.images) \
+            .filter(CampusMemory.user_id == user_id, CampusMemory.deleted_at.is_(None)) \
+            .order_by(CampusMemory.id).yield_per(EXPORT_BATCH_SIZE)
+        for memory_id, images in rows:
+            for index, url in enumerate(json.loads(images) if images else []):
+                source = _open_image(url)
+                if source is None:
+                    continue
+                with source, archive.open(_image_name(memory_id, index, url), 'w') as entry:
+                    while True:
+                        chunk = source.read(CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        entry.write(chunk)
+                        data = sink.drain()
+                        if data:
+                            yield data
+                data = sink.drain()
+                if data:
+                    yield data
+    yield sink.drain()
+
+
+@click.command('export-user')
+@click.argument('user_id', type=int)
+@click.option('--format', 'fmt', type=click.Choice(['ndjson', 'zip']), default='zip', help='导出格式')
+@click.option('-o', '--output', type=click.Path(dir_okay=False), required=True, help='输出文件')
+@with_appcontext
+def export_user_command(user_id, fmt, output):
+    """导出一个用户的全部数据"""
+    if not User.query.get(user_id):
+        raise click.ClickException(f'用户不存在：{user_id}')
+
+    chunks = iter_zip(user_id) if fmt == 'zip' else iter_ndjson(user_id)
+    written = 0
+    with open(output, 'wb') as out:
+        for chunk in chunks:
+            out.write(chunk)
+            written += len(chunk)
+    click.echo(f'已导出 {written} 字节到 {output}')
@@ -0,0 +1,89 @@
+# fileserve.py - 上传文件服务（sendfile / Range / 条件GET / 前置代理卸载）
+import os
+
+from flask import current_app, request, send_file, abort
+from werkzeug.security import safe_join
+
+from storage import get_storage, key_from_url, CONTENT_TYPES, UPLOAD_URL_PREFIX
+
+# 内容寻址文件永不改变，缓存一年并标记immutable
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+def _mimetype(filename):
+    return CONTENT_TYPES.get(filename.rsplit('.', 1)[-1].lower(), 'application/octet-stream')
+
+
+def _accel_response(path, relative, etag, max_age, immutable, mimetype):
+    """交给前置代理发送文件内容，Python只返回响应头"""
+    mode = current_app.config.get('UPLOAD_ACCEL_MODE')
+    rv = current_app.response_class(mimetype=mimetype)
+    if mode == 'nginx':
+        # nginx 中对应 location 需配置为 internal
+        rv.headers['X-Accel-Redirect'] = current_app.config['UPLOAD_ACCEL_PREFIX'] + relative
+    else:
+        # Apache mod_xsendfile / lighttpd
+        rv.headers['X-Sendfile'] = path
+    if etag:
+        rv.set_etag(etag)
+    rv.cache_control.public = True
+    rv.cache_control.max_age = max_age
+    if immutable:
+        rv.cache_control.immutable = True
+    # 条件请求仍由应用判断，命中时直接304，不再惊动代理
+    rv = rv.make_conditional(request.environ)
+    if rv.status_code == 304:
+        rv.headers.pop('X-Accel-Redirect', None)
+        rv.headers.pop('X-Sendfile', None)
+    return rv
+
+
+def _send(path_or_file, etag, max_age, immutable, mimetype, relative=None):
+    if relative is not None and current_app.config.get('UPLOAD_ACCEL_MODE'):
+        return _accel_response(path_or_file, relative, etag, max_age, immutable, mimetype)
+
+    # send_file 在 conditional=True 时处理 Range / If-None-Match / If-Range，
+    # 文件对象经 wsgi.file_wrapper 交给 gunicorn，走 sendfile 零拷贝
+    rv = send_file(path_or_file, mimetype=mimetype, conditional=True,
+                   etag=etag if etag else True, max_age=max_age)
+    rv.cache_control.public = True
+    if immutable:
+        rv.cache_control.immutable = True
+    return rv
+
+
+def serve_upload(filename):
+    """发送 /uploads/ 下的文件"""
+    mimetype = _mimetype(filename)
+    key = key_from_url(UPLOAD_URL_PREFIX + filename)
+
+    if key is None:
+        # 旧版平铺存储的文件：不可变性无法保证，使用较短的缓存时间和基于mtime的ETag。
+        # 旧文件名都经过 secure_filename，不含目录也不以点开头；其余名字（如上传暂存目录 .tmp/ 下
+        # 写了一半的 .part 文件）一律不提供
+        if '/' in filename or '\\' in filename or filename.startswith('.'):
+            abort(404)
+        path = safe_join(current_app.config['UPLOAD_FOLDER'], filename)
+        if path is None or not os.path.isfile(path):
+            abort(404)
+        return _send(path, None, current_app.config['UPLOAD_LEGACY_MAX_AGE'], False,
+                     mimetype, relative=filename)
+
+    # sha256本身就是强ETag，不需要读文件
+    digest = key.rsplit('/', 1)[1]
+    storage = get_storage()
+    path = storage.local_path(key)
+    if path:
+        if not os.path.isfile(path):
+            abort(404)
+        relative = os.path.relpath(path, current_app.config['UPLOAD_FOLDER']).replace(os.sep, '/')
+        # 对象不在上传目录下（如S3本地替身）时无法交给代理
+        if relative.startswith('..'):
+            relative = None
+        return _send(path, digest, IMMUTABLE_MAX_AGE, True, mimetype, relative=relative)
+
+    try:
+        body = storage.open(key)
+    except FileNotFoundError:
+        abort(404)
+    return _send(body, digest, IMMUTABLE_MAX_AGE, True, mimetype)
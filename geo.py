@@ -0,0 +1,117 @@
+# geo.py - 建筑坐标的空间索引：经纬度 -> 最近的几个建筑
+#
+# 坐标存在 buildings 表（flask buildings sync 从 CAMPUSES[校区]['coordinates'] 写入）。
+# 每个worker按校区在内存里建一棵二维 KD 树：一个校区只有几公里见方，
+# 把经纬度按等距圆柱投影到以米为单位的平面上，误差远小于建筑本身的尺寸。
+# 建筑表的指纹（与地图预览相同）变化时重建，重建只是一次小查询加排序。
+import heapq
+import math
+import threading
+
+from building_summary import buildings_fingerprint, catalog
+
+EARTH_RADIUS = 6371000.0  # 米
+
+# 校区 -> {'fingerprint', 'index'}
+_index_cache = {}
+_index_lock = threading.Lock()
+
+
+class KDTree:
+    """节点为 (点, 数据, 划分轴, 左子树, 右子树)。点是平面坐标 (x, y)"""
+
+    def __init__(self, points):
+        """points: [((x, y), 数据)]"""
+        self.size = len(points)
+        self.root = self._build(list(points), 0)
+
+    def _build(self, points, depth):
+        if not points:
+            return None
+        axis = depth % 2
+        points.sort(key=lambda p: p[0][axis])
+        mid = len(points) // 2
+        point, item = points[mid]
+        return (point, item, axis,
+                self._build(points[:mid], depth + 1),
+                self._build(points[mid + 1:], depth + 1))
+
+    def nearest(self, x, y, k=1, max_distance=None):
+        """返回最近的 k 个 [(距离, 数据)]，按距离升序；max_distance 以外的不要"""
+        if k <= 0:
+            return []
+        bound = max_distance ** 2 if max_distance is not None else math.inf
+        best = []  # 大小为 k 的最大堆：(-距离平方, 序号, 数据)
+        counter = 0
+        stack = [(self.root, 0.0)]  # (子树, 查询点到子树所在半平面的距离平方)
+        while stack:
+            node, plane_d2 = stack.pop()
+            limit = -best[0][0] if len(best) == k else bound
+            if node is None or plane_d2 > limit:
+                continue
+            (px, py), item, axis, left, right = node
+            d2 = (px - x) ** 2 + (py - y) ** 2
+            if d2 <= limit:
+                counter += 1
+                if len(best) == k:
+                    heapq.heapreplace(best, (-d2, counter, item))
+                else:
+                    heapq.heappush(best, (-d2, counter, item))
+            diff = (x if axis == 0 else y) - (px if axis == 0 else py)
+            near, far = (left, right) if diff < 0 else (right, left)
+            # 后压入的先出栈：先走查询点所在的一侧，另一侧出栈时分割线仍够近才看
+            stack.append((far, max(plane_d2, diff ** 2)))
+            stack.append((near, plane_d2))
+        return [(math.sqrt(-d2), item) for d2, _, item in sorted(best, reverse=True)]
+
+
+class CampusIndex:
+    """一个校区的建筑空间索引。以校区建筑的平均经纬度为投影原点"""
+
+    def __init__(self, buildings):
+        located = [b for b in buildings if b.latitude is not None and b.longitude is not None]
+        if located:
+            self.lat0 = sum(b.latitude for b in located) / len(located)
+            self.lon0 = sum(b.longitude for b in located) / len(located)
+        else:
+            self.lat0 = self.lon0 = 0.0
+        self.cos_lat0 = math.cos(math.radians(self.lat0))
+        self.tree = KDTree([(self.project(b.latitude, b.longitude), self._snapshot(b)) for b in located])
+
+    @staticmethod
+    def _snapshot(building):
+        # 建筑变化时整个索引会重建，这里直接存一份预览数据，查询时不用再查建筑表
+        data = building.to_preview_dict()
+        del data['latest']
+        return data
+
+    def project(self, lat, lon):
+        """经纬度 -> 以原点为中心、单位为米的平面坐标"""
+        return (math.radians(lon - self.lon0) * self.cos_lat0 * EARTH_RADIUS,
+                math.radians(lat - self.lat0) * EARTH_RADIUS)
+
+    def __len__(self):
+        return self.tree.size
+
+    def nearest(self, lat, lon, k=3, max_distance=None):
+        """返回 [(距离米数, 建筑预览)]"""
+        x, y = self.project(lat, lon)
+        return self.tree.nearest(x, y, k, max_distance)
+
+
+def campus_index(campus):
+    """取本校区的空间索引，建筑表有变化时重建"""
+    fingerprint = buildings_fingerprint(campus)
+    with _index_lock:
+        cached = _index_cache.get(campus)
+        if cached and cached['fingerprint'] == fingerprint:
+            return cached['index']
+
+    index = CampusIndex(catalog(campus))
+    with _index_lock:
+        _index_cache[campus] = {'fingerprint': fingerprint, 'index': index}
+    return index
+
+
+def nearest_buildings(campus, lat, lon, k=3, max_distance=None):
+    return campus_index(campus).nearest(lat, lon, k, max_distance)
@@ -0,0 +1,22 @@
+# gunicorn.conf.py - gunicorn 默认会读取当前目录下的这个文件
+
+# 主进程先导入应用（包括预渲染页面），worker fork 后按写时复制共享这部分内存
+preload_app = True
+
+
+def post_fork(server, worker):
+    """连接池不能跨进程共享：丢弃从主进程继承的连接（不关闭，主进程可能还在用）"""
+    from app import app
+    from exts import db
+    with app.app_context():
+        db.engine.dispose(close=False)
+        # 每个worker先把用户名/学号索引建好，第一个注册请求不用等全表扫描
+        from availability import availability_index
+        availability_index.refresh()
+        db.session.remove()
+
+
+def worker_exit(server, worker):
+    """worker退出前把缓冲中的活动日志写完"""
+    from activity import activity_logger
+    activity_logger.shutdown()
@@ -0,0 +1,329 @@
+# jobs.py - 持久化的后台任务队列 + flask worker
+#
+# 路由里调用 enqueue() 把任务写进 jobs 表，和业务数据在同一个事务里提交：
+# 事务回滚任务也不存在，提交后 worker 才能看到。worker 进程里若干线程轮询取任务：
+#   - 优先级高的先执行，同优先级按 run_at 先后；
+#   - 失败后按指数退避（带抖动）重新排队，超过 max_attempts 标记为 failed；
+#   - 相同 idempotency_key 的任务只入队一次；
+#   - 任务可声明并发上限（所有 worker 合计同时执行的个数）；
+#   - 执行超过 JOB_LEASE_SECONDS 的任务视为 worker 已退出，重新入队。
+# 任务可能被执行多次（重试、租约过期），任务函数必须是幂等的。
+import importlib
+import json
+import os
+import random
+import signal
+import socket
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import select, update, delete, func
+from sqlalchemy.exc import IntegrityError
+
+from exts import db
+from model import Job
+
+# 定义了任务的模块，worker 启动时导入
+TASK_MODULES = ('purge', 'counters', 'changelog')
+
+
+# ===== 任务注册 =====
+
+class Task:
+    def __init__(self, name, func, concurrency=None):
+        self.name = name
+        self.func = func
+        self.concurrency = concurrency
+
+
+TASKS = {}
+
+
+def task(name, concurrency=None):
+    """注册任务函数：fn(**payload)。concurrency 为所有 worker 合计的并发上限"""
+    def decorator(func):
+        TASKS[name] = Task(name, func, concurrency)
+        return func
+    return decorator
+
+
+def load_tasks():
+    for module in TASK_MODULES:
+        importlib.import_module(module)
+    return TASKS
+
+
+# ===== 入队 =====
+
+def enqueue(task_name, payload=None, key=None, priority=0, delay=0, max_attempts=None):
+    """在调用方事务中加入一个任务（不提交）。key 相同的任务已存在时返回已有的任务"""
+    if key:
+        existing = Job.query.filter_by(idempotency_key=key).first()
+        if existing is not None:
+            return existing
+
+    job = Job(
+        task=task_name,
+        payload=json.dumps(payload or {}, ensure_ascii=False),
+        priority=priority,
+        status='queued',
+        attempts=0,
+        max_attempts=max_attempts or current_app.config.get('JOB_MAX_ATTEMPTS', 5),
+        run_at=datetime.utcnow() + timedelta(seconds=delay),
+        idempotency_key=key,
+    )
+    if not key:
+        db.session.add(job)
+        return job
+    try:
+        with db.session.begin_nested():
+            db.session.add(job)
+    except IntegrityError:
+        # 另一个请求同时入队了相同的任务
+        job = Job.query.filter_by(idempotency_key=key).first()
+    return job
+
+
+# ===== 执行 =====
+
+def retry_delay(attempts):
+    base = current_app.config.get('JOB_RETRY_BASE_SECONDS', 10)
+    cap = current_app.config.get('JOB_RETRY_MAX_SECONDS', 3600)
+    return min(cap, base * 2 ** (attempts - 1)) * random.uniform(0.5, 1.0)
+
+
+def _running_counts():
+    rows = db.session.execute(
+        select(Job.task, func.count(Job.id)).where(Job.status == 'running').group_by(Job.task)
+    ).all()
+    return dict(rows)
+
+
+def _release(job_id):
+    """把刚取到的任务放回队列（超出并发上限时），不计执行次数"""
+    db.session.execute(update(Job).where(Job.id == job_id, Job.status == 'running').values(
+        status='queued', attempts=Job.attempts - 1, locked_by=None, locked_at=None))
+    db.session.commit()
+
+
+def claim(worker_id, tasks, limit=20):
+    """取一个可执行的任务并标记为 running，没有时返回 None。
+    先读候选再用带 status 条件的 UPDATE 抢占，多个 worker 并发时只有一个能成功"""
+    now = datetime.utcnow()
+    candidates = db.session.execute(
+        select(Job.id, Job.task).where(Job.status == 'queued', Job.run_at <= now)
+        .order_by(Job.priority.desc(), Job.run_at, Job.id).limit(limit)
+    ).all()
+    if not candidates:
+        db.session.rollback()
+        return None
+
+    running = _running_counts()
+    for job_id, name in candidates:
+        spec = tasks.get(name)
+        if spec is not None and spec.concurrency and running.get(name, 0) >= spec.concurrency:
+            continue
+        result = db.session.execute(update(Job).where(Job.id == job_id, Job.status == 'queued').values(
+            status='running', attempts=Job.attempts + 1, locked_by=worker_id, locked_at=now))
+        db.session.commit()
+        if result.rowcount != 1:
+            continue  # 被其他 worker 抢先
+        # 其他 worker 可能同时取到了同类任务，抢占后再确认一次并发上限
+        if spec is not None and spec.concurrency and _running_counts().get(name, 0) > spec.concurrency:
+            _release(job_id)
+            continue
+        return db.session.get(Job, job_id)
+    db.session.rollback()
+    return None
+
+
+def execute(job, tasks):
+    """执行一个已取到的任务，返回最终状态"""
+    job_id, attempts, max_attempts = job.id, job.attempts, job.max_attempts
+    spec = tasks.get(job.task)
+    payload = json.loads(job.payload) if job.payload else {}
+    db.session.rollback()  # 任务在自己的事务里运行
+
+    try:
+        if spec is None:
+            raise LookupError(f'未注册的任务：{job.task}')
+        spec.func(**payload)
+    except Exception:
+        db.session.rollback()
+        error = traceback.format_exc(limit=5)[-4000:]
+        if attempts < max_attempts and spec is not None:
+            status = 'queued'
+            values = {'status': status, 'last_error': error, 'locked_by': None, 'locked_at': None,
+                      'run_at': datetime.utcnow() + timedelta(seconds=retry_delay(attempts))}
+        else:
+            status = 'failed'
+            values = {'status': status, 'last_error': error, 'finished_at': datetime.utcnow()}
+        current_app.logger.warning('任务 %s 第%d次执行失败', job_id, attempts)
+    else:
+        status = 'done'
+        values = {'status': status, 'finished_at': datetime.utcnow()}
+
+    db.session.execute(update(Job).where(Job.id == job_id).values(**values))
+    db.session.commit()
+    return status
+
+
+def requeue_stale(lease_seconds=None):
+    """租约过期的 running 任务重新入队（已用完次数的标记失败），返回处理的个数"""
+    if lease_seconds is None:
+        lease_seconds = current_app.config.get('JOB_LEASE_SECONDS', 900)
+    cutoff = datetime.utcnow() - timedelta(seconds=lease_seconds)
+    stale = (Job.status == 'running', Job.locked_at < cutoff)
+    failed = db.session.execute(update(Job).where(*stale, Job.attempts >= Job.max_attempts).values(
+        status='failed', last_error='执行超时（worker 未在租约内结束）', finished_at=datetime.utcnow())).rowcount
+    requeued = db.session.execute(update(Job).where(*stale).values(
+        status='queued', locked_by=None, locked_at=None, run_at=datetime.utcnow())).rowcount
+    db.session.commit()
+    return failed + requeued
+
+
+def prune_finished(days=None):
+    """删除超过保留天数的已完成/失败任务"""
+    if days is None:
+        days = current_app.config.get('JOB_KEEP_FINISHED_DAYS', 7)
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    removed = db.session.execute(delete(Job).where(
+        Job.status.in_(('done', 'failed')), Job.finished_at < cutoff)).rowcount
+    db.session.commit()
+    return removed
+
+
+class Worker:
+    """一个进程内的若干执行线程，每个线程有自己的应用上下文和数据库会话"""
+
+    # 维护（租约检查、清理旧任务）的间隔秒数
+    MAINTENANCE_INTERVAL = 60
+
+    def __init__(self, app, threads=1, burst=False):
+        self.app = app
+        self.threads = threads
+        self.burst = burst
+        self.name = f'{socket.gethostname()}:{os.getpid()}'
+        self.stopping = threading.Event()
+        self.tasks = load_tasks()
+        self.poll_interval = app.config.get('JOB_POLL_INTERVAL', 1.0)
+        self.processed = {'done': 0, 'queued': 0, 'failed': 0}
+        self._lock = threading.Lock()
+
+    def _loop(self, index):
+        worker_id = f'{self.name}:{index}'
+        with self.app.app_context():
+            while not self.stopping.is_set():
+                try:
+                    job = claim(worker_id, self.tasks)
+                except Exception:
+                    # 数据库暂时不可用等情况，稍后重试
+                    current_app.logger.exception('取任务失败')
+                    db.session.rollback()
+                    self.stopping.wait(self.poll_interval)
+                    continue
+                if job is None:
+                    if self.burst:
+                        return
+                    self.stopping.wait(self.poll_interval)
+                    continue
+                status = execute(job, self.tasks)
+                with self._lock:
+                    self.processed[status] += 1
+            db.session.remove()
+
+    def maintain(self):
+        with self.app.app_context():
+            requeue_stale()
+            prune_finished()
+            db.session.remove()
+
+    def run(self):
+        self.maintain()
+        workers = [threading.Thread(target=self._loop, args=(i,), name=f'job-worker-{i}')
+                   for i in range(self.threads)]
+        for thread in workers:
+            thread.start()
+        last_maintenance = time.monotonic()
+        while any(thread.is_alive() for thread in workers):
+            for thread in workers:
+                thread.join(timeout=1)
+            if not self.burst and time.monotonic() - last_maintenance > self.MAINTENANCE_INTERVAL:
+                self.maintain()
+                last_maintenance = time.monotonic()
+        return self.processed
+
+    def stop(self, *_):
+        # 不打断正在执行的任务，执行完当前任务后退出
+        self.stopping.set()
+
+
+# ===== 命令行 =====
+
+@click.command('worker')
+@click.option('--threads', default=2, show_default=True, help='执行线程数')
+@click.option('--burst', is_flag=True, help='队列里没有可执行的任务时退出（适合定时任务或调试）')
+@with_appcontext
+def worker_command(threads, burst):
+    """启动后台任务 worker，收到 SIGTERM/SIGINT 后执行完当前任务再退出"""
+    worker = Worker(current_app._get_current_object(), threads, burst)
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    click.echo(f'worker {worker.name} 已启动，任务：{", ".join(sorted(worker.tasks))}')
+    processed = worker.run()
+    click.echo(f'worker 退出：完成 {processed["done"]}，待重试 {processed["queued"]}，失败 {processed["failed"]}')
+
+
+@click.group('jobs')
+def jobs_cli():
+    """后台任务队列"""
+
+
+@jobs_cli.command('status')
+@with_appcontext
+def status_command():
+    """按任务、状态统计队列中的任务"""
+    rows = db.session.execute(
+        select(Job.task, Job.status, func.count(Job.id), func.min(Job.run_at))
+        .group_by(Job.task, Job.status).order_by(Job.task, Job.status)
+    ).all()
+    if not rows:
+        click.echo('队列为空')
+    for name, status, count, run_at in rows:
+        extra = f'，最早 {run_at:%Y-%m-%d %H:%M:%S}' if status == 'queued' and run_at else ''
+        click.echo(f'{name:<24}{status:<8}{count}{extra}')
+
+
+@jobs_cli.command('enqueue')
+@click.argument('task_name')
+@click.option('--payload', default='{}', help='任务参数JSON')
+@click.option('--key', default=None, help='幂等键')
+@click.option('--priority', default=0, show_default=True)
+@click.option('--delay', default=0, show_default=True, help='延迟秒数')
+@with_appcontext
+def enqueue_command(task_name, payload, key, priority, delay):
+    """手动加入一个任务（如 flask jobs enqueue counters.reconcile）"""
+    if task_name not in load_tasks():
+        raise click.BadParameter(f'未注册的任务，可用：{", ".join(sorted(TASKS))}')
+    job = enqueue(task_name, json.loads(payload), key, priority, delay)
+    db.session.commit()
+    click.echo(f'任务 {job.id}（{job.status}）')
+
+
+@jobs_cli.command('retry')
+@click.option('--task', 'task_name', default=None, help='只重试某种任务')
+@with_appcontext
+def retry_command(task_name):
+    """把失败的任务重新入队（执行次数清零）"""
+    query = update(Job).where(Job.status == 'failed')
+    if task_name:
+        query = query.where(Job.task == task_name)
+    count = db.session.execute(query.values(
+        status='queued', attempts=0, run_at=datetime.utcnow(), finished_at=None)).rowcount
+    db.session.commit()
+    click.echo(f'已重新入队 {count} 个任务')
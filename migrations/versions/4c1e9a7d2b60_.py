@@ -0,0 +1,42 @@
+"""users table
+
+Revision ID: 4c1e9a7d2b60
+Revises: 
+Create Date: 2026-10-19 09:12:41.508233
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4c1e9a7d2b60'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+# users 表原来只由 db.create_all() 创建，迁移里一直没有。放在最前面，
+# 后面各表的外键才能在全新数据库上建立。已有数据库的版本号在它之后，不会重复执行。
+def upgrade():
+    op.create_table('users',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('username', sa.String(length=50), nullable=False),
+    sa.Column('student_id', sa.String(length=20), nullable=False),
+    sa.Column('password_hash', sa.String(length=128), nullable=False),
+    sa.Column('nickname', sa.String(length=50), nullable=True),
+    sa.Column('gender', sa.String(length=10), nullable=True),
+    sa.Column('college', sa.String(length=50), nullable=True),
+    sa.Column('avatar', sa.Text(), nullable=True),
+    sa.Column('email', sa.String(length=100), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('last_login', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id', name=op.f('pk_users')),
+    sa.UniqueConstraint('email', name=op.f('uq_users_email')),
+    sa.UniqueConstraint('student_id', name=op.f('uq_users_student_id')),
+    sa.UniqueConstraint('username', name=op.f('uq_users_username'))
+    )
+
+
+def downgrade():
+    op.drop_table('users')
@@ -1,7 +1,7 @@
 """empty message
 
 Revision ID: b5ae00a23155
-Revises: 
+Revises: 4c1e9a7d2b60
 Create Date: 2026-01-30 22:50:17.302875
 
 """
@@ -11,7 +11,7 @@ import sqlalchemy as sa
 
 # revision identifiers, used by Alembic.
 revision = 'b5ae00a23155'
-down_revision = None
+down_revision = '4c1e9a7d2b60'
 branch_labels = None
 depends_on = None
 
@@ -6,6 +6,15 @@ import json
 
 from exts import db
 
+# 多校区之前的数据都属于北邮本部，迁移时以此填充校区列
+LEGACY_CAMPUS = 'bupt'
+
+
+def hash_password(password):
+    """sha256+盐值，返回 '<hash>:<salt>'（模块级函数，批量导入时可在进程池中调用）"""
+    salt = uuid.uuid4().hex
+    return hashlib.sha256((password + salt).encode()).hexdigest() + ':' + salt
+
 
 class User(db.Model):
     __tablename__ = 'users'
@@ -24,8 +33,7 @@ class User(db.Model):
 
     def set_password(self, password):
         """安全地设置密码（使用sha256+盐值）"""
-        salt = uuid.uuid4().hex
-        self.password_hash = hashlib.sha256((password + salt).encode()).hexdigest() + ':' + salt
+        self.password_hash = hash_password(password)
 
     def check_password(self, password):
         """验证密码"""
@@ -53,22 +61,50 @@ class CampusMemory(db.Model):
     __tablename__ = 'campus_memories'
 
     id = db.Column(db.Integer, primary_key=True)
+    campus = db.Column(db.String(20), nullable=False, default=LEGACY_CAMPUS, server_default=LEGACY_CAMPUS)  # 校区（分区键）
     building = db.Column(db.String(50), nullable=False)  # 建筑名称
     content = db.Column(db.Text, nullable=False)  # 记忆内容
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     images = db.Column(db.Text, default='[]')  # 存储图片的JSON字符串数组
     likes_count = db.Column(db.Integer, default=0)
     comments_count = db.Column(db.Integer, default=0)
+    hot_score = db.Column(db.Float, default=0, server_default='0', nullable=False)  # 时间衰减热度（见trending.py）
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    deleted_at = db.Column(db.DateTime, nullable=True)  # 软删除时间，关联数据由 purge.py 清理
+
+    # 列表类索引都以校区开头，每个校区的查询只扫描自己的一段
+    __table_args__ = (
+        # 热门列表按热度倒序的索引范围扫描
+        db.Index('ix_campus_memories_campus_hot', 'campus', 'hot_score', 'id'),
+        db.Index('ix_campus_memories_campus_building_hot', 'campus', 'building', 'hot_score', 'id'),
+        # 时间线：全校按时间倒序 / 各建筑按时间倒序
+        db.Index('ix_campus_memories_campus_created', 'campus', 'created_at', 'id'),
+        db.Index('ix_campus_memories_campus_building_created', 'campus', 'building', 'created_at', 'id'),
+        # 建筑记忆流的ETag指纹（count + max(updated_at)）只读索引
+        db.Index('ix_campus_memories_campus_building_updated', 'campus', 'building', 'updated_at'),
+        # 后台清理扫描已软删除的记忆
+        db.Index('ix_campus_memories_deleted', 'deleted_at'),
+    )
 
     # 建立与用户的关系
     user = db.relationship('User', backref='campus_memories')
 
+    @classmethod
+    def visible(cls):
+        """未被删除的记忆，所有列表和查找都应从这里开始"""
+        return cls.query.filter(cls.deleted_at.is_(None))
+
+    @classmethod
+    def in_campus(cls, campus):
+        """某个校区未被删除的记忆"""
+        return cls.visible().filter(cls.campus == campus)
+
     def to_dict(self):
         """将记忆对象转为字典"""
         return {
             'id': self.id,
+            'campus': self.campus,
             'building': self.building,
             'content': self.content,
             'user_id': self.user_id,
@@ -86,8 +122,9 @@ class CampusMemory(db.Model):
             'updated_at': self.updated_at.strftime('%Y-%m-%d %H:%M:%S') if self.updated_at else None
         }
 
-    def to_frontend_dict(self):
-        """为前端优化的格式"""
+    def to_frontend_dict(self, author=None):
+        """为前端优化的格式。author 为预先批量查好的作者信息，传入时不再懒加载 user"""
+        user = author if author is not None else self.user
         images = []
         if self.images:
             try:
@@ -99,8 +136,8 @@ class CampusMemory(db.Model):
             'id': self.id,
             'building': self.building,
             'content': self.content,
-            'name': self.user.nickname or self.user.username if self.user else '匿名',
-            'avatar': self.user.avatar if self.user else '/static/default-avatar.jpg',
+            'name': user.nickname or user.username if user else '匿名',
+            'avatar': user.avatar if user else '/static/default-avatar.jpg',
             'images': images,
             'likes_count': self.likes_count,
             'comments_count': self.comments_count,
@@ -114,12 +151,21 @@ class Diary(db.Model):
     __tablename__ = 'diaries'
 
     id = db.Column(db.Integer, primary_key=True)
+    campus = db.Column(db.String(20), nullable=False, default=LEGACY_CAMPUS, server_default=LEGACY_CAMPUS)  # 校区（分区键）
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     location = db.Column(db.String(50), nullable=False)  # 地点名称
     content = db.Column(db.Text, nullable=False)  # 日记内容
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')  # 每次修改加一，用于乐观并发控制
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    # 按校区+用户+地点分组、按时间倒序的查询都走这个索引
+    __table_args__ = (
+        db.Index('ix_diaries_campus_user_location_created', 'campus', 'user_id', 'location', 'created_at'),
+    )
+    # UPDATE 带上 WHERE version = 读取时的版本，并发修改时抛出 StaleDataError
+    __mapper_args__ = {'version_id_col': version}
+
     # 建立与用户的关系
     user = db.relationship('User', backref='diaries')
 
@@ -128,8 +174,10 @@ class Diary(db.Model):
         return {
             'id': self.id,
             'user_id': self.user_id,
+            'campus': self.campus,
             'location': self.location,
             'content': self.content,
+            'version': self.version,
             'user_info': {
                 'username': self.user.username,
                 'nickname': self.user.nickname or self.user.username,
@@ -141,6 +189,30 @@ class Diary(db.Model):
         }
 
 
+class DiaryRevision(db.Model):
+    __tablename__ = 'diary_revisions'
+
+    # 日记的历史版本：只存把下一个版本还原成该版本的反向补丁（见 revisions.py）
+    id = db.Column(db.Integer, primary_key=True)
+    diary_id = db.Column(db.Integer, db.ForeignKey('diaries.id'), nullable=False)
+    version = db.Column(db.Integer, nullable=False)  # 还原出的版本号
+    delta = db.Column(db.Text, nullable=False)  # 补丁JSON
+    size = db.Column(db.Integer, default=0)  # 补丁JSON长度
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('diary_id', 'version', name='uq_diary_revision_version'),
+    )
+
+    def to_dict(self):
+        """将修订对象转为字典（不含补丁内容）"""
+        return {
+            'version': self.version,
+            'size': self.size,
+            'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S') if self.created_at else None
+        }
+
+
 class MemoryComment(db.Model):
     __tablename__ = 'memory_comments'
 
@@ -152,6 +224,11 @@ class MemoryComment(db.Model):
     likes_count = db.Column(db.Integer, default=0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    # 按记忆取评论、按记忆统计评论数（计数校正）都走这个索引
+    __table_args__ = (
+        db.Index('ix_memory_comments_memory_created', 'memory_id', 'created_at'),
+    )
+
     # 建立关系
     memory = db.relationship('CampusMemory', backref='memory_comments')
     user = db.relationship('User', backref='memory_comments')
@@ -242,12 +319,23 @@ class Notification(db.Model):
     is_read = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_notifications_user_created', 'user_id', 'created_at'),  # 用户通知列表
+        db.Index('ix_notifications_created', 'created_at'),  # 过期归档扫描
+    )
+
     # 建立关系
     user = db.relationship('User', foreign_keys=[user_id], backref='received_notifications')
     from_user = db.relationship('User', foreign_keys=[from_user_id], backref='sent_notifications')
     memory = db.relationship('CampusMemory', backref='notifications')
     comment = db.relationship('MemoryComment', backref='notifications')
 
+    @staticmethod
+    def not_hidden():
+        """过滤条件：关联记忆已被软删除的通知不再显示（清理任务随后会删掉它们）"""
+        return ~db.exists().where(CampusMemory.id == Notification.memory_id,
+                                  CampusMemory.deleted_at.isnot(None))
+
     def to_dict(self):
         """将通知对象转为字典"""
         return {
@@ -271,25 +359,51 @@ class Building(db.Model):
     __tablename__ = 'buildings'
 
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(50), unique=True, nullable=False)  # 建筑名称
+    campus = db.Column(db.String(20), nullable=False, default=LEGACY_CAMPUS, server_default=LEGACY_CAMPUS)  # 校区（分区键）
+    name = db.Column(db.String(50), nullable=False)  # 建筑名称，校区内唯一
+    position = db.Column(db.Integer)  # 在校区建筑目录（地图）中的顺序，为空的排在最后
+    latitude = db.Column(db.Float)  # 纬度（WGS84），由 flask buildings sync 从配置写入
+    longitude = db.Column(db.Float)  # 经度
     description = db.Column(db.Text)  # 建筑描述
     image_url = db.Column(db.String(200))  # 建筑图片URL
     memories_count = db.Column(db.Integer, default=0)  # 相关记忆数量
     diaries_count = db.Column(db.Integer, default=0)  # 相关日记数量
+    preview = db.Column(db.Text, default='{}')  # 预先生成的地图预览（最新几条记忆、封面图）JSON
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        # 同时是按校区取建筑目录的索引
+        db.UniqueConstraint('campus', 'name', name='uq_buildings_campus_name'),
+    )
 
     def to_dict(self):
         """将建筑对象转为字典"""
         return {
             'id': self.id,
+            'campus': self.campus,
             'name': self.name,
             'description': self.description,
             'image_url': self.image_url,
             'memories_count': self.memories_count,
             'diaries_count': self.diaries_count,
+            'latitude': self.latitude,
+            'longitude': self.longitude,
             'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S') if self.created_at else None
         }
 
+    def to_preview_dict(self):
+        """地图预览用的格式"""
+        preview = json.loads(self.preview) if self.preview else {}
+        return {
+            'name': self.name,
+            'count': self.memories_count or 0,
+            'cover': preview.get('cover') or self.image_url,
+            'latest': preview.get('latest', []),
+            'latitude': self.latitude,
+            'longitude': self.longitude
+        }
+
 
 class UserActivity(db.Model):
     __tablename__ = 'user_activities'
@@ -304,6 +418,11 @@ class UserActivity(db.Model):
     user_agent = db.Column(db.Text)  # 用户代理
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_user_activities_user_created', 'user_id', 'created_at'),
+        db.Index('ix_user_activities_created', 'created_at'),  # 过期归档扫描
+    )
+
     # 建立关系
     user = db.relationship('User', backref='activities')
 
@@ -318,4 +437,171 @@ class UserActivity(db.Model):
             'ip_address': self.ip_address,
             'user_agent': self.user_agent[:200] if self.user_agent else None,
             'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S') if self.created_at else None
-        }
\ No newline at end of file
+        }
+
+class StoredFile(db.Model):
+    __tablename__ = 'stored_files'
+
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), unique=True, nullable=False)  # 内容哈希，同时决定存储路径
+    size = db.Column(db.Integer, nullable=False)  # 文件字节数
+    content_type = db.Column(db.String(50))  # MIME类型
+    ref_count = db.Column(db.Integer, default=0, nullable=False)  # 被引用次数，为0时可回收
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        """将存储文件对象转为字典"""
+        return {
+            'id': self.id,
+            'sha256': self.sha256,
+            'size': self.size,
+            'content_type': self.content_type,
+            'ref_count': self.ref_count,
+            'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S') if self.created_at else None
+        }
+
+
+class NotificationArchive(db.Model):
+    __tablename__ = 'notifications_archive'
+
+    # 与 notifications 相同的列，不建外键，归档数据不影响主表的删除
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False, index=True)
+    from_user_id = db.Column(db.Integer, nullable=False)
+    type = db.Column(db.String(20), nullable=False)
+    memory_id = db.Column(db.Integer, nullable=True)
+    comment_id = db.Column(db.Integer, nullable=True)
+    content = db.Column(db.Text)
+    is_read = db.Column(db.Boolean, default=False)
+    created_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)  # 归档时间
+
+
+class UserActivityArchive(db.Model):
+    __tablename__ = 'user_activities_archive'
+
+    # 与 user_activities 相同的列，不建外键
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False, index=True)
+    activity_type = db.Column(db.String(30), nullable=False)
+    target_type = db.Column(db.String(20), nullable=True)
+    target_id = db.Column(db.Integer, nullable=True)
+    ip_address = db.Column(db.String(45))
+    user_agent = db.Column(db.Text)
+    created_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)  # 归档时间
+
+
+class AppState(db.Model):
+    __tablename__ = 'app_state'
+
+    # 全局的小型键值状态（如热度基准时间、后台任务的断点）
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(50), unique=True, nullable=False)
+    value = db.Column(db.Text)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    @classmethod
+    def get_value(cls, key, default=None):
+        state = cls.query.filter_by(key=key).first()
+        return state.value if state else default
+
+    @classmethod
+    def set_value(cls, key, value):
+        """设置键值（不提交，随调用方事务一起提交）"""
+        state = cls.query.filter_by(key=key).first()
+        if state is None:
+            state = cls(key=key)
+            db.session.add(state)
+        state.value = value
+        return state
+
+
+class ModerationFlag(db.Model):
+    __tablename__ = 'moderation_flags'
+
+    # 命中 flag 类敏感词、照常发布但需要人工复查的内容（见 moderation.py）
+    id = db.Column(db.Integer, primary_key=True)
+    target_type = db.Column(db.String(20), nullable=False)  # 'memory', 'comment'
+    target_id = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    words = db.Column(db.Text)  # 命中的词JSON数组
+    reviewed = db.Column(db.Boolean, default=False, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_moderation_flags_reviewed_created', 'reviewed', 'created_at'),
+    )
+
+    def to_dict(self):
+        """将审核记录转为字典"""
+        return {
+            'id': self.id,
+            'target_type': self.target_type,
+            'target_id': self.target_id,
+            'user_id': self.user_id,
+            'words': json.loads(self.words) if self.words else [],
+            'reviewed': self.reviewed,
+            'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S') if self.created_at else None
+        }
+
+
+class ChangeLog(db.Model):
+    __tablename__ = 'change_log'
+
+    # 记忆、日记、通知的变更记录（见 changelog.py），自增id即增量同步的令牌
+    id = db.Column(db.Integer, primary_key=True)
+    entity = db.Column(db.String(20), nullable=False)  # 'memory', 'diary', 'notification'
+    entity_id = db.Column(db.Integer, nullable=True)  # 为空表示该用户的全部（如清空通知）
+    op = db.Column(db.String(10), nullable=False)  # 'upsert', 'delete', 'clear'
+    campus = db.Column(db.String(20), nullable=True)  # 记忆、日记所属校区
+    user_id = db.Column(db.Integer, nullable=True)  # 日记、通知的所属用户（记忆对校区内所有人可见，为空）
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_change_log_campus_id', 'campus', 'id'),
+        db.Index('ix_change_log_user_id', 'user_id', 'id'),
+        db.Index('ix_change_log_created', 'created_at'),  # 稳定令牌、过期清理
+    )
+
+
+class Job(db.Model):
+    __tablename__ = 'jobs'
+
+    # 后台任务队列（见 jobs.py），由 flask worker 执行
+    id = db.Column(db.Integer, primary_key=True)
+    task = db.Column(db.String(50), nullable=False)  # 任务名，如 'purge.memory'
+    payload = db.Column(db.Text, default='{}')  # 任务参数JSON
+    priority = db.Column(db.Integer, default=0, nullable=False)  # 越大越先执行
+    status = db.Column(db.String(10), default='queued', nullable=False)  # queued / running / done / failed
+    attempts = db.Column(db.Integer, default=0, nullable=False)  # 已开始执行的次数
+    max_attempts = db.Column(db.Integer, default=5, nullable=False)
+    run_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)  # 最早执行时间，重试时按退避推后
+    idempotency_key = db.Column(db.String(100), unique=True, nullable=True)  # 相同键的任务只入队一次
+    locked_by = db.Column(db.String(64))  # 正在执行的worker
+    locked_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        # worker取任务：status='queued' 内按优先级、时间顺序扫描
+        db.Index('ix_jobs_status_priority_run_at', 'status', 'priority', 'run_at'),
+    )
+
+    def to_dict(self):
+        """将任务对象转为字典"""
+        return {
+            'id': self.id,
+            'task': self.task,
+            'payload': json.loads(self.payload) if self.payload else {},
+            'priority': self.priority,
+            'status': self.status,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'run_at': self.run_at.strftime('%Y-%m-%d %H:%M:%S') if self.run_at else None,
+            'last_error': self.last_error,
+            'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S') if self.created_at else None,
+            'finished_at': self.finished_at.strftime('%Y-%m-%d %H:%M:%S') if self.finished_at else None
+        }
@@ -0,0 +1,156 @@
+# pages.py - 页面预渲染：启动时把没有服务端变量的页面渲染好，带内容哈希的静态资源地址，
+# 连同压缩版本一起放在内存里，请求时只做一次ETag比较
+import gzip
+import hashlib
+import os
+import re
+import threading
+
+import click
+from flask import current_app, render_template, request
+from flask.cli import with_appcontext
+
+from campus import PATH_PREFIX
+from compression import brotli, choose_encoding
+
+# 端点名 -> 模板。只有列在这里的模板会被预渲染，*Old.html 等旧模板不参与
+PAGES = {
+    'index': 'index.html',
+    'campus': '校园记忆.html',
+    'my_bupt': 'my-bupt.html',
+}
+
+# 模板里的 /static/xxx 引用（HTML属性、CSS url()、JS字符串）
+STATIC_REF = re.compile(r'/static/([^"\'\s()<>?#]+)')
+
+# 页面脚本里写死的站内地址：'/api'、'/my-bupt'、'/campus'、'/'。
+# 通过 /c/<校区> 前缀访问时要加上前缀，静态资源各校区共用，不改
+APP_PATH_REF = re.compile(r'''(?<=['"])/(?=(?:api|my-bupt|campus)?['"])''')
+
+# 带 ?v= 的静态资源内容变了地址就变，可以长期缓存
+STATIC_VERSIONED_MAX_AGE = 365 * 24 * 3600
+
+
+class RenderedPage:
+    def __init__(self, html):
+        self.body = html.encode('utf-8')
+        self.etag = hashlib.sha256(self.body).hexdigest()[:20]
+        # 启动时一次性生成各编码版本（brotli 11级耗时是9级的7倍，体积只小约8%）
+        self.variants = {None: self.body, 'gzip': gzip.compress(self.body, compresslevel=9)}
+        if brotli is not None:
+            self.variants['br'] = brotli.compress(self.body, quality=9)
+
+    def etag_for(self, encoding):
+        # 不同编码的字节不同，强ETag也要区分
+        return self.etag if encoding is None else f'{self.etag}-{encoding}'
+
+
+class PageCache:
+    def __init__(self):
+        self._pages = {}
+        self._asset_versions = {}
+        self._lock = threading.Lock()
+
+    # ===== 静态资源版本 =====
+
+    def asset_version(self, static_folder, filename):
+        """文件内容sha256前10位，按 (mtime, size) 缓存；文件不存在返回None"""
+        path = os.path.join(static_folder, filename)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        version = self._asset_versions.get(key)
+        if version is None:
+            digest = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(chunk)
+            version = digest.hexdigest()[:10]
+            self._asset_versions[key] = version
+        return version
+
+    def _version_assets(self, html, static_folder):
+        def replace(match):
+            version = self.asset_version(static_folder, match.group(1))
+            if version is None:
+                return match.group(0)
+            return f'{match.group(0)}?v={version}'
+        return STATIC_REF.sub(replace, html)
+
+    # ===== 渲染 =====
+
+    def render(self, app, endpoint, script_root=''):
+        # script_root 是校区路径前缀（/c/<校区>），url_for 生成的地址会自动带上
+        with app.test_request_context('/', base_url=f'http://localhost{script_root}/'):
+            html = render_template(PAGES[endpoint])
+        if script_root:
+            html = APP_PATH_REF.sub(script_root + '/', html)
+        return RenderedPage(self._version_assets(html, os.path.join(app.root_path, 'static')))
+
+    def build(self, app):
+        """渲染全部页面（无前缀一份，每个校区前缀各一份），返回 {页面地址: 字节数}"""
+        roots = [''] + [PATH_PREFIX + campus for campus in app.config['CAMPUSES']]
+        pages = {(endpoint, root): self.render(app, endpoint, root) for endpoint in PAGES for root in roots}
+        with self._lock:
+            self._pages = pages
+        return {f'{root}/{PAGES[endpoint]}': len(page.body) for (endpoint, root), page in pages.items()}
+
+    def get(self, endpoint):
+        app = current_app._get_current_object()
+        script_root = request.script_root
+        if not app.config.get('PAGES_PRERENDER', True):
+            # 开发时每次都重新渲染，改模板立即生效
+            return self.render(app, endpoint, script_root)
+        key = (endpoint, script_root)
+        page = self._pages.get(key)
+        if page is None:
+            with self._lock:
+                page = self._pages.get(key)
+                if page is None:
+                    page = self.render(app, endpoint, script_root)
+                    self._pages = {**self._pages, key: page}
+        return page
+
+    # ===== 响应 =====
+
+    def serve(self, endpoint):
+        page = self.get(endpoint)
+        encoding = choose_encoding(request.accept_encodings)
+        if encoding not in page.variants:
+            encoding = None
+
+        response_class = current_app.response_class
+        if any(request.if_none_match.contains(page.etag_for(e)) for e in page.variants):
+            response = response_class(status=304)
+        else:
+            response = response_class(page.variants[encoding], mimetype='text/html')
+            if encoding:
+                response.headers['Content-Encoding'] = encoding
+        response.set_etag(page.etag_for(encoding))
+        response.vary.add('Accept-Encoding')
+        # 页面本身要重新验证（资源版本号在页面里），验证命中只回304
+        response.headers['Cache-Control'] = 'public, no-cache'
+        return response
+
+
+page_cache = PageCache()
+
+
+def static_max_age(filename):
+    """带版本号的静态资源长期缓存，其余交给Flask默认策略"""
+    if request.args.get('v'):
+        return STATIC_VERSIONED_MAX_AGE
+    return None
+
+
+# ===== 命令行 =====
+
+@click.command('build-pages')
+@with_appcontext
+def build_pages_command():
+    """预渲染页面并输出各页面大小（检查模板能否正常渲染）"""
+    sizes = page_cache.build(current_app._get_current_object())
+    for page, size in sizes.items():
+        click.echo(f'{page}: {size} 字节')
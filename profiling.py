@@ -0,0 +1,265 @@
+# profiling.py - 按需的单请求性能剖析
+#
+# 配置 PROFILE_DIR 后启用。两种触发方式：
+#   1. 请求带签名头 X-Profile: <过期时间戳>.<签名>（flask profile token 生成），用于排查指定请求；
+#   2. PROFILE_SAMPLE_RATE > 0 时按比例随机抽样。
+# 两种剖析方式（PROFILE_MODE）：
+#   sample   - 后台线程每隔 PROFILE_INTERVAL_MS 抓一次被剖析线程的调用栈，写 .folded 文件，
+#              每行 "栈帧;栈帧;... 次数"，可直接交给 flamegraph.pl / speedscope；开销与请求数无关
+#   cprofile - 用 cProfile 记录全部调用，写 .prof 文件（pstats 格式，可用 snakeviz、flameprof 查看）
+# /api/admin/profiles 汇总最近的剖析结果，列出最热的函数。
+import cProfile
+import hashlib
+import hmac
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+import click
+from flask import current_app, g, request
+from flask.cli import with_appcontext
+
+PROFILE_HEADER = 'X-Profile'
+
+
+# ===== 触发 =====
+
+def _signature(secret, expires):
+    return hmac.new(secret.encode(), f'profile:{expires}'.encode(), hashlib.sha256).hexdigest()[:32]
+
+
+def make_token(secret, ttl=600):
+    expires = int(time.time()) + ttl
+    return f'{expires}.{_signature(secret, expires)}'
+
+
+def verify_token(secret, token):
+    expires, _, signature = (token or '').partition('.')
+    if not expires.isdigit() or int(expires) < time.time():
+        return False
+    return hmac.compare_digest(signature, _signature(secret, int(expires)))
+
+
+# ===== 采样剖析 =====
+
+def _frame_name(code):
+    # 折叠栈格式里分号是分隔符，空格用于分隔次数
+    name = f'{os.path.basename(code.co_filename)}:{code.co_name}:{code.co_firstlineno}'
+    return name.replace(';', ':').replace(' ', '_')
+
+
+class StackSampler:
+    """一个后台线程为所有正在剖析的请求线程采样，请求结束时取走各自的计数"""
+
+    def __init__(self):
+        self.interval = 0.005
+        self._targets = {}  # 线程id -> Counter(折叠栈 -> 次数)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pid = None
+
+    def _ensure_thread(self):
+        # fork 之后线程不会被继承
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._targets = {}
+            self._lock = threading.Lock()
+            self._wakeup = threading.Event()
+            threading.Thread(target=self._run, name='profile-sampler', daemon=True).start()
+
+    def start(self):
+        self._ensure_thread()
+        with self._lock:
+            self._targets[threading.get_ident()] = Counter()
+        self._wakeup.set()
+
+    def stop(self):
+        with self._lock:
+            return self._targets.pop(threading.get_ident(), Counter())
+
+    def _run(self):
+        while True:
+            with self._lock:
+                idle = not self._targets
+            if idle:
+                self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, counter in self._targets.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        counter[self._fold(frame)] += 1
+            time.sleep(self.interval)
+
+    @staticmethod
+    def _fold(frame):
+        stack = []
+        while frame is not None:
+            stack.append(frame.f_code)
+            # 只保留 Flask 分发请求以下的部分，上面是服务器和WSGI框架的固定调用链
+            if frame.f_code.co_name == 'full_dispatch_request':
+                break
+            frame = frame.f_back
+        return ';'.join(_frame_name(code) for code in reversed(stack))
+
+
+sampler = StackSampler()
+
+
+# ===== 请求钩子 =====
+
+class RequestProfiler:
+    def init_app(self, app):
+        self.directory = app.config.get('PROFILE_DIR')
+        if not self.directory:
+            return
+        self.mode = app.config.get('PROFILE_MODE', 'sample')
+        self.sample_rate = app.config.get('PROFILE_SAMPLE_RATE', 0.0)
+        sampler.interval = app.config.get('PROFILE_INTERVAL_MS', 5) / 1000
+        app.extensions['request_profiler'] = self
+        app.before_request(self._before)
+        app.teardown_request(self._teardown)
+
+    def _wanted(self):
+        token = request.headers.get(PROFILE_HEADER)
+        if token and verify_token(current_app.config['SECRET_KEY'], token):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def _before(self):
+        if not self._wanted():
+            return
+        g.profile_started = time.perf_counter()
+        if self.mode == 'cprofile':
+            g.profile = cProfile.Profile()
+            g.profile.enable()
+        else:
+            sampler.start()
+
+    def _teardown(self, exc):
+        started = g.pop('profile_started', None)
+        if started is None:
+            return
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        endpoint = (request.endpoint or 'unknown').replace('.', '-')
+        name = f'{time.strftime("%Y%m%d-%H%M%S")}-{endpoint}-{elapsed_ms:.0f}ms-{os.getpid()}-{threading.get_ident() % 10000}'
+        os.makedirs(self.directory, exist_ok=True)
+
+        if self.mode == 'cprofile':
+            profile = g.pop('profile')
+            profile.disable()
+            profile.dump_stats(os.path.join(self.directory, name + '.prof'))
+            return
+
+        counter = sampler.stop()
+        if counter:
+            with open(os.path.join(self.directory, name + '.folded'), 'w', encoding='utf-8') as f:
+                for stack, count in counter.most_common():
+                    f.write(f'{stack} {count}\n')
+
+
+request_profiler = RequestProfiler()
+
+
+# ===== 汇总 =====
+
+def _endpoint_of(filename):
+    # 文件名：日期-时间-端点-耗时ms-pid-线程.扩展名
+    parts = filename.split('-')
+    return '-'.join(parts[2:-3]) if len(parts) > 5 else 'unknown'
+
+
+def list_profiles(directory, endpoint=None, limit=200):
+    """最近的剖析文件（新的在前）"""
+    try:
+        names = [n for n in os.listdir(directory) if n.endswith(('.folded', '.prof'))]
+    except FileNotFoundError:
+        return []
+    if endpoint:
+        names = [n for n in names if _endpoint_of(n) == endpoint.replace('.', '-')]
+    names.sort(reverse=True)
+    return [os.path.join(directory, n) for n in names[:limit]]
+
+
+def aggregate(paths, top=20):
+    """合并多个剖析结果，按自身耗时和累计耗时列出最热的函数。
+    采样文件的单位是样本数，cProfile文件的单位是秒，两者分开统计"""
+    self_samples = Counter()
+    total_samples = Counter()
+    endpoints = Counter()
+    sample_count = 0
+    prof_paths = []
+
+    for path in paths:
+        endpoints[_endpoint_of(os.path.basename(path))] += 1
+        if path.endswith('.prof'):
+            prof_paths.append(path)
+            continue
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                stack, _, count = line.rstrip('\n').rpartition(' ')
+                if not stack:
+                    continue
+                count = int(count)
+                frames = stack.split(';')
+                sample_count += count
+                self_samples[frames[-1]] += count
+                # 递归调用只算一次
+                for frame in set(frames):
+                    total_samples[frame] += count
+
+    result = {
+        'profiles': len(paths),
+        'endpoints': dict(endpoints.most_common()),
+        'samples': sample_count,
+        'top_self': [{'function': name, 'samples': n, 'percent': round(n / sample_count * 100, 1)}
+                     for name, n in self_samples.most_common(top)],
+        'top_total': [{'function': name, 'samples': n, 'percent': round(n / sample_count * 100, 1)}
+                      for name, n in total_samples.most_common(top)],
+    }
+
+    if prof_paths:
+        stats = pstats.Stats(*prof_paths)
+        rows = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:top]
+        result['cprofile_top'] = [{
+            'function': f'{os.path.basename(filename)}:{name}:{line}',
+            'calls': calls,
+            'self_seconds': round(tottime, 6),
+            'total_seconds': round(cumtime, 6),
+        } for (filename, line, name), (_, calls, tottime, cumtime, _) in rows]
+    return result
+
+
+# ===== 命令行 =====
+
+@click.group('profile')
+def profile_cli():
+    """按需性能剖析"""
+
+
+@profile_cli.command('token')
+@click.option('--ttl', default=600, show_default=True, help='有效秒数')
+@with_appcontext
+def token_command(ttl):
+    """生成 X-Profile 请求头的值，带上它的请求会被剖析"""
+    click.echo(f'{PROFILE_HEADER}: {make_token(current_app.config["SECRET_KEY"], ttl)}')
+
+
+@profile_cli.command('top')
+@click.option('--endpoint', default=None, help='只看某个端点，如 main.get_building_memories')
+@click.option('--limit', default=200, show_default=True, help='最多汇总最近多少个剖析文件')
+@click.option('--top', default=20, show_default=True)
+@with_appcontext
+def top_command(endpoint, limit, top):
+    """在命令行汇总最近的剖析结果"""
+    paths = list_profiles(current_app.config['PROFILE_DIR'] or '.', endpoint, limit)
+    result = aggregate(paths, top)
+    click.echo(f'{result["profiles"]} 个剖析文件，{result["samples"]} 个样本')
+    for row in result['top_self']:
+        click.echo(f'{row["percent"]:>6.1f}%  {row["function"]}')
@@ -0,0 +1,146 @@
+# purge.py - 软删除记忆的后台清理：按批删除点赞、评论、通知，最后删记忆本身并释放图片
+import json
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import select, delete, update, or_, func
+
+from exts import db
+from jobs import task
+from model import CampusMemory, MemoryComment, MemoryLike, CommentLike, Notification
+from storage import release_uploads
+
+# 每轮处理的记忆数；关联行另按 batch_size 分批
+MEMORIES_PER_ROUND = 100
+
+PURGE_STEPS = ('comment_likes', 'notifications', 'comment_replies', 'comments', 'likes')
+
+
+def _run_batches(table, condition, make_statement, batch_size, pause=0):
+    """先按主键取一批再按主键删/改，每批一个短事务，返回影响的总行数。
+    不用带 LIMIT 的子查询，MySQL/PostgreSQL/SQLite 写法一致"""
+    total = 0
+    while True:
+        ids = db.session.execute(
+            select(table.c.id).where(condition).order_by(table.c.id).limit(batch_size)
+        ).scalars().all()
+        if not ids:
+            return total
+        db.session.execute(make_statement(table.c.id.in_(ids)))
+        db.session.commit()
+        total += len(ids)
+        if len(ids) < batch_size:
+            return total
+        if pause:
+            time.sleep(pause)
+
+
+def purge_memories(memory_ids, batch_size=1000, pause=0):
+    """彻底删除一组已软删除的记忆，返回各表删除的行数"""
+    memories = CampusMemory.__table__
+    comments = MemoryComment.__table__
+    likes = MemoryLike.__table__
+    comment_likes = CommentLike.__table__
+    notifications = Notification.__table__
+    comment_ids = select(comments.c.id).where(comments.c.memory_id.in_(memory_ids))
+
+    def deleting(table):
+        return lambda where: delete(table).where(where)
+
+    steps = {
+        'comment_likes': (comment_likes, comment_likes.c.comment_id.in_(comment_ids), deleting(comment_likes)),
+        'notifications': (notifications, or_(notifications.c.memory_id.in_(memory_ids),
+                                             notifications.c.comment_id.in_(comment_ids)),
+                          deleting(notifications)),
+        # 先断开回复关系，分批删除评论时才不会违反 parent_id 外键
+        'comment_replies': (comments, comments.c.memory_id.in_(memory_ids) & comments.c.parent_id.isnot(None),
+                            lambda where: update(comments).where(where).values(parent_id=None)),
+        'comments': (comments, comments.c.memory_id.in_(memory_ids), deleting(comments)),
+        'likes': (likes, likes.c.memory_id.in_(memory_ids), deleting(likes)),
+    }
+    counts = {name: _run_batches(*steps[name], batch_size=batch_size, pause=pause) for name in PURGE_STEPS}
+
+    # 最后一步：删除记忆并释放图片引用，放在同一个事务里
+    rows = db.session.execute(
+        select(memories.c.id, memories.c.images)
+        .where(memories.c.id.in_(memory_ids), memories.c.deleted_at.isnot(None))
+    ).all()
+    urls = [url for row in rows for url in (json.loads(row.images) if row.images else [])]
+    release_uploads(urls)
+    db.session.execute(delete(memories).where(
+        memories.c.id.in_([row.id for row in rows]), memories.c.deleted_at.isnot(None)))
+    db.session.commit()
+
+    counts['memories'] = len(rows)
+    counts['images'] = len(urls)
+    return counts
+
+
+@task('purge.memory', concurrency=2)
+def purge_memory_task(memory_id):
+    """删除记忆时入队（见 app.delete_memory），延迟宽限期后清理这一条"""
+    purge_memories([memory_id], current_app.config.get('PURGE_BATCH_SIZE', 1000))
+
+
+def _pending(grace_seconds):
+    cutoff = datetime.utcnow() - timedelta(seconds=grace_seconds)
+    return CampusMemory.deleted_at.isnot(None), CampusMemory.deleted_at < cutoff
+
+
+def purge_deleted(batch_size=1000, grace_seconds=None, max_memories=None, pause=0):
+    """清理所有超过宽限期的软删除记忆，每轮产出 (本轮记忆数, 各表累计行数)"""
+    if grace_seconds is None:
+        grace_seconds = current_app.config.get('PURGE_GRACE_SECONDS', 300)
+    totals = {}
+    done = 0
+    while max_memories is None or done < max_memories:
+        size = MEMORIES_PER_ROUND if max_memories is None else min(MEMORIES_PER_ROUND, max_memories - done)
+        memory_ids = db.session.query(CampusMemory.id) \
+            .filter(*_pending(grace_seconds)) \
+            .order_by(CampusMemory.deleted_at, CampusMemory.id).limit(size).all()
+        memory_ids = [memory_id for (memory_id,) in memory_ids]
+        if not memory_ids:
+            break
+        for name, count in purge_memories(memory_ids, batch_size, pause).items():
+            totals[name] = totals.get(name, 0) + count
+        done += len(memory_ids)
+        yield len(memory_ids), totals
+
+
+# ===== 命令行 =====
+
+@click.group('purge')
+def purge_cli():
+    """清理已删除的记忆（平时由 worker 逐条清理，flask purge run 用于补漏）"""
+
+
+@purge_cli.command('status')
+@with_appcontext
+def purge_status():
+    """查看待清理的记忆数"""
+    pending, oldest = db.session.query(func.count(CampusMemory.id), func.min(CampusMemory.deleted_at)) \
+        .filter(CampusMemory.deleted_at.isnot(None)).one()
+    click.echo(f'待清理 {pending} 条记忆' + (f'，最早删除于 {oldest:%Y-%m-%d %H:%M:%S}' if oldest else ''))
+
+
+@purge_cli.command('run')
+@click.option('--batch-size', default=None, type=int, help='关联数据每批删除的行数')
+@click.option('--grace-seconds', default=None, type=int, help='删除后至少经过多少秒才清理')
+@click.option('--max-memories', default=None, type=int, help='本次最多清理的记忆数')
+@click.option('--pause', default=0.0, show_default=True, help='批间暂停秒数')
+@with_appcontext
+def purge_run(batch_size, grace_seconds, max_memories, pause):
+    """分批删除软删除记忆的点赞、评论、通知，最后删除记忆并释放图片"""
+    batch_size = batch_size or current_app.config.get('PURGE_BATCH_SIZE', 1000)
+    started = time.perf_counter()
+    purged = 0
+    totals = {}
+    for count, totals in purge_deleted(batch_size, grace_seconds, max_memories, pause):
+        purged += count
+        click.echo(f'已清理 {purged} 条记忆')
+    detail = '，'.join(f'{name} {count}' for name, count in totals.items())
+    click.echo(f'完成：{purged} 条记忆，用时 {time.perf_counter() - started:.1f}s' +
+               (f'（{detail}）' if detail else ''))
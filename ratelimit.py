@@ -0,0 +1,127 @@
+# ratelimit.py - 跨worker共享的令牌桶限流（状态存放在本地SQLite文件）
+import math
+import os
+import random
+import sqlite3
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, request, session, jsonify
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    ts REAL NOT NULL,
+    allowed INTEGER NOT NULL
+) WITHOUT ROWID
+"""
+
+# 一条语句完成"补充令牌 + 尝试扣减"，SQLite写锁保证多进程下的原子性
+_TAKE = """
+INSERT INTO buckets (key, tokens, ts, allowed) VALUES (:key, :capacity - 1, :now, 1)
+ON CONFLICT(key) DO UPDATE SET
+    tokens = CASE WHEN min(:capacity, tokens + (:now - ts) * :rate) >= 1
+                  THEN min(:capacity, tokens + (:now - ts) * :rate) - 1
+                  ELSE min(:capacity, tokens + (:now - ts) * :rate) END,
+    allowed = min(:capacity, tokens + (:now - ts) * :rate) >= 1,
+    ts = :now
+RETURNING tokens, allowed
+"""
+
+
+def parse_limit(spec):
+    """'10/minute' -> (容量10, 每秒补充 10/60 个令牌)"""
+    count, _, period = spec.partition('/')
+    seconds = PERIODS[period.strip()]
+    capacity = int(count)
+    return capacity, capacity / seconds
+
+
+class RateLimiter:
+    """每个线程一个SQLite连接，所有gunicorn worker共用同一个数据库文件"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._pid = os.getpid()
+
+    def _conn(self):
+        if self._pid != os.getpid():
+            # fork 后不能复用父进程的连接
+            self._local = threading.local()
+            self._pid = os.getpid()
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1.0, isolation_level=None,
+                                   check_same_thread=False)
+            # 限流状态丢了也无妨，换取写入速度
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+            conn.execute(_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def take(self, key, capacity, rate):
+        """尝试消耗一个令牌，返回 (是否允许, 需要等待的秒数)"""
+        now = time.time()
+        conn = self._conn()
+        tokens, allowed = conn.execute(_TAKE, {
+            'key': key, 'capacity': capacity, 'rate': rate, 'now': now
+        }).fetchone()
+
+        # 偶尔清理长时间未访问的桶
+        if random.random() < 0.001:
+            conn.execute('DELETE FROM buckets WHERE ts < ?', (now - 86400,))
+
+        if allowed:
+            return True, 0
+        return False, max(1, math.ceil((1 - tokens) / rate))
+
+    def reset(self):
+        self._conn().execute('DELETE FROM buckets')
+
+
+def client_ip():
+    """客户端IP。可信代理的 X-Forwarded-For 已由 ProxyFix 换到 remote_addr（见 TRUSTED_PROXY_COUNT）"""
+    return request.remote_addr or 'unknown'
+
+
+def get_limiter():
+    limiter = current_app.extensions.get('rate_limiter')
+    if limiter is None:
+        limiter = current_app.extensions['rate_limiter'] = RateLimiter(current_app.config['RATE_LIMIT_DB'])
+    return limiter
+
+
+def rate_limit(name):
+    """按 RATE_LIMITS[name] 限流：按IP，已登录时同时按用户。超限返回429和Retry-After"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            spec = current_app.config.get('RATE_LIMITS', {}).get(name)
+            if not spec or not current_app.config.get('RATE_LIMIT_ENABLED', True):
+                return view(*args, **kwargs)
+
+            keys = [f'{name}:ip:{client_ip()}']
+            user_id = session.get('user_id')
+            if user_id:
+                keys.append(f'{name}:u:{user_id}')
+            capacity, rate = parse_limit(spec)
+            limiter = get_limiter()
+            allowed, retry_after = True, 0
+            for key in keys:
+                key_allowed, key_retry = limiter.take(key, capacity, rate)
+                if not key_allowed:
+                    allowed, retry_after = False, max(retry_after, key_retry)
+            if not allowed:
+                response = jsonify({'success': False, 'message': '操作过于频繁，请稍后再试'})
+                response.status_code = 429
+                response.headers['Retry-After'] = str(retry_after)
+                return response
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
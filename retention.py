@@ -0,0 +1,150 @@
+# retention.py - 通知/活动记录的过期归档
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import select, insert, delete, literal, func
+
+from exts import db
+from model import Notification, NotificationArchive, UserActivity, UserActivityArchive, ChangeLog
+
+
+class RetentionPolicy:
+    """一条保留策略：满足条件且超过保留天数的行从主表搬到归档表"""
+
+    def __init__(self, name, model, archive_model, days, condition=None, description='', entity=None):
+        self.name = name
+        self.model = model
+        self.archive_model = archive_model
+        self.days = days
+        self.condition = condition
+        self.description = description
+        self.entity = entity  # 增量同步里的实体名，归档时记为删除
+
+    def where(self, now):
+        table = self.model.__table__
+        clause = table.c.created_at < now - timedelta(days=self.days)
+        if self.condition is not None:
+            clause = clause & self.condition(table)
+        return clause
+
+
+def default_policies():
+    """内置策略，保留天数可用配置 RETENTION_DAYS 覆盖"""
+    days = current_app.config.get('RETENTION_DAYS', {})
+    return [
+        RetentionPolicy('read_notifications', Notification, NotificationArchive,
+                        days.get('read_notifications', 90),
+                        condition=lambda t: t.c.is_read.is_(True),
+                        description='已读通知', entity='notification'),
+        RetentionPolicy('unread_notifications', Notification, NotificationArchive,
+                        days.get('unread_notifications', 365),
+                        condition=lambda t: t.c.is_read.isnot(True),
+                        description='未读通知', entity='notification'),
+        RetentionPolicy('user_activities', UserActivity, UserActivityArchive,
+                        days.get('user_activities', 180),
+                        description='用户活动记录'),
+    ]
+
+
+def count_expired(policy, now=None):
+    now = now or datetime.utcnow()
+    table = policy.model.__table__
+    return db.session.execute(
+        select(func.count()).select_from(table).where(policy.where(now))
+    ).scalar()
+
+
+def archive_batches(policy, batch_size=1000, pause=0.05, max_batches=None, now=None):
+    """按主键分小批归档：每批一个短事务（INSERT...SELECT + DELETE），
+    批间暂停让出锁。每批结束产出 (本批行数, 累计行数)"""
+    now = now or datetime.utcnow()
+    table = policy.model.__table__
+    archive = policy.archive_model.__table__
+    columns = [c.name for c in table.c]
+
+    moved = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        ids = db.session.execute(
+            select(table.c.id).where(policy.where(now))
+            .order_by(table.c.created_at, table.c.id).limit(batch_size)
+        ).scalars().all()
+        if not ids:
+            break
+
+        db.session.execute(insert(archive).from_select(
+            columns + ['archived_at'],
+            select(*[table.c[name] for name in columns], literal(now)).where(table.c.id.in_(ids))
+        ))
+        if policy.entity:
+            # 归档对客户端来说就是删除
+            db.session.execute(insert(ChangeLog.__table__).from_select(
+                ['entity', 'entity_id', 'op', 'user_id', 'created_at'],
+                select(literal(policy.entity), table.c.id, literal('delete'), table.c.user_id, literal(now))
+                .where(table.c.id.in_(ids))
+            ))
+        db.session.execute(delete(table).where(table.c.id.in_(ids)))
+        db.session.commit()
+
+        moved += len(ids)
+        batches += 1
+        yield len(ids), moved
+
+        if len(ids) < batch_size:
+            break
+        if pause:
+            time.sleep(pause)
+
+
+# ===== 命令行 =====
+
+@click.group('retention')
+def retention_cli():
+    """过期数据归档（适合由定时任务每天执行一次 flask retention run）"""
+
+
+@retention_cli.command('status')
+@with_appcontext
+def retention_status():
+    """查看每条策略当前待归档的行数"""
+    for policy in default_policies():
+        click.echo(f'{policy.name:<22} {policy.description}，保留 {policy.days} 天，'
+                   f'待归档 {count_expired(policy)} 行')
+
+
+@retention_cli.command('run')
+@click.option('--policy', 'names', multiple=True, help='只执行指定策略（可多次指定）')
+@click.option('--batch-size', default=1000, show_default=True, help='每批归档的行数')
+@click.option('--pause', default=0.05, show_default=True, help='批间暂停秒数')
+@click.option('--max-batches', type=int, default=None, help='本次最多执行的批数')
+@click.option('--dry-run', is_flag=True, help='只统计，不归档')
+@with_appcontext
+def retention_run(names, batch_size, pause, max_batches, dry_run):
+    """执行归档并输出进度"""
+    policies = [p for p in default_policies() if not names or p.name in names]
+    if not policies:
+        raise click.ClickException('没有匹配的策略')
+
+    total = 0
+    for policy in policies:
+        if dry_run:
+            click.echo(f'[{policy.name}] 待归档 {count_expired(policy)} 行（dry-run）')
+            continue
+
+        started = time.perf_counter()
+        moved = 0
+        batches = 0
+        for batch, moved in archive_batches(policy, batch_size, pause, max_batches):
+            batches += 1
+            elapsed = time.perf_counter() - started
+            click.echo(f'[{policy.name}] 第 {batches} 批 {batch} 行，累计 {moved} 行，'
+                       f'{moved / elapsed:,.0f} 行/秒')
+        elapsed = time.perf_counter() - started
+        click.echo(f'[{policy.name}] 完成：归档 {moved} 行，{batches} 批，用时 {elapsed:.1f}s')
+        total += moved
+
+    if not dry_run:
+        click.echo(f'共归档 {total} 行')
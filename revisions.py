@@ -0,0 +1,143 @@
+# revisions.py - 日记的增量编辑与修订历史
+#
+# 补丁格式（与常见的OT文本操作一致）：操作列表，依次作用在基础版本上
+#   正整数 n  保留 n 个字符
+#   字符串 s  插入 s
+#   负整数 -n 删除 n 个字符
+# 末尾没有覆盖到的部分视为保留。长度按 Unicode 码点计（JS 里用 Array.from(text).length）。
+#
+# 日记表只存最新内容；每次保存在 diary_revisions 记一条反向补丁（新内容 -> 旧内容），
+# 查看旧版本时从最新内容依次往回应用。连续自动保存时合并到同一条修订里，历史只按分钟粒度保留。
+import json
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from exts import db
+from model import DiaryRevision
+
+
+class DeltaError(ValueError):
+    """补丁格式错误或与基础版本长度不符"""
+
+
+# ===== 补丁 =====
+
+def apply_delta(text, delta):
+    if not isinstance(delta, list):
+        raise DeltaError('补丁必须是操作列表')
+    parts = []
+    pos = 0
+    for op in delta:
+        if isinstance(op, bool):
+            raise DeltaError(f'无效的操作：{op!r}')
+        if isinstance(op, str):
+            parts.append(op)
+        elif isinstance(op, int) and op > 0:
+            if pos + op > len(text):
+                raise DeltaError('保留的长度超出了基础版本')
+            parts.append(text[pos:pos + op])
+            pos += op
+        elif isinstance(op, int) and op < 0:
+            if pos - op > len(text):
+                raise DeltaError('删除的长度超出了基础版本')
+            pos -= op
+        else:
+            raise DeltaError(f'无效的操作：{op!r}')
+    parts.append(text[pos:])
+    return ''.join(parts)
+
+
+def invert_delta(text, delta):
+    """delta 作用于 text 的反向补丁（不需要比较文本，O(补丁长度)）"""
+    inverse = []
+    pos = 0
+    for op in delta:
+        if isinstance(op, str):
+            if op:
+                inverse.append(-len(op))
+        elif op > 0:
+            inverse.append(op)
+            pos += op
+        else:
+            inverse.append(text[pos:pos - op])
+            pos -= op
+    return compact(inverse)
+
+
+def diff(old, new):
+    """把 old 变成 new 的补丁：去掉公共前缀和后缀，中间整体替换。
+    对"在某处改一段"的编辑足够紧凑，且是线性时间"""
+    limit = min(len(old), len(new))
+    prefix = 0
+    while prefix < limit and old[prefix] == new[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < limit - prefix and old[-1 - suffix] == new[-1 - suffix]:
+        suffix += 1
+    return compact([prefix, -(len(old) - prefix - suffix), new[prefix:len(new) - suffix]])
+
+
+def compact(delta):
+    """去掉空操作、合并相邻同类操作、去掉末尾的保留"""
+    result = []
+    for op in delta:
+        if op == 0 or op == '':
+            continue
+        if result and type(result[-1]) is type(op) and (isinstance(op, str) or (result[-1] > 0) == (op > 0)):
+            result[-1] += op
+        else:
+            result.append(op)
+    while result and isinstance(result[-1], int) and result[-1] > 0:
+        result.pop()
+    return result
+
+
+# ===== 修订历史 =====
+
+def record_revision(diary, old_content, new_content, delta=None):
+    """保存前调用：记下把新内容还原成旧内容的反向补丁（在调用方事务内）"""
+    reverse = invert_delta(old_content, delta) if delta is not None else diff(new_content, old_content)
+    window = current_app.config.get('DIARY_REVISION_COALESCE_SECONDS', 60)
+    latest = DiaryRevision.query.filter_by(diary_id=diary.id) \
+        .order_by(DiaryRevision.version.desc()).first()
+
+    if latest is not None and latest.created_at and \
+            latest.created_at > datetime.utcnow() - timedelta(seconds=window):
+        # 当前版本刚保存不久：不单独保留它，直接把上一条修订改成 新内容 -> 更早的版本
+        earlier = apply_delta(old_content, json.loads(latest.delta))
+        latest.delta = json.dumps(diff(new_content, earlier), ensure_ascii=False)
+        latest.size = len(latest.delta)
+        return latest
+
+    revision = DiaryRevision(diary_id=diary.id, version=diary.version)
+    revision.delta = json.dumps(reverse, ensure_ascii=False)
+    revision.size = len(revision.delta)
+    db.session.add(revision)
+    _trim(diary.id)
+    return revision
+
+
+def _trim(diary_id):
+    keep = current_app.config.get('DIARY_MAX_REVISIONS', 100)
+    oldest_kept = DiaryRevision.query.with_entities(DiaryRevision.version) \
+        .filter_by(diary_id=diary_id).order_by(DiaryRevision.version.desc()) \
+        .offset(keep - 1).limit(1).scalar()
+    if oldest_kept is not None:
+        DiaryRevision.query.filter(DiaryRevision.diary_id == diary_id,
+                                   DiaryRevision.version < oldest_kept).delete(synchronize_session=False)
+
+
+def content_at(diary, version):
+    """还原某个历史版本的内容；该版本已被合并或清理时返回 None"""
+    if version == diary.version:
+        return diary.content
+    revisions = DiaryRevision.query.filter(DiaryRevision.diary_id == diary.id,
+                                           DiaryRevision.version >= version) \
+        .order_by(DiaryRevision.version.desc()).all()
+    if not revisions or revisions[-1].version != version:
+        return None
+    content = diary.content
+    for revision in revisions:
+        content = apply_delta(content, json.loads(revision.delta))
+    return content
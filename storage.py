@@ -0,0 +1,458 @@
+# storage.py - 上传文件存储（内容寻址 + 去重 + 引用计数）
+import hashlib
+import os
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+
+from exts import db
+from model import StoredFile
+
+# 上传图片对外的URL前缀
+UPLOAD_URL_PREFIX = '/uploads/'
+
+# 扩展名 -> MIME类型
+CONTENT_TYPES = {
+    'png': 'image/png',
+    'jpg': 'image/jpeg',
+    'jpeg': 'image/jpeg',
+    'gif': 'image/gif',
+}
+
+
+def shard_key(digest):
+    """sha256 -> 分片存储键 ab/cd/<sha256>"""
+    return f'{digest[:2]}/{digest[2:4]}/{digest}'
+
+
+def is_content_key(key):
+    """判断是否为内容寻址的存储键（而不是旧版平铺文件名）"""
+    parts = key.split('/')
+    if len(parts) != 3:
+        return False
+    a, b, digest = parts
+    return (len(digest) == 64 and digest[:2] == a and digest[2:4] == b
+            and all(c in '0123456789abcdef' for c in digest))
+
+
+def url_for_key(key, extension):
+    """存储键 -> 对外URL（扩展名只用于推断Content-Type）"""
+    return f'{UPLOAD_URL_PREFIX}{key}.{extension}'
+
+
+def key_from_url(url):
+    """对外URL -> 存储键；旧版平铺文件返回None"""
+    if not url or not url.startswith(UPLOAD_URL_PREFIX):
+        return None
+    key = url[len(UPLOAD_URL_PREFIX):].rsplit('.', 1)[0]
+    return key if is_content_key(key) else None
+
+
+def spool_stream(stream, tmp_dir, chunk_size):
+    """分块把上传流写入临时文件，同时计算sha256。返回 (临时路径, sha256, 字节数)"""
+    os.makedirs(tmp_dir, exist_ok=True)
+    hasher = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return tmp_path, hasher.hexdigest(), size
+
+
+# ===== 存储后端 =====
+
+class StorageBackend:
+    """存储后端接口：按存储键保存/读取/删除不可变的文件内容"""
+
+    def spool(self, stream):
+        """把上传流落到临时文件并计算哈希，返回 (临时路径, sha256, 字节数)"""
+        raise NotImplementedError
+
+    def commit(self, tmp_path, key):
+        """把临时文件提交为存储键对应的对象（已存在时直接丢弃临时文件）"""
+        raise NotImplementedError
+
+    def discard(self, tmp_path):
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+    def exists(self, key):
+        raise NotImplementedError
+
+    def open(self, key):
+        """以二进制只读方式打开对象"""
+        raise NotImplementedError
+
+    def size(self, key):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def local_path(self, key):
+        """对象在本地磁盘上的路径（不在本地时返回None）"""
+        return None
+
+    def iter_keys(self, start_after=None):
+        """按键的顺序逐个列出对象 (存储键, 字节数, 修改时间UTC)，只列 start_after 之后的"""
+        raise NotImplementedError
+
+    def clean_tmp(self, older_than):
+        """删除早于 older_than 的临时文件（中断的上传留下的 .part），返回 (个数, 字节数)"""
+        removed = 0
+        reclaimed = 0
+        try:
+            entries = list(os.scandir(self.tmp_dir))
+        except FileNotFoundError:
+            return 0, 0
+        for entry in entries:
+            if not entry.is_file(follow_symlinks=False):
+                continue
+            stat = entry.stat()
+            if datetime.utcfromtimestamp(stat.st_mtime) >= older_than:
+                continue
+            try:
+                os.unlink(entry.path)
+            except FileNotFoundError:
+                continue
+            removed += 1
+            reclaimed += stat.st_size
+        return removed, reclaimed
+
+
+class LocalStorage(StorageBackend):
+    """本地磁盘存储，目录按 ab/cd/<sha256> 分片，避免单目录文件过多"""
+
+    def __init__(self, root, chunk_size=64 * 1024):
+        self.root = root
+        self.tmp_dir = os.path.join(root, '.tmp')
+        self.chunk_size = chunk_size
+
+    def _path(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    def spool(self, stream):
+        return spool_stream(stream, self.tmp_dir, self.chunk_size)
+
+    def commit(self, tmp_path, key):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 内容相同，原子覆盖即可，不会出现半写文件
+        os.replace(tmp_path, path)
+
+    def exists(self, key):
+        return os.path.exists(self._path(key))
+
+    def open(self, key):
+        return open(self._path(key), 'rb')
+
+    def size(self, key):
+        return os.path.getsize(self._path(key))
+
+    def delete(self, key):
+        try:
+            os.unlink(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def local_path(self, key):
+        return self._path(key)
+
+    def iter_keys(self, start_after=None):
+        # 逐层按名字排序遍历，按路径分段比较断点，整个目录都在断点之前时直接跳过
+        after = tuple(start_after.split('/')) if start_after else ()
+
+        def walk(directory, prefix):
+            try:
+                entries = sorted(os.scandir(directory), key=lambda e: e.name)
+            except FileNotFoundError:
+                return
+            for entry in entries:
+                parts = prefix + (entry.name,)
+                if entry.is_dir(follow_symlinks=False):
+                    if parts == ('.tmp',) or parts < after[:len(parts)]:
+                        continue
+                    yield from walk(entry.path, parts)
+                elif parts > after:
+                    stat = entry.stat()
+                    yield '/'.join(parts), stat.st_size, datetime.utcfromtimestamp(stat.st_mtime)
+
+        yield from walk(self.root, ())
+
+
+class LocalS3Client:
+    """S3兼容接口的本地替身（put/get/head/delete_object），开发环境代替boto3"""
+
+    class NoSuchKey(Exception):
+        pass
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, bucket, key):
+        return os.path.join(self.root, bucket, *key.split('/'))
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        path = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = Body.read(64 * 1024)
+                if not chunk:
+                    break
+                out.write(chunk)
+        os.replace(tmp_path, path)
+        return {}
+
+    def head_object(self, Bucket, Key):
+        path = self._path(Bucket, Key)
+        if not os.path.exists(path):
+            raise self.NoSuchKey(Key)
+        return {'ContentLength': os.path.getsize(path)}
+
+    def get_object(self, Bucket, Key):
+        path = self._path(Bucket, Key)
+        if not os.path.exists(path):
+            raise self.NoSuchKey(Key)
+        return {'Body': open(path, 'rb'), 'ContentLength': os.path.getsize(path)}
+
+    def delete_object(self, Bucket, Key):
+        try:
+            os.unlink(self._path(Bucket, Key))
+        except FileNotFoundError:
+            pass
+        return {}
+
+    def list_objects_v2(self, Bucket, StartAfter='', ContinuationToken=None, MaxKeys=1000):
+        bucket_root = os.path.join(self.root, Bucket)
+        after = ContinuationToken or StartAfter or ''
+        keys = []
+        for directory, _, files in os.walk(bucket_root):
+            for name in files:
+                if name.endswith('.part'):
+                    continue
+                key = os.path.relpath(os.path.join(directory, name), bucket_root).replace(os.sep, '/')
+                if key > after:
+                    keys.append(key)
+        keys.sort()
+        page = keys[:MaxKeys]
+        contents = []
+        for key in page:
+            stat = os.stat(self._path(Bucket, key))
+            contents.append({'Key': key, 'Size': stat.st_size,
+                             'LastModified': datetime.fromtimestamp(stat.st_mtime, timezone.utc)})
+        result = {'Contents': contents, 'IsTruncated': len(keys) > MaxKeys}
+        if result['IsTruncated']:
+            result['NextContinuationToken'] = page[-1]
+        return result
+
+
+def _is_missing(error):
+    """兼容本地替身和boto3的"对象不存在"异常"""
+    if isinstance(error, LocalS3Client.NoSuchKey):
+        return True
+    code = getattr(error, 'response', {}).get('Error', {}).get('Code')
+    return code in ('404', 'NoSuchKey', 'NotFound')
+
+
+class S3Storage(StorageBackend):
+    """S3兼容对象存储；client可以是boto3客户端，也可以是LocalS3Client"""
+
+    def __init__(self, client, bucket, tmp_dir, chunk_size=64 * 1024):
+        self.client = client
+        self.bucket = bucket
+        self.tmp_dir = tmp_dir
+        self.chunk_size = chunk_size
+
+    def spool(self, stream):
+        return spool_stream(stream, self.tmp_dir, self.chunk_size)
+
+    def commit(self, tmp_path, key):
+        try:
+            if not self.exists(key):
+                with open(tmp_path, 'rb') as body:
+                    self.client.put_object(Bucket=self.bucket, Key=key, Body=body)
+        finally:
+            self.discard(tmp_path)
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+            return True
+        except Exception as e:
+            if _is_missing(e):
+                return False
+            raise
+
+    def open(self, key):
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=key)['Body']
+        except Exception as e:
+            if _is_missing(e):
+                raise FileNotFoundError(key)
+            raise
+
+    def size(self, key):
+        return self.client.head_object(Bucket=self.bucket, Key=key)['ContentLength']
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def local_path(self, key):
+        if isinstance(self.client, LocalS3Client):
+            return self.client._path(self.bucket, key)
+        return None
+
+    def iter_keys(self, start_after=None):
+        # S3 按键的字节序分页返回
+        kwargs = {'Bucket': self.bucket}
+        if start_after:
+            kwargs['StartAfter'] = start_after
+        while True:
+            page = self.client.list_objects_v2(**kwargs)
+            for item in page.get('Contents', []):
+                modified = item['LastModified'].astimezone(timezone.utc).replace(tzinfo=None)
+                yield item['Key'], item['Size'], modified
+            if not page.get('IsTruncated'):
+                return
+            kwargs['ContinuationToken'] = page['NextContinuationToken']
+
+
+def create_storage(config):
+    """根据配置创建存储后端"""
+    chunk_size = config.get('UPLOAD_CHUNK_SIZE', 64 * 1024)
+    upload_folder = config['UPLOAD_FOLDER']
+    backend = config.get('STORAGE_BACKEND', 'local')
+
+    if backend == 'local':
+        return LocalStorage(upload_folder, chunk_size)
+
+    if backend == 's3':
+        endpoint = config.get('S3_ENDPOINT_URL')
+        if endpoint:
+            import boto3  # 可选依赖，只有真正连接S3时才需要
+            client = boto3.client('s3', endpoint_url=endpoint)
+        else:
+            client = LocalS3Client(config['S3_LOCAL_ROOT'])
+        return S3Storage(client, config['S3_BUCKET'],
+                         os.path.join(upload_folder, '.tmp'), chunk_size)
+
+    raise ValueError(f'未知的存储后端：{backend}')
+
+
+def get_storage():
+    """当前应用的存储后端（每个进程创建一次）"""
+    storage = current_app.extensions.get('storage')
+    if storage is None:
+        storage = current_app.extensions['storage'] = create_storage(current_app.config)
+    return storage
+
+
+# ===== 引用计数 =====
+
+def _acquire(digest, size, content_type):
+    """引用计数+1；第一次出现时插入记录"""
+    updated = StoredFile.query.filter_by(sha256=digest) \
+        .update({'ref_count': StoredFile.ref_count + 1, 'updated_at': datetime.utcnow()},
+                synchronize_session=False)
+    if updated:
+        return
+
+    try:
+        with db.session.begin_nested():
+            db.session.add(StoredFile(sha256=digest, size=size,
+                                      content_type=content_type, ref_count=1))
+    except IntegrityError:
+        # 并发上传了同一文件，对方已插入，改为+1
+        StoredFile.query.filter_by(sha256=digest) \
+            .update({'ref_count': StoredFile.ref_count + 1, 'updated_at': datetime.utcnow()},
+                    synchronize_session=False)
+
+
+def save_upload(file_storage):
+    """流式保存一个上传文件，返回对外URL。引用计数随当前事务一起提交"""
+    storage = get_storage()
+    extension = file_storage.filename.rsplit('.', 1)[1].lower()
+
+    tmp_path, digest, size = storage.spool(file_storage.stream)
+    try:
+        key = shard_key(digest)
+        # 先占引用再落盘，回收任务只会删除引用为0的对象
+        _acquire(digest, size, CONTENT_TYPES.get(extension, 'application/octet-stream'))
+        storage.commit(tmp_path, key)
+    except BaseException:
+        storage.discard(tmp_path)
+        raise
+
+    return url_for_key(key, extension)
+
+
+def release_uploads(urls):
+    """释放一组图片URL的引用（旧版平铺文件不参与计数）。文件本身由回收任务删除"""
+    digests = [key.rsplit('/', 1)[1] for key in map(key_from_url, urls) if key]
+    for digest in digests:
+        StoredFile.query.filter(StoredFile.sha256 == digest, StoredFile.ref_count > 0) \
+            .update({'ref_count': StoredFile.ref_count - 1, 'updated_at': datetime.utcnow()},
+                    synchronize_session=False)
+
+
+def reclaim_object(key, size=0):
+    """删除一个不再被引用的对象，返回是否删除。
+
+    内容寻址对象在 StoredFile 行锁内删除：同时上传相同内容的请求会在 _acquire 处
+    等待本事务结束，之后重新插入记录并写入文件，不会出现"记录在、文件被删"。
+    没有记录的对象（上传事务回滚留下的）先插入一条引用为0的记录占住再删"""
+    storage = get_storage()
+    if not is_content_key(key):
+        # 旧版平铺文件不会再有新的写入
+        storage.delete(key)
+        return True
+
+    digest = key.rsplit('/', 1)[1]
+    row = StoredFile.query.filter_by(sha256=digest).with_for_update().first()
+    if row is None:
+        try:
+            with db.session.begin_nested():
+                row = StoredFile(sha256=digest, size=size, ref_count=0)
+                db.session.add(row)
+        except IntegrityError:
+            db.session.rollback()
+            return False
+    elif row.ref_count > 0:
+        db.session.rollback()
+        return False
+
+    storage.delete(key)
+    db.session.delete(row)
+    db.session.commit()
+    return True
+
+
+def collect_unreferenced(grace_seconds=3600, limit=500):
+    """删除引用为0且超过宽限期的对象，返回 (删除数量, 释放字节数)"""
+    cutoff = datetime.utcnow() - timedelta(seconds=grace_seconds)
+    candidates = StoredFile.query.filter(StoredFile.ref_count == 0,
+                                         StoredFile.updated_at < cutoff) \
+        .with_entities(StoredFile.sha256, StoredFile.size) \
+        .order_by(StoredFile.id).limit(limit).all()
+
+    removed = 0
+    reclaimed = 0
+    for digest, size in candidates:
+        if reclaim_object(shard_key(digest), size):
+            removed += 1
+            reclaimed += size or 0
+    return removed, reclaimed
@@ -0,0 +1,93 @@
+# timeline.py - 全校时间线：多建筑有序流的k路归并 + 游标分页 + 批量补全作者
+import heapq
+from datetime import datetime
+
+from sqlalchemy import select, union_all, or_, and_
+
+from exts import db
+from model import CampusMemory, User
+
+CURSOR_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def encode_cursor(key):
+    return f'{key.created_at.strftime(CURSOR_TIME_FORMAT)}_{key.id}'
+
+
+def decode_cursor(cursor):
+    stamp, _, memory_id = cursor.rpartition('_')
+    return datetime.strptime(stamp, CURSOR_TIME_FORMAT), int(memory_id)
+
+
+def _keys_query(campus, building=None, colleges=None, cursor=None, limit=20):
+    """只取 (created_at, id)，按 campus, (building,) created_at, id 索引倒序扫描"""
+    table = CampusMemory.__table__
+    query = select(table.c.created_at, table.c.id) \
+        .where(table.c.campus == campus, table.c.deleted_at.is_(None))
+    if building is not None:
+        query = query.where(table.c.building == building)
+    if colleges:
+        query = query.join(User.__table__, User.__table__.c.id == table.c.user_id) \
+            .where(User.__table__.c.college.in_(colleges))
+    if cursor:
+        created_at, memory_id = cursor
+        query = query.where(or_(
+            table.c.created_at < created_at,
+            and_(table.c.created_at == created_at, table.c.id < memory_id)
+        ))
+    return query.order_by(table.c.created_at.desc(), table.c.id.desc()).limit(limit)
+
+
+def timeline_keys(campus, buildings=None, colleges=None, cursor=None, limit=20):
+    """返回按时间倒序的前 limit 个 (created_at, id)"""
+    if not buildings:
+        # 全校：直接走 (campus, created_at, id) 索引
+        return db.session.execute(_keys_query(campus, None, colleges, cursor, limit)).all()
+
+    # 指定建筑：每个建筑一个有序子查询，UNION ALL 一次取回，再在内存中k路归并
+    # （重复的建筑会产生重复的记忆，先去重）
+    streams = [_keys_query(campus, b, colleges, cursor, limit).subquery() for b in dict.fromkeys(buildings)]
+    rows = db.session.execute(union_all(*[select(s.c.created_at, s.c.id) for s in streams])).all()
+
+    # 把结果切成若干段倒序的连续行（正常情况下就是各建筑的有序流），
+    # 不依赖 UNION ALL 的输出顺序，归并结果都是正确的
+    runs = []
+    start = 0
+    for i in range(len(rows)):
+        if i + 1 == len(rows) or (rows[i + 1].created_at, rows[i + 1].id) > (rows[i].created_at, rows[i].id):
+            runs.append(rows[start:i + 1])
+            start = i + 1
+    merged = heapq.merge(*runs, key=lambda r: (r.created_at, r.id), reverse=True)
+    return [row for _, row in zip(range(limit), merged)]
+
+
+def hydrate(memory_ids):
+    """按id批量取记忆和作者（各一次查询），保持传入顺序"""
+    if not memory_ids:
+        return []
+    memories = {m.id: m for m in CampusMemory.visible().filter(CampusMemory.id.in_(memory_ids))}
+    user_ids = {m.user_id for m in memories.values()}
+    authors = {
+        row.id: row for row in db.session.query(
+            User.id, User.username, User.nickname, User.avatar, User.college
+        ).filter(User.id.in_(user_ids))
+    }
+    result = []
+    for memory_id in memory_ids:
+        memory = memories.get(memory_id)
+        if memory is None:
+            continue
+        author = authors.get(memory.user_id)
+        item = memory.to_frontend_dict(author=author)
+        item['college'] = author.college if author else None
+        result.append(item)
+    return result
+
+
+def fetch_timeline(campus, buildings=None, colleges=None, cursor=None, limit=20):
+    """返回 (记忆列表, 下一页游标)"""
+    keys = timeline_keys(campus, buildings, colleges, decode_cursor(cursor) if cursor else None, limit + 1)
+    has_more = len(keys) > limit
+    keys = keys[:limit]
+    next_cursor = encode_cursor(keys[-1]) if has_more else None
+    return hydrate([k.id for k in keys]), next_cursor
@@ -0,0 +1,390 @@
+# traffic.py - 线上流量录制（脱敏NDJSON）与回放压测，用真实流量确定worker/线程数
+#
+# 录制：配置 TRAFFIC_RECORD_DIR 后，每个请求结束时追加一行记录到 traffic-<pid>.ndjson
+# （每个进程一个文件，无需跨进程加锁）。只保留路由、参数、耗时和结构性字段：
+# 自由文本（请求体和查询参数）替换为长度，用户名/密码等替换为占位，登录用户记录为HMAC化名。
+#
+# 回放：flask traffic replay traffic-*.ndjson --target http://127.0.0.1:8080 --speed 2
+# 按原始时间间隔（除以speed）开环发送，每个化名用户一个cookie会话。
+# 目标实例应从同一份数据快照恢复，否则按id访问的接口会返回"不存在"；并关闭限流
+# （RATE_LIMIT_ENABLED=0），所有回放请求都来自同一个IP。
+import hashlib
+import heapq
+import hmac
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import CookieJar
+from urllib.error import HTTPError, URLError
+from urllib.parse import quote, urlencode
+from urllib.request import Request, build_opener, HTTPCookieProcessor
+
+import click
+from flask import g, request, session
+
+# 原样保留的请求体字段和查询参数（枚举值、id、分页参数），其余字符串只记录长度
+# （经纬度等查询参数同样只记录长度）
+STRUCTURAL_FIELDS = {'building', 'location', 'gender', 'college', 'format', 'parent_id',
+                     'page', 'per_page', 'limit', 'cursor', 'buildings', 'colleges',
+                     'k', 'radius', 'since', 'types', 'version', 'v'}
+# 身份相关字段，回放时替换为化名用户自己的值
+IDENTITY_FIELDS = {'username', 'student_id', 'password'}
+
+REPLAY_PASSWORD = 'replay-password'
+
+
+# ===== 录制 =====
+
+def sanitize(value, key=None):
+    if isinstance(value, dict):
+        return {k: sanitize(v, k) for k, v in value.items()}
+    if isinstance(value, list):
+        return [sanitize(v, key) for v in value]
+    if not isinstance(value, str) or key in STRUCTURAL_FIELDS:
+        return value
+    if key in IDENTITY_FIELDS:
+        return {'$identity': key}
+    return {'$len': len(value)}
+
+
+def _file_size(file_storage):
+    stream = file_storage.stream
+    try:
+        position = stream.tell()
+        stream.seek(0, os.SEEK_END)
+        size = stream.tell()
+        stream.seek(position)
+        return size
+    except (AttributeError, OSError):
+        return file_storage.content_length or 0
+
+
+def _request_body():
+    if request.files or request.form:
+        return {
+            'form': sanitize(request.form.to_dict()),
+            'files': [{'field': field, 'filename': f'file.{(f.filename or "").rsplit(".", 1)[-1]}',
+                       'size': _file_size(f), 'content_type': f.mimetype}
+                      for field, f in request.files.items(multi=True)],
+        }
+    data = request.get_json(silent=True)
+    if data is not None:
+        return {'json': sanitize(data)}
+    return None
+
+
+class TrafficRecorder:
+    def __init__(self, app=None):
+        self.directory = None
+        self._pid = None
+        self._file = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.directory = app.config.get('TRAFFIC_RECORD_DIR')
+        if not self.directory:
+            return
+        self.sample_rate = app.config.get('TRAFFIC_RECORD_SAMPLE', 1.0)
+        self.secret = app.config['SECRET_KEY'].encode()
+        app.extensions['traffic_recorder'] = self
+        app.before_request(self._before)
+        app.after_request(self._after)
+
+    def pseudonym(self, user_id):
+        if not user_id:
+            return None
+        return 'u' + hmac.new(self.secret, f'traffic:{user_id}'.encode(), hashlib.sha256).hexdigest()[:12]
+
+    def _before(self):
+        if random.random() < self.sample_rate:
+            g.traffic_started = time.perf_counter()
+
+    def _after(self, response):
+        started = g.pop('traffic_started', None)
+        if started is None:
+            return response
+        try:
+            self.write({
+                'ts': round(time.time(), 4),
+                'method': request.method,
+                'route': request.url_rule.rule if request.url_rule else None,
+                'endpoint': request.endpoint,
+                'path': request.script_root + request.path,  # 带上校区路径前缀
+                'args': [[key, sanitize(value, key)] for key, value in request.args.items(multi=True)],
+                'body': _request_body(),
+                'user': self.pseudonym(session.get('user_id')),
+                'status': response.status_code,
+                'ms': round((time.perf_counter() - started) * 1000, 3),
+                'bytes': response.calculate_content_length(),
+            })
+        except Exception:
+            # 录制失败不影响请求
+            pass
+        return response
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n'
+        with self._lock:
+            # fork 之后每个 worker 写自己的文件
+            if self._pid != os.getpid():
+                os.makedirs(self.directory, exist_ok=True)
+                path = os.path.join(self.directory, f'traffic-{os.getpid()}.ndjson')
+                self._file = open(path, 'a', encoding='utf-8', buffering=1)
+                self._pid = os.getpid()
+            self._file.write(line)
+
+
+traffic_recorder = TrafficRecorder()
+
+
+# ===== 回放 =====
+
+def load_records(paths, limit=None):
+    """按时间归并多个 worker 的录制文件"""
+    def read(path):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    merged = heapq.merge(*[read(p) for p in paths], key=lambda r: r['ts'])
+    records = []
+    for record in merged:
+        records.append(record)
+        if limit and len(records) >= limit:
+            break
+    return records
+
+
+def _identity(user, key):
+    name = user or 'anonymous'
+    return {'username': f'replay_{name}', 'student_id': f'r{name}', 'password': REPLAY_PASSWORD}[key]
+
+
+def restore(value, user, key=None):
+    """把脱敏后的值还原为可发送的请求数据"""
+    if isinstance(value, dict):
+        if '$len' in value:
+            return 'x' * value['$len']
+        if '$identity' in value:
+            return _identity(user, value['$identity'])
+        return {k: restore(v, user, k) for k, v in value.items()}
+    if isinstance(value, list):
+        return [restore(v, user, key) for v in value]
+    return value
+
+
+def encode_multipart(fields, files):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for item in files:
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{item["field"]}"; '
+                     f'filename="{item["filename"]}"\r\nContent-Type: {item["content_type"]}\r\n\r\n'.encode())
+        # 随机内容，避免按内容去重后跳过写盘
+        parts.append(os.urandom(item['size']) + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+def build_request(target, record):
+    url = target.rstrip('/') + quote(record['path'], safe='/')
+    if record.get('args'):
+        url += '?' + urlencode([(key, restore(value, record.get('user'), key))
+                                for key, value in record['args']])
+    body = record.get('body') or {}
+    data = None
+    headers = {'Accept-Encoding': 'identity'}
+    if 'json' in body:
+        data = json.dumps(restore(body['json'], record.get('user'))).encode()
+        headers['Content-Type'] = 'application/json'
+    elif 'form' in body:
+        data, headers['Content-Type'] = encode_multipart(restore(body['form'], record.get('user')),
+                                                          body.get('files', []))
+    return Request(url, data=data, headers=headers, method=record['method'])
+
+
+class Sessions:
+    """每个化名用户一个带cookie的客户端；匿名请求不带cookie"""
+
+    def __init__(self, target):
+        self.target = target
+        self._openers = {}
+        self._lock = threading.Lock()
+
+    def get(self, user):
+        if user is None:
+            return build_opener()
+        with self._lock:
+            opener = self._openers.get(user)
+            if opener is None:
+                opener = self._openers[user] = build_opener(HTTPCookieProcessor(CookieJar()))
+        return opener
+
+    def login_all(self, users):
+        """回放前为每个化名用户注册并登录（不计入统计）"""
+        for user in users:
+            for path in ('/api/register', '/api/login'):
+                record = {'method': 'POST', 'path': path, 'user': user,
+                          'body': {'json': {key: {'$identity': key} for key in IDENTITY_FIELDS}}}
+                try:
+                    self.get(user).open(build_request(self.target, record), timeout=30).read()
+                except (HTTPError, URLError):
+                    pass
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+class RouteStats:
+    def __init__(self):
+        self.latencies = []
+        self.recorded = []
+        self.errors = 0  # HTTP >= 400 或连接失败
+        self.failures = 0  # HTTP 200 但 success=false
+        self.throttled = 0
+
+    def add(self, latency_ms, status, failed, recorded_ms=None):
+        self.latencies.append(latency_ms)
+        if recorded_ms is not None:
+            self.recorded.append(recorded_ms)
+        if status is None or status >= 400:
+            self.errors += 1
+        if status == 429:
+            self.throttled += 1
+        if failed:
+            self.failures += 1
+
+
+def send(sessions, target, record, timeout):
+    """发送一条记录，返回 (耗时ms, 状态码, 是否业务失败)；连接失败时状态码为None"""
+    started = time.perf_counter()
+    status = None
+    failed = False
+    try:
+        req = build_request(target, record)
+        with sessions.get(record.get('user')).open(req, timeout=timeout) as response:
+            status = response.status
+            payload = response.read()
+            if response.headers.get_content_type() == 'application/json':
+                try:
+                    failed = json.loads(payload).get('success') is False
+                except (ValueError, AttributeError):
+                    pass
+    except HTTPError as e:
+        status = e.code
+        e.read()
+    except (URLError, OSError, ValueError, TypeError):
+        pass
+    return (time.perf_counter() - started) * 1000, status, failed
+
+
+def replay(records, target, speed=1.0, concurrency=8, timeout=30, progress=None):
+    """开环回放：按录制的时间间隔/speed 调度，返回 ({路由: RouteStats}, 用时秒, 调度延迟列表)"""
+    sessions = Sessions(target)
+    sessions.login_all(sorted({r['user'] for r in records if r.get('user')}))
+
+    stats = {}
+    lags = []
+    lock = threading.Lock()
+
+    def run(record, due):
+        lag = max(0.0, time.perf_counter() - due) * 1000
+        latency, status, failed = send(sessions, target, record, timeout)
+        key = f'{record["method"]} {record.get("route") or record["path"]}'
+        with lock:
+            stats.setdefault(key, RouteStats()).add(latency, status, failed, record.get('ms'))
+            lags.append(lag)
+
+    first = records[0]['ts'] if records else 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for i, record in enumerate(records):
+            due = started + (record['ts'] - first) / speed
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(run, record, due)
+            if progress and (i + 1) % 1000 == 0:
+                progress(i + 1)
+    return stats, time.perf_counter() - started, lags
+
+
+def format_report(stats, elapsed, recorded_only=False):
+    lines = []
+    total = sum(len(s.latencies) for s in stats.values())
+    header = f'{"路由":<52} {"请求":>7} {"req/s":>8} {"错误%":>6} {"失败%":>6} ' \
+             f'{"p50":>8} {"p90":>8} {"p99":>8} {"max":>8}'
+    if not recorded_only:
+        header += f' {"录制p50":>8}'
+    lines.append(header)
+    for key, s in sorted(stats.items(), key=lambda item: -len(item[1].latencies)):
+        values = sorted(s.recorded if recorded_only else s.latencies)
+        count = len(s.latencies)
+        line = (f'{key[:52]:<52} {count:>7} {count / elapsed if elapsed else 0:>8.1f} '
+                f'{s.errors / count * 100:>6.1f} {s.failures / count * 100:>6.1f} '
+                f'{percentile(values, 50):>8.1f} {percentile(values, 90):>8.1f} '
+                f'{percentile(values, 99):>8.1f} {values[-1] if values else 0:>8.1f}')
+        if not recorded_only:
+            line += f' {percentile(sorted(s.recorded), 50):>8.1f}'
+        lines.append(line)
+    errors = sum(s.errors for s in stats.values())
+    lines.append(f'共 {total} 个请求，用时 {elapsed:.1f}s，{total / elapsed if elapsed else 0:.1f} req/s，'
+                 f'错误率 {errors / total * 100 if total else 0:.2f}%（延迟单位 ms）')
+    return '\n'.join(lines)
+
+
+# ===== 命令行 =====
+
+@click.group('traffic')
+def traffic_cli():
+    """流量录制文件的查看与回放"""
+
+
+@traffic_cli.command('summary')
+@click.argument('paths', nargs=-1, required=True, type=click.Path(exists=True))
+def summary_command(paths):
+    """按路由统计录制文件里的请求量和服务端耗时"""
+    records = load_records(paths)
+    if not records:
+        raise click.ClickException('录制文件为空')
+    stats = {}
+    for record in records:
+        key = f'{record["method"]} {record.get("route") or record["path"]}'
+        stats.setdefault(key, RouteStats()).add(record['ms'], record['status'], False, record['ms'])
+    click.echo(format_report(stats, records[-1]['ts'] - records[0]['ts'], recorded_only=True))
+
+
+@traffic_cli.command('replay')
+@click.argument('paths', nargs=-1, required=True, type=click.Path(exists=True))
+@click.option('--target', default='http://127.0.0.1:8080', show_default=True, help='被压测的实例地址')
+@click.option('--speed', default=1.0, show_default=True, help='回放倍速，2 表示两倍速')
+@click.option('--concurrency', default=16, show_default=True, help='并发客户端数')
+@click.option('--limit', type=int, default=None, help='只回放前N条')
+@click.option('--timeout', default=30.0, show_default=True)
+def replay_command(paths, target, speed, concurrency, limit, timeout):
+    """按录制的节奏（可加速）回放请求，输出各路由的吞吐、错误率和延迟分位数"""
+    records = load_records(paths, limit)
+    if not records:
+        raise click.ClickException('录制文件为空')
+    click.echo(f'回放 {len(records)} 个请求，原始时长 {records[-1]["ts"] - records[0]["ts"]:.1f}s，'
+               f'{speed}x，{concurrency} 并发 -> {target}')
+    stats, elapsed, lags = replay(records, target, speed, concurrency, timeout,
+                                  progress=lambda n: click.echo(f'已发送 {n}'))
+    click.echo(format_report(stats, elapsed))
+    lags.sort()
+    click.echo(f'调度延迟 p50 {percentile(lags, 50):.1f}ms / p99 {percentile(lags, 99):.1f}ms'
+               '（持续增大说明并发客户端不够或服务端已饱和）')
+    if any(s.throttled for s in stats.values()):
+        click.echo('注意：出现了429，目标实例应关闭限流（RATE_LIMIT_ENABLED=0）', err=True)
@@ -0,0 +1,155 @@
+# trending.py - 时间衰减热度：写入时增量维护，读取时只做索引范围扫描
+#
+# 热度 = Σ 权重 × 2^(-(now - t) / 半衰期)。把公共因子 2^(-now/半衰期) 提出来后，
+# 每个事件的贡献变成 权重 × e^(λ(t - epoch))，与读取时间无关，可以直接累加到
+# hot_score 列上，并按该列排序。数值随时间指数增长，定期执行 rescale：
+# 把所有分数乘以同一个因子并推后 epoch，排序不变、数值有界。
+import math
+import time
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import select, update, bindparam
+from sqlalchemy.exc import IntegrityError
+
+from exts import db
+from model import CampusMemory, MemoryLike, MemoryComment, AppState
+
+EPOCH_KEY = 'trending_epoch'
+
+
+def _decay_rate():
+    half_life = current_app.config.get('TRENDING_HALF_LIFE_HOURS', 24) * 3600
+    return math.log(2) / half_life
+
+
+def _weight(kind):
+    return current_app.config.get('TRENDING_WEIGHTS', {}).get(kind, 1.0)
+
+
+def _timestamp(dt):
+    # 数据库里存的都是UTC的naive时间
+    return (dt - datetime(1970, 1, 1)).total_seconds()
+
+
+def _epoch_query(exclusive=False):
+    return select(AppState.value).where(AppState.key == EPOCH_KEY) \
+        .with_for_update(read=not exclusive)
+
+
+def current_epoch():
+    """当前热度基准时间（unix秒），第一次使用时写入数据库。
+    在调用方事务里读取并对该行加共享锁（SQLite 靠库级写锁）：rescale 要等这个事务提交，
+    rescale 之后的事务读到的一定是新基准，增量不会按旧基准加到已缩放的分数上"""
+    value = db.session.execute(_epoch_query()).scalar()
+    if value is None:
+        try:
+            with db.session.begin_nested():
+                value = str(time.time())
+                AppState.set_value(EPOCH_KEY, value)
+        except IntegrityError:
+            # 其他worker同时完成了初始化
+            value = db.session.execute(_epoch_query()).scalar()
+    return float(value)
+
+
+def score_at(kind, when=None, epoch=None):
+    """一个事件（post / like / comment）在当前基准下的贡献值，要和写入在同一个事务里计算"""
+    t = _timestamp(when) if when else time.time()
+    if epoch is None:
+        epoch = current_epoch()
+    return _weight(kind) * math.exp(_decay_rate() * (t - epoch))
+
+
+def bump(memory_id, kind, when=None, sign=1):
+    """在当前事务中给记忆加（或减）一个事件的热度，不读出整行"""
+    delta = sign * score_at(kind, when)
+    CampusMemory.query.filter_by(id=memory_id) \
+        .update({CampusMemory.hot_score: CampusMemory.hot_score + delta}, synchronize_session=False)
+
+
+def rescale(now=None):
+    """把epoch推到当前时间，所有分数乘以同一因子；在一个事务里完成"""
+    now = now or time.time()
+    current_epoch()  # 确保基准行存在
+    # 先对基准行加排他锁：等进行中的增量提交，之后的增量等本事务提交后读新基准
+    old_epoch = float(db.session.execute(_epoch_query(exclusive=True)).scalar())
+    factor = math.exp(_decay_rate() * (old_epoch - now))
+    AppState.set_value(EPOCH_KEY, str(now))
+    db.session.flush()
+
+    db.session.execute(
+        update(CampusMemory.__table__).values(
+            hot_score=CampusMemory.__table__.c.hot_score * factor,
+            updated_at=CampusMemory.__table__.c.updated_at
+        )
+    )
+    db.session.commit()
+    return factor
+
+
+def rebuild(batch_size=1000, memory_ids=None):
+    """按帖子、点赞、评论的时间从头重算热度（导入数据后使用）；不给 memory_ids 时重算全部"""
+    table = CampusMemory.__table__
+    stmt = update(table).where(table.c.id == bindparam('memory_id')) \
+        .values(hot_score=bindparam('score'), updated_at=table.c.updated_at)
+
+    pending = sorted(memory_ids) if memory_ids is not None else None
+    last_id = 0
+    total = 0
+    while True:
+        query = db.session.query(CampusMemory.id, CampusMemory.created_at).order_by(CampusMemory.id)
+        if pending is None:
+            query = query.filter(CampusMemory.id > last_id).limit(batch_size)
+        else:
+            chunk, pending = pending[:batch_size], pending[batch_size:]
+            if not chunk:
+                break
+            query = query.filter(CampusMemory.id.in_(chunk))
+        memories = query.all()
+        if not memories:
+            if pending:
+                continue  # 这一段的记忆都已不存在
+            break
+        ids = [m.id for m in memories]
+        epoch = current_epoch()
+        scores = {m.id: score_at('post', m.created_at, epoch) for m in memories}
+
+        for memory_id, created_at in db.session.query(MemoryLike.memory_id, MemoryLike.created_at) \
+                .filter(MemoryLike.memory_id.in_(ids)):
+            scores[memory_id] += score_at('like', created_at, epoch)
+        for memory_id, created_at in db.session.query(MemoryComment.memory_id, MemoryComment.created_at) \
+                .filter(MemoryComment.memory_id.in_(ids)):
+            scores[memory_id] += score_at('comment', created_at, epoch)
+
+        db.session.execute(stmt, [{'memory_id': k, 'score': v} for k, v in scores.items()])
+        db.session.commit()
+        last_id = ids[-1]
+        total += len(ids)
+    return total
+
+
+# ===== 命令行 =====
+
+@click.group('trending')
+def trending_cli():
+    """热度分数维护"""
+
+
+@trending_cli.command('rescale')
+@with_appcontext
+def rescale_command():
+    """把热度基准推到当前时间，防止数值溢出（建议每天执行）"""
+    factor = rescale()
+    click.echo(f'热度已按因子 {factor:.6g} 缩放')
+
+
+@trending_cli.command('rebuild')
+@click.option('--batch-size', default=1000, show_default=True)
+@with_appcontext
+def rebuild_command(batch_size):
+    """根据点赞、评论记录重算全部热度"""
+    total = rebuild(batch_size)
+    click.echo(f'已重算 {total} 条记忆的热度')
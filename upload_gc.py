@@ -0,0 +1,186 @@
+# upload_gc.py - 孤儿上传文件回收：流式扫描存储中的对象，用布隆过滤器判断是否仍被引用
+#
+# 上传事务回滚、记忆被删除等情况都会在存储里留下没有任何记录引用的文件。
+# 先把全部引用（记忆图片、头像）流式读入布隆过滤器，再按存储键顺序流式扫描对象：
+# 过滤器说"不在"的一定没被引用，超过宽限期即可删除；误判为"在"的只会被保留到下次。
+# 扫描断点按批写入 AppState，中断后下次从断点继续。
+import json
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import select
+
+from bloom import BloomFilter
+from exts import db
+from model import CampusMemory, User, StoredFile, AppState
+from storage import (UPLOAD_URL_PREFIX, get_storage, key_from_url, is_content_key,
+                     reclaim_object, collect_unreferenced)
+
+CURSOR_KEY = 'upload_gc_cursor'
+# 每条记忆最多3张图片，按此估算引用数以确定布隆过滤器大小
+IMAGES_PER_MEMORY = 3
+
+
+def reference_key(url):
+    """图片URL -> 存储键：内容寻址的去掉扩展名，旧版平铺文件就是相对路径"""
+    if not url or not url.startswith(UPLOAD_URL_PREFIX):
+        return None
+    return key_from_url(url) or url[len(UPLOAD_URL_PREFIX):]
+
+
+def iter_references(batch_size=2000):
+    """流式读出所有被引用的存储键（包括未清理的软删除记忆）"""
+    memories = db.session.execute(
+        select(CampusMemory.images).where(CampusMemory.images.isnot(None))
+        .execution_options(yield_per=batch_size))
+    for (images,) in memories:
+        try:
+            urls = json.loads(images)
+        except ValueError:
+            continue
+        for url in urls:
+            key = reference_key(url)
+            if key:
+                yield key
+
+    # 头像现在存为data URL，早期版本可能存过上传路径
+    avatars = db.session.execute(
+        select(User.avatar).where(User.avatar.like(f'{UPLOAD_URL_PREFIX}%'))
+        .execution_options(yield_per=batch_size))
+    for (avatar,) in avatars:
+        key = reference_key(avatar)
+        if key:
+            yield key
+
+
+def build_reference_filter(fp_rate=0.001):
+    memories = db.session.query(db.func.count(CampusMemory.id)).scalar()
+    bloom = BloomFilter(memories * IMAGES_PER_MEMORY + 1024, fp_rate)
+    bloom.update(iter_references())
+    return bloom
+
+
+class GCStats:
+    def __init__(self):
+        self.scanned = 0
+        self.referenced = 0
+        self.young = 0
+        self.pinned = 0  # 没有引用但引用计数>0（计数偏高或上传事务尚未提交）
+        self.removed = 0
+        self.reclaimed = 0
+        self.tmp_removed = 0
+        self.tmp_reclaimed = 0
+        self.rows_removed = 0
+        self.finished = False
+
+    def summary(self):
+        return (f'扫描 {self.scanned} 个对象：仍被引用 {self.referenced}，宽限期内 {self.young}，'
+                f'计数未归零 {self.pinned}，删除 {self.removed}（{format_bytes(self.reclaimed)}）；'
+                f'临时文件 {self.tmp_removed}（{format_bytes(self.tmp_reclaimed)}）；'
+                f'无文件的零引用记录 {self.rows_removed}')
+
+
+def format_bytes(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f'{size:.0f}{unit}' if unit == 'B' else f'{size:.1f}{unit}'
+        size /= 1024
+
+
+def _reclaim_batch(batch, stats, dry_run):
+    """一批候选对象：一次查询取出引用计数，计数为0（或没有记录）的才删除"""
+    digests = [key.rsplit('/', 1)[1] for key, _ in batch if is_content_key(key)]
+    pinned = set()
+    if digests:
+        pinned = {digest for (digest,) in db.session.query(StoredFile.sha256)
+                  .filter(StoredFile.sha256.in_(digests), StoredFile.ref_count > 0)}
+    for key, size in batch:
+        if is_content_key(key) and key.rsplit('/', 1)[1] in pinned:
+            stats.pinned += 1
+        elif dry_run or reclaim_object(key, size):
+            stats.removed += 1
+            stats.reclaimed += size
+
+
+def collect_orphans(grace_seconds=None, batch_size=500, max_files=None, dry_run=False, progress=None):
+    """扫描一轮（或最多 max_files 个对象），返回 GCStats"""
+    if grace_seconds is None:
+        grace_seconds = current_app.config.get('UPLOAD_GC_GRACE_SECONDS', 86400)
+    storage = get_storage()
+    cutoff = datetime.utcnow() - timedelta(seconds=grace_seconds)
+    stats = GCStats()
+
+    bloom = build_reference_filter()
+    cursor = AppState.get_value(CURSOR_KEY) or None
+    db.session.rollback()  # 结束读引用的事务，扫描期间不长时间持有
+
+    def checkpoint(batch, last_key):
+        _reclaim_batch(batch, stats, dry_run)
+        batch.clear()
+        if not dry_run:
+            AppState.set_value(CURSOR_KEY, last_key or '')
+            db.session.commit()
+        if progress:
+            progress(stats)
+
+    batch = []
+    last_key = cursor
+    stats.finished = True
+    for key, size, modified in storage.iter_keys(start_after=cursor):
+        stats.scanned += 1
+        last_key = key
+        if key in bloom:
+            stats.referenced += 1
+        elif modified >= cutoff:
+            stats.young += 1
+        else:
+            batch.append((key, size))
+        if stats.scanned % batch_size == 0:
+            checkpoint(batch, last_key)
+        if max_files and stats.scanned >= max_files:
+            stats.finished = False
+            break
+    # 扫描到末尾时清空断点，下次从头开始
+    checkpoint(batch, None if stats.finished else last_key)
+
+    if not dry_run:
+        stats.tmp_removed, stats.tmp_reclaimed = storage.clean_tmp(cutoff)
+        if stats.finished:
+            # 文件已不存在、引用计数为0的记录
+            stats.rows_removed, reclaimed = collect_unreferenced(grace_seconds)
+            stats.reclaimed += reclaimed
+    return stats
+
+
+# ===== 命令行 =====
+
+@click.group('uploads')
+def uploads_cli():
+    """上传文件维护"""
+
+
+@uploads_cli.command('gc')
+@click.option('--grace-seconds', type=int, default=None, help='只删除超过这么多秒的文件（默认见配置）')
+@click.option('--batch-size', default=500, show_default=True, help='每批处理并记录断点的对象数')
+@click.option('--max-files', type=int, default=None, help='本次最多扫描的对象数，下次从断点继续')
+@click.option('--restart', is_flag=True, help='忽略上次的断点，从头扫描')
+@click.option('--dry-run', is_flag=True, help='只统计，不删除')
+@with_appcontext
+def gc_command(grace_seconds, batch_size, max_files, restart, dry_run):
+    """删除没有被任何记录引用的上传文件，输出释放的空间"""
+    if restart:
+        AppState.set_value(CURSOR_KEY, '')
+        db.session.commit()
+    cursor = AppState.get_value(CURSOR_KEY)
+    if cursor:
+        click.echo(f'从断点 {cursor} 继续')
+
+    started = time.perf_counter()
+    stats = collect_orphans(grace_seconds, batch_size, max_files, dry_run,
+                            progress=lambda s: click.echo(f'已扫描 {s.scanned}，删除 {s.removed}'))
+    click.echo(('（dry-run）' if dry_run else '') + stats.summary())
+    click.echo(f'用时 {time.perf_counter() - started:.1f}s' +
+               ('' if stats.finished else '，未扫描完，再次执行将从断点继续'))